@@ -0,0 +1,93 @@
+"""
+Benchmark parsing of Experimenter API payloads.
+
+Compares the per-experiment converter setup opmon used previously against
+the shared converters of `ExperimentCollection.parse_experiments`.
+
+    python benchmarks/experimenter_parsing.py --repeat 500
+
+By default the recorded payloads in benchmarks/data are used, a recent
+payload can be recorded with:
+
+    curl https://experimenter.services.mozilla.com/api/v6/experiments/ > v6.json
+"""
+
+import argparse
+import datetime as dt
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import cattr
+
+from opmon.experimenter import ExperimentCollection, ExperimentV1, ExperimentV6
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def legacy_v1_from_dict(d: Dict[str, Any]) -> ExperimentV1:
+    """Parse a v1 experiment setting up a new converter, as opmon used to."""
+    converter = cattr.Converter()
+    converter.register_structure_hook(
+        dt.datetime,
+        lambda num, _: ExperimentV1._unix_millis_to_datetime(num),
+    )
+    return converter.structure(d, ExperimentV1)
+
+
+def legacy_v6_from_dict(d: Dict[str, Any]) -> ExperimentV6:
+    """Parse a v6 experiment generating a new converter, as opmon used to."""
+    converter = cattr.GenConverter()
+    converter.register_structure_hook(
+        dt.datetime,
+        lambda num, _: dt.datetime.strptime(num, "%Y-%m-%d"),
+    )
+    converter.register_structure_hook(
+        ExperimentV6,
+        cattr.gen.make_dict_structure_fn(
+            ExperimentV6,
+            converter,
+            _appName=cattr.override(rename="appName"),
+            _appId=cattr.override(rename="appId"),
+        ),  # type: ignore
+    )
+    return converter.structure(d, ExperimentV6)
+
+
+def timed(parse: Callable[[], List[Any]]) -> float:
+    """Return the seconds it takes to parse."""
+    start = time.perf_counter()
+    parse()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--v1", type=Path, default=DATA_DIR / "experimenter_v1.json")
+    parser.add_argument("--v6", type=Path, default=DATA_DIR / "experimenter_v6.json")
+    parser.add_argument(
+        "--repeat", type=int, default=200, help="Number of times the payload is repeated"
+    )
+    args = parser.parse_args()
+
+    v1 = [e for e in json.loads(args.v1.read_text()) if e["type"] != "rapid"] * args.repeat
+    v6 = json.loads(args.v6.read_text()) * args.repeat
+    print(f"Parsing {len(v1)} v1 and {len(v6)} v6 experiments")
+
+    legacy = timed(
+        lambda: ExperimentCollection.parse_experiments(v1, legacy_v1_from_dict)
+        + ExperimentCollection.parse_experiments(v6, legacy_v6_from_dict)
+    )
+    shared = timed(
+        lambda: ExperimentCollection.parse_experiments(v1, ExperimentV1.from_dict)
+        + ExperimentCollection.parse_experiments(v6, ExperimentV6.from_dict)
+    )
+
+    print(f"converter per experiment: {legacy:.3f}s")
+    print(f"shared converters:        {shared:.3f}s ({legacy / shared:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
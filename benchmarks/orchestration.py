@@ -0,0 +1,201 @@
+"""
+Benchmark how opmon orchestrates BigQuery jobs, against a fake BigQuery.
+
+Every scenario runs the stages of synthetic projects with the scheduler of
+`opmon run`, followed by writing the project metadata. Jobs take a simulated
+time drawn from a log-normal distribution and may fail randomly. The
+simulated makespan, the number of jobs and the maximum number of
+concurrently running queries are reported and compared against stored
+baselines:
+
+    python benchmarks/orchestration.py
+    python benchmarks/orchestration.py --update-baselines
+
+Simulated seconds are replayed scaled down by `--time-scale`, so results
+depend less on the machine than wall-clock benchmarks, but a loaded machine
+still inflates the makespan. Latencies and failures of jobs are derived from
+`--seed` and the job itself, so they don't depend on the order in which
+concurrent jobs get started.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import attr
+import pytz
+from google.api_core.exceptions import GoogleAPICallError
+from sql_generation import Scenario, synthetic_config
+
+from opmon.bigquery_client import BigQueryClient
+from opmon.metadata import Metadata
+from opmon.monitoring import Monitoring
+from opmon.scheduler import Scheduler, monitoring_tasks
+from opmon.tests.fake_bigquery import FakeBigQuery, fail_randomly, lognormal
+
+BASELINES_FILE = Path(__file__).parent / "baselines" / "orchestration.json"
+
+SUBMISSION_DATE = datetime(2022, 6, 1, tzinfo=pytz.utc)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class OrchestrationScenario:
+    """Projects run against a fake BigQuery with the given latencies."""
+
+    name: str
+    projects: int
+    parallelism: int
+    metrics: int = 10
+    data_sources: int = 2
+    part_parallelism: int = 4
+    # median and spread of the simulated seconds of a query
+    median_seconds: float = 30.0
+    sigma: float = 0.8
+    failure_rate: float = 0.0
+
+
+SCENARIOS = [
+    OrchestrationScenario(name="serial", projects=20, parallelism=1),
+    OrchestrationScenario(name="parallel", projects=20, parallelism=8),
+    OrchestrationScenario(name="long_tail", projects=20, parallelism=8, sigma=1.5),
+    # enough metrics to be split into multipart queries
+    OrchestrationScenario(
+        name="multipart", projects=8, parallelism=4, metrics=300, data_sources=20
+    ),
+    OrchestrationScenario(name="failures", projects=20, parallelism=8, failure_rate=0.05),
+]
+
+
+def run_scenario(
+    scenario: OrchestrationScenario, time_scale: float, seed: int, verbose: bool = False
+) -> Dict[str, Any]:
+    """Run the projects of a scenario and return statistics of the job timeline."""
+    fake = FakeBigQuery(
+        latency=lognormal(scenario.median_seconds, scenario.sigma, seed=seed),
+        failures=[fail_randomly(scenario.failure_rate, seed=seed)] if scenario.failure_rate else [],
+        time_scale=time_scale,
+    )
+    client = BigQueryClient(
+        project="project",
+        dataset="dataset",
+        client=fake,
+        part_parallelism=scenario.part_parallelism,
+    )
+    config = synthetic_config(
+        Scenario(name=scenario.name, metrics=scenario.metrics, data_sources=scenario.data_sources)
+    )
+    monitorings = [
+        Monitoring("project", "dataset", "derived_dataset", f"project_{i}", config, client=client)
+        for i in range(scenario.projects)
+    ]
+
+    tasks = []
+    for monitoring in monitorings:
+        tasks += monitoring_tasks(monitoring, SUBMISSION_DATE)
+    # projects print their progress
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        results = Scheduler(parallelism=scenario.parallelism).run(tasks)
+        try:
+            Metadata(
+                "project",
+                "dataset",
+                "derived_dataset",
+                [(monitoring.slug, config) for monitoring in monitorings],
+                client=client,
+            ).write()
+            results["metadata"] = True
+        except GoogleAPICallError:
+            # jobs of the metadata can fail like any other job
+            results["metadata"] = False
+
+    summary = fake.summary()
+    return {
+        "simulated_seconds": round(summary["simulated_seconds"], 1),
+        "queries": summary["queries"],
+        "failed_jobs": summary["failed"],
+        "failed_tasks": sum(1 for success in results.values() if not success),
+        "max_concurrency": summary["max_concurrency"],
+    }
+
+
+def compare(
+    name: str, results: Dict[str, Any], baseline: Optional[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Return the regressions of a scenario compared to its baseline."""
+    if baseline is None:
+        return []
+
+    regressions = []
+    for key in ("simulated_seconds", "queries"):
+        if baseline[key] and results[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{name}: {key} increased from {baseline[key]} to {results[key]}")
+    return regressions
+
+
+def main() -> None:
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--baselines", type=Path, default=BASELINES_FILE)
+    parser.add_argument(
+        "--update-baselines", action="store_true", help="Store the results as new baselines"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative increase compared to the baseline that is reported as a regression",
+    )
+    parser.add_argument("--scenario", action="append", help="Only run the given scenarios")
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.005,
+        help="Wall-clock seconds a simulated second of a job takes",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Seed of latencies and failures")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the tasks")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        # injected failures are logged with their tracebacks
+        logging.disable(logging.CRITICAL)
+
+    baselines = json.loads(args.baselines.read_text()) if args.baselines.exists() else {}
+    results = {}
+    regressions: List[str] = []
+
+    for scenario in SCENARIOS:
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+
+        results[scenario.name] = run_scenario(scenario, args.time_scale, args.seed, args.verbose)
+        measurements = results[scenario.name]
+        print(
+            f"{scenario.name:<12} {measurements['simulated_seconds']:>10.1f}s simulated "
+            + f"{measurements['queries']:>6} queries "
+            + f"{measurements['max_concurrency']:>4} concurrent "
+            + f"{measurements['failed_tasks']:>4} failed tasks"
+        )
+        regressions += compare(
+            scenario.name, measurements, baselines.get(scenario.name), args.tolerance
+        )
+
+    if args.update_baselines:
+        args.baselines.parent.mkdir(parents=True, exist_ok=True)
+        args.baselines.write_text(json.dumps({**baselines, **results}, indent=2) + "\n")
+        print(f"Updated baselines in {args.baselines}")
+        return
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
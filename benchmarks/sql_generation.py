@@ -0,0 +1,323 @@
+"""
+Benchmark SQL generation for large synthetic project configurations.
+
+For every scenario, the metrics, statistics and alerts SQL of a project and
+the projects metadata SQL are rendered. Render time, peak memory and the
+size of the generated SQL are reported and compared against stored
+baselines:
+
+    python benchmarks/sql_generation.py
+    python benchmarks/sql_generation.py --update-baselines
+
+The script exits with a non-zero code if the peak memory or the size of the
+SQL of a scenario regressed by more than the allowed tolerance, if a single
+query exceeds the maximum query length BigQuery accepts or if a query newly
+came close to it. Render times depend on the machine and its load, so slower
+renders are only reported as warnings.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest.mock import MagicMock
+
+import attr
+import pytz
+from metric_config_parser.config import ConfigCollection
+from metric_config_parser.monitoring import MonitoringConfiguration, MonitoringSpec
+
+from opmon.config import with_stable_order
+from opmon.metadata import Metadata
+from opmon.monitoring import Monitoring
+
+BASELINES_FILE = Path(__file__).parent / "baselines" / "sql_generation.json"
+
+# maximum length of an unresolved standard SQL query in BigQuery
+MAX_QUERY_LENGTH = 1024 * 1024
+QUERY_LENGTH_WARNING_RATIO = 0.8
+
+# render time differences below this are considered noise
+MIN_SECONDS_INCREASE = 0.01
+
+SUBMISSION_DATE = datetime(2022, 6, 1, tzinfo=pytz.utc)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Scenario:
+    """Shape of a synthetic project configuration."""
+
+    name: str
+    metrics: int
+    data_sources: int
+    dimensions: int = 0
+    threshold_alerts: int = 0
+    avg_diff_alerts: int = 0
+    statistics: List[str] = ["mean", "sum"]
+    xaxis: str = "submission_date"
+    projects: int = 1
+
+
+SCENARIOS = [
+    Scenario(name="small", metrics=10, data_sources=2),
+    Scenario(name="wide", metrics=500, data_sources=20, dimensions=2),
+    Scenario(
+        name="dimensions",
+        metrics=100,
+        data_sources=5,
+        dimensions=10,
+        statistics=["mean", "sum", "percentile"],
+    ),
+    Scenario(
+        name="alerts",
+        metrics=200,
+        data_sources=10,
+        dimensions=3,
+        threshold_alerts=50,
+        avg_diff_alerts=50,
+    ),
+    Scenario(name="build_id", metrics=200, data_sources=10, xaxis="build_id"),
+    Scenario(name="metadata", metrics=50, data_sources=5, dimensions=2, projects=200),
+]
+
+
+def synthetic_config(scenario: Scenario) -> MonitoringConfiguration:
+    """Generate a resolved configuration with the shape of the scenario."""
+    data_sources = {
+        f"source_{i}": {"from_expression": f"`moz-fx-data-shared-prod.telemetry.source_{i}`"}
+        for i in range(scenario.data_sources)
+    }
+    metrics = {
+        f"metric_{i}": {
+            "select_expression": f"SUM(payload.processes.parent.scalars.metric_{i})",
+            "data_source": f"source_{i % scenario.data_sources}",
+            "type": "scalar",
+            "statistics": {statistic: {} for statistic in scenario.statistics},
+        }
+        for i in range(scenario.metrics)
+    }
+    dimensions = {
+        f"dimension_{i}": {
+            "select_expression": f"environment.settings.dimension_{i}",
+            "data_source": "source_0",
+        }
+        for i in range(scenario.dimensions)
+    }
+    alerts: Dict[str, Dict[str, Any]] = {}
+    for i in range(scenario.threshold_alerts):
+        alerts[f"threshold_{i}"] = {
+            "type": "threshold",
+            "metrics": [f"metric_{i % scenario.metrics}"],
+            "min": [0],
+            "max": [100],
+        }
+    for i in range(scenario.avg_diff_alerts):
+        alerts[f"avg_diff_{i}"] = {
+            "type": "avg_diff",
+            "metrics": [f"metric_{i % scenario.metrics}"],
+            "window_size": 7,
+            "max_relative_change": 0.5,
+        }
+
+    spec = MonitoringSpec.from_dict(
+        {
+            "project": {
+                "name": scenario.name,
+                "xaxis": scenario.xaxis,
+                "start_date": "2022-01-01",
+                "metrics": list(metrics),
+                "alerts": list(alerts),
+                "population": {
+                    "data_source": "source_0",
+                    "monitor_entire_population": True,
+                    "dimensions": list(dimensions),
+                },
+            },
+            "data_sources": data_sources,
+            "metrics": metrics,
+            "dimensions": dimensions,
+            "alerts": alerts,
+        }
+    )
+    return with_stable_order(spec.resolve(experiment=None, configs=ConfigCollection()))
+
+
+def _measure(render: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Render SQL and return the time, peak memory and size of the result."""
+    # the first render includes loading and compiling templates
+    sql = render()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queries = sql if isinstance(sql, list) else [sql]
+    return {
+        "seconds": round(min(seconds), 4),
+        "peak_memory_bytes": peak,
+        "sql_bytes": sum(len(query) for query in queries),
+        "max_query_bytes": max(len(query) for query in queries),
+        "queries": len(queries),
+    }
+
+
+def _rendered_metadata(config: MonitoringConfiguration, projects: int) -> Callable[[], str]:
+    metadata = Metadata(
+        "project",
+        "dataset",
+        "derived_dataset",
+        [(f"project_{i}", config) for i in range(projects)],
+    )
+    metadata._client = MagicMock()
+    rendered: List[str] = []
+    metadata._client.execute.side_effect = lambda query, *args, **kwargs: rendered.append(query)
+
+    def render() -> str:
+        rendered.clear()
+        # don't keep the loaded rows of previous repetitions around
+        metadata._client.reset_mock()
+        metadata.write()
+        return rendered[0]
+
+    return render
+
+
+def run_scenario(scenario: Scenario, repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Measure all SQL generation steps of a scenario."""
+    config = synthetic_config(scenario)
+    monitoring = Monitoring("project", "dataset", "derived_dataset", scenario.name, config)
+
+    results = {
+        "metrics": _measure(
+            lambda: monitoring._get_metrics_sql(SUBMISSION_DATE, first_run=True), repeat
+        ),
+        "statistics": _measure(lambda: monitoring._get_statistics_sql(SUBMISSION_DATE), repeat),
+        "metadata": _measure(_rendered_metadata(config, scenario.projects), repeat),
+    }
+    if len(config.alerts) > 0:
+        results["alerts"] = _measure(
+            lambda: monitoring._get_sql_for_alerts(SUBMISSION_DATE), repeat
+        )
+    return results
+
+
+def compare(
+    name: str,
+    results: Dict[str, Dict[str, Any]],
+    baseline: Optional[Dict[str, Dict[str, Any]]],
+    tolerance: float,
+) -> Tuple[List[str], List[str]]:
+    """
+    Return the regressions and warnings of a scenario compared to its baseline.
+
+    Queries exceeding the maximum query length are always regressions, since
+    BigQuery rejects them. Queries close to the limit are regressions, unless
+    the baseline was already close to the limit. Slower renders are warnings.
+    """
+    regressions = []
+    warnings = []
+    limit = MAX_QUERY_LENGTH * QUERY_LENGTH_WARNING_RATIO
+    for step, measurements in results.items():
+        previous = baseline.get(step) if baseline else None
+
+        query_bytes = measurements["max_query_bytes"]
+        if query_bytes > MAX_QUERY_LENGTH:
+            regressions.append(
+                f"{name}/{step}: query of {query_bytes} bytes exceeds "
+                + f"the limit of {MAX_QUERY_LENGTH} bytes"
+            )
+        elif query_bytes > limit:
+            message = (
+                f"{name}/{step}: query of {query_bytes} bytes is close to "
+                + f"the limit of {MAX_QUERY_LENGTH} bytes"
+            )
+            if previous and previous["max_query_bytes"] > limit:
+                warnings.append(message)
+            else:
+                regressions.append(message)
+
+        if previous is None:
+            continue
+
+        for key in ("seconds", "peak_memory_bytes", "sql_bytes"):
+            if key == "seconds" and measurements[key] - previous[key] < MIN_SECONDS_INCREASE:
+                continue
+            if previous[key] and measurements[key] > previous[key] * (1 + tolerance):
+                message = (
+                    f"{name}/{step}: {key} increased from {previous[key]} to {measurements[key]}"
+                )
+                # render times are too noisy to fail the comparison
+                (warnings if key == "seconds" else regressions).append(message)
+    return regressions, warnings
+
+
+def main() -> None:
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--baselines", type=Path, default=BASELINES_FILE)
+    parser.add_argument(
+        "--update-baselines", action="store_true", help="Store the results as new baselines"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Relative increase compared to the baseline that is reported as a regression",
+    )
+    parser.add_argument("--scenario", action="append", help="Only run the given scenarios")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed renders, the fastest is reported"
+    )
+    args = parser.parse_args()
+
+    baselines = json.loads(args.baselines.read_text()) if args.baselines.exists() else {}
+    results = {}
+    regressions: List[str] = []
+    warnings: List[str] = []
+
+    for scenario in SCENARIOS:
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+
+        results[scenario.name] = run_scenario(scenario, args.repeat)
+        for step, measurements in results[scenario.name].items():
+            print(
+                f"{scenario.name:<12} {step:<12} {measurements['seconds']:>8.3f}s "
+                + f"{measurements['peak_memory_bytes'] / 1e6:>8.1f}MB "
+                + f"{measurements['sql_bytes'] / 1e3:>10.1f}kB SQL "
+                + f"in {measurements['queries']} queries"
+            )
+        scenario_regressions, scenario_warnings = compare(
+            scenario.name,
+            results[scenario.name],
+            baselines.get(scenario.name),
+            args.tolerance,
+        )
+        regressions += scenario_regressions
+        warnings += scenario_warnings
+
+    if args.update_baselines:
+        args.baselines.parent.mkdir(parents=True, exist_ok=True)
+        args.baselines.write_text(json.dumps({**baselines, **results}, indent=2) + "\n")
+        print(f"Updated baselines in {args.baselines}")
+        return
+
+    for warning in warnings:
+        print(f"WARNING {warning}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 """BigQuery handler."""
-from typing import Any, Dict, Iterable, List, Optional, Protocol, Union
+import threading
+import uuid
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Tuple, Union
 
 import attr
 from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from opmon.costs import BytesBudget
 
 
 class BeforeExecuteCallback(Protocol):
@@ -23,11 +30,63 @@ class BeforeExecuteCallback(Protocol):
         pass
 
 
+class ExecutionEngine(Protocol):
+    """Executes the generated SQL and manages the resulting tables."""
+
+    before_execute_callback: Optional[BeforeExecuteCallback]
+
+    def execute(
+        self,
+        query: Union[str, List[str]],
+        destination_table: Optional[str] = None,
+        write_disposition: Optional[bigquery.job.WriteDisposition] = None,
+        clustering: Optional[List[str]] = None,
+        time_partitioning: Optional[str] = None,
+        partition_expiration_ms: Optional[int] = None,
+        dataset: Optional[str] = None,
+        join_keys: Optional[List[str]] = None,
+        annotations: Dict[str, Any] = {},
+        partition_range: Optional[Tuple[datetime, datetime]] = None,
+    ) -> None:
+        """Execute a SQL query, see `BigQueryClient.execute`."""
+        ...
+
+    def table_exists(self, table_id: str) -> bool:
+        """Return whether the table with the fully qualified ID exists."""
+        ...
+
+    def delete_table(self, table_id: str) -> None:
+        """Delete the table with the fully qualified ID if it exists."""
+        ...
+
+
+# staging tables are deleted after use, expiration cleans up after failures
+STAGING_TABLE_EXPIRATION_HOURS = 24
+# maximum number of parts of a multipart query that are run at the same time
+DEFAULT_PART_PARALLELISM = 4
+
+# column with a composite key of all join keys that is added to each part of multipart queries
+JOIN_KEY_COLUMN = "_join_key"
+
+
 def sql_table_id(table):
     """Get the standard sql format fully qualified id for a table."""
     return f"{table.project}.{table.dataset_id}.{table.table_id}"
 
 
+def with_join_key(query: str, join_keys: List[str]) -> str:
+    """
+    Add a single column that combines all join keys to the results of a query.
+
+    The key is a JSON string, so rows with NULL join keys still get equal
+    keys and parts can be joined using plain equality.
+    """
+    return (
+        f"SELECT\n  TO_JSON_STRING(STRUCT({', '.join(join_keys)})) AS {JOIN_KEY_COLUMN},\n  *\n"
+        + f"FROM (\n{query}\n)"
+    )
+
+
 @attr.s(auto_attribs=True, slots=True)
 class BigQueryClient:
     """Handler for requests to BigQuery."""
@@ -37,6 +96,9 @@ class BigQueryClient:
     _client: Optional[bigquery.client.Client] = None
 
     before_execute_callback: Optional[BeforeExecuteCallback] = None
+    part_parallelism: int = DEFAULT_PART_PARALLELISM
+    # if set, queries are dry run first and charged to the budget
+    budget: Optional[BytesBudget] = None
 
     @property
     def client(self) -> bigquery.client.Client:
@@ -55,8 +117,19 @@ class BigQueryClient:
         dataset: Optional[str] = None,
         join_keys: Optional[List[str]] = None,
         annotations: Dict[str, Any] = {},
+        partition_range: Optional[Tuple[datetime, datetime]] = None,
     ) -> None:
-        """Execute a SQL query and applies the provided parameters."""
+        """
+        Execute a SQL query and applies the provided parameters.
+
+        If `partition_range` is set, the query results replace all partitions of
+        `destination_table` between the first and the last date (inclusive) instead
+        of a single partition. If the table exists, the results are written to a
+        staging table and replace the existing partitions in a single transaction.
+
+        If the client has a `budget`, every query is dry run before it gets
+        submitted and is charged to the budget of the project in `annotations`.
+        """
         bq_dataset = bigquery.dataset.DatasetReference.from_string(
             dataset if dataset else self.dataset,
             default_project=self.project,
@@ -87,62 +160,251 @@ class BigQueryClient:
             else:
                 kwargs["time_partitioning"] = bigquery.TimePartitioning(field=time_partitioning)
 
-        parts = []
+        # whether results replace existing partitions of a range
+        replace_partitions = False
+        if partition_range:
+            if not destination_table or not time_partitioning or "$" in destination_table:
+                raise ValueError("partition range specified without partitioned destination table")
+
+            # results of multiple partitions are written by a single query,
+            # truncating would drop all other partitions
+            kwargs["write_disposition"] = bigquery.job.WriteDisposition.WRITE_APPEND
+            replace_partitions = self.table_exists(
+                sql_table_id(bq_dataset.table(destination_table))
+            )
+
+        parts: List[bigquery.job.QueryJob] = []
         if isinstance(query, list):
             if not join_keys:
                 raise ValueError("multipart query specified without join keys")
 
-            for idx, part in enumerate(query):
-                config = bigquery.job.QueryJobConfig(default_dataset=bq_dataset, **base_kwargs)
-
-                if callable(self.before_execute_callback):
-                    annotations["part"] = f"part-{idx}"
-                    self.before_execute_callback(part, config, annotations)
-
-                job = self.client.query(part, config)
-                # block on result
-                job.result()
-                parts.append(job)
+            parts = self._execute_parts(
+                [with_join_key(part, join_keys) for part in query],
+                bq_dataset,
+                base_kwargs,
+                annotations,
+            )
 
             # redefine query as a join over the parts, so that things like destination
             # table and schema update options are available for the result
             query = (
-                "SELECT\n  _0.*,\n"
+                f"SELECT\n  _0.* EXCEPT({JOIN_KEY_COLUMN}),\n"
                 + "".join(
-                    f"  _{i}.* EXCEPT({', '.join(join_keys)}),\n"
+                    f"  _{i}.* EXCEPT({', '.join([JOIN_KEY_COLUMN] + join_keys)}),\n"
                     for i, _ in enumerate(parts)
                     if i > 0
                 )
                 + f"FROM\n  `{sql_table_id(parts[0].destination)}` AS _0\n"
                 + "".join(
                     f"JOIN\n  `{sql_table_id(job.destination)}` AS _{i}\n"
-                    + "ON\n  "
-                    + "   AND ".join(
-                        "(\n"
-                        f"    _0.{join_key} = _{i}.{join_key}\n"
-                        f"    OR (_0.{join_key} IS NULL AND _{i}.{join_key} IS NULL)\n"
-                        "  )\n"
-                        for join_key in join_keys
-                    )
+                    + f"ON\n  _0.{JOIN_KEY_COLUMN} = _{i}.{JOIN_KEY_COLUMN}\n"
                     for i, job in enumerate(parts)
                     if i > 0
                 )
             )
 
+        # table the results replacing existing partitions are written to first
+        staging: Optional[bigquery.TableReference] = None
         try:
+            if replace_partitions and destination_table:
+                # the partitions are replaced by the staged results in a single transaction
+                staging = self._create_staging_table(bq_dataset.table(destination_table))
+                kwargs = {
+                    **base_kwargs,
+                    "destination": staging,
+                    "write_disposition": bigquery.job.WriteDisposition.WRITE_TRUNCATE,
+                }
             config = bigquery.job.QueryJobConfig(default_dataset=bq_dataset, **kwargs)
+            if len(parts) > 0:
+                annotations = {**annotations, "part": "joined"}
+            self._run_query(query, config, annotations)
 
-            if callable(self.before_execute_callback):
-                if len(parts) > 0:
-                    annotations["part"] = "joined"
-                self.before_execute_callback(query, config, annotations)
+            if staging and destination_table and time_partitioning and partition_range:
+                self._replace_partitions(
+                    bq_dataset.table(destination_table),
+                    staging,
+                    time_partitioning,
+                    *partition_range,
+                    annotations={**annotations, "part": "replace"},
+                )
+        finally:
+            for job in parts:
+                self.client.delete_table(job.destination, not_found_ok=True)
+            if staging:
+                self.client.delete_table(staging, not_found_ok=True)
 
-            job = self.client.query(query, config)
+    def _execute_parts(
+        self,
+        queries: List[str],
+        bq_dataset: bigquery.DatasetReference,
+        job_kwargs: Dict[str, Any],
+        annotations: Dict[str, Any],
+    ) -> List[bigquery.job.QueryJob]:
+        """
+        Run the parts of a multipart query concurrently and return their finished jobs.
+
+        If a part fails, the remaining parts are cancelled and the results of all
+        parts are deleted.
+        """
+        jobs: List[Optional[bigquery.job.QueryJob]] = [None] * len(queries)
+        cancelled = threading.Event()
+        lock = threading.Lock()
+
+        def run_part(idx: int) -> None:
+            config = bigquery.job.QueryJobConfig(default_dataset=bq_dataset, **job_kwargs)
+            part_annotations = {**annotations, "part": f"part-{idx}"}
+            estimate = self._charge(queries[idx], config, part_annotations)
+
+            # parts are only submitted while holding the lock, so that no part can
+            # get started after remaining parts have been cancelled
+            with lock:
+                if cancelled.is_set():
+                    self._settle(None, part_annotations, estimate)
+                    return
+
+                if callable(self.before_execute_callback):
+                    self.before_execute_callback(queries[idx], config, part_annotations)
+
+                job = self.client.query(queries[idx], config)
+                jobs[idx] = job
+
+            try:
+                # block on result
+                job.result()
+            finally:
+                self._settle(job, part_annotations, estimate)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.part_parallelism)) as executor:
+            futures = [executor.submit(run_part, idx) for idx in range(len(queries))]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+
+            failed = next((f for f in done if f.exception() is not None), None)
+            if failed is not None:
+                with lock:
+                    cancelled.set()
+                    started = [job for job in jobs if job is not None]
+                for future in futures:
+                    future.cancel()
+                for running_job in started:
+                    if not running_job.done():
+                        running_job.cancel()
+
+        if failed is not None:
+            for started_job in started:
+                if started_job.destination is not None:
+                    self.client.delete_table(started_job.destination, not_found_ok=True)
+            raise failed.exception()  # type: ignore
+
+        return [finished_job for finished_job in jobs if finished_job is not None]
+
+    def _run_query(
+        self, query: str, config: bigquery.job.QueryJobConfig, annotations: Dict[str, Any]
+    ) -> bigquery.job.QueryJob:
+        """Run a query charged to the budget and block until it has finished."""
+        if callable(self.before_execute_callback):
+            self.before_execute_callback(query, config, annotations)
+
+        estimate = self._charge(query, config, annotations)
+        job = self.client.query(query, config)
+        try:
             # block on result
             job.result()
         finally:
-            for job in parts:
-                self.client.delete_table(job.destination)
+            self._settle(job, annotations, estimate)
+        return job
+
+    def _charge(
+        self, query: str, config: bigquery.job.QueryJobConfig, annotations: Dict[str, Any]
+    ) -> int:
+        """
+        Dry run a query and charge its estimated bytes to the budget.
+
+        Caps the bytes the query may bill to the remaining budget and returns
+        the estimate, which is 0 if the client has no budget.
+        """
+        if self.budget is None:
+            return 0
+
+        dry_run_config = bigquery.job.QueryJobConfig(
+            dry_run=True, use_query_cache=False, default_dataset=config.default_dataset
+        )
+        estimate = self.client.query(query, dry_run_config).total_bytes_processed or 0
+        config.maximum_bytes_billed = self.budget.charge(annotations.get("slug"), estimate)
+        return estimate
+
+    def _settle(
+        self,
+        job: Optional[bigquery.job.QueryJob],
+        annotations: Dict[str, Any],
+        estimate: int,
+    ) -> None:
+        """Replace the estimate a query was charged with by the bytes it billed."""
+        if self.budget is None:
+            return
+
+        billed = (job.total_bytes_billed if job is not None and job.done() else None) or 0
+        self.budget.settle(annotations.get("slug"), estimate, billed)
+
+    def table_exists(self, table_id: str) -> bool:
+        """Return whether the table with the fully qualified ID exists."""
+        try:
+            self.client.get_table(table_id)
+        except NotFound:
+            return False
+        return True
+
+    def delete_table(self, table_id: str) -> None:
+        """Delete the table with the fully qualified ID if it exists."""
+        self.client.delete_table(table_id, not_found_ok=True)
+
+    def _create_staging_table(self, table: bigquery.TableReference) -> bigquery.TableReference:
+        """Create an empty table for results that expires if it doesn't get deleted."""
+        staging_id = f"{sql_table_id(table)}_staging_{uuid.uuid4().hex[:12]}"
+        staging = bigquery.Table(staging_id)
+        staging.expires = datetime.now(timezone.utc) + timedelta(
+            hours=STAGING_TABLE_EXPIRATION_HOURS
+        )
+        return self.client.create_table(staging).reference
+
+    def _replace_partitions(
+        self,
+        table: bigquery.TableReference,
+        staging: bigquery.TableReference,
+        partition_field: str,
+        start_date: datetime,
+        end_date: datetime,
+        annotations: Dict[str, Any] = {},
+    ) -> None:
+        """
+        Replace the partitions between `start_date` and `end_date` with the staged results.
+
+        The existing rows are deleted and the results are inserted in a single
+        transaction, so partitions are never missing or incomplete for readers
+        and nothing is deleted if inserting fails. Like any other query, the
+        transaction is charged to the budget of the project in `annotations`.
+        """
+        destination = self.client.get_table(table)
+        results = self.client.get_table(staging)
+
+        # columns added to the results are added to the destination table first
+        existing = {field.name for field in destination.schema}
+        added = [field for field in results.schema if field.name not in existing]
+        if added:
+            destination.schema = list(destination.schema) + added
+            self.client.update_table(destination, ["schema"])
+
+        columns = ", ".join(f"`{field.name}`" for field in results.schema)
+        self._run_query(
+            "BEGIN TRANSACTION;\n"
+            + f"DELETE FROM `{sql_table_id(table)}` "
+            + f"WHERE {partition_field} BETWEEN DATE('{start_date:%Y-%m-%d}') "
+            + f"AND DATE('{end_date:%Y-%m-%d}');\n"
+            + f"INSERT INTO `{sql_table_id(table)}` ({columns})\n"
+            + f"SELECT {columns} FROM `{sql_table_id(staging)}`;\n"
+            + "COMMIT TRANSACTION;",
+            bigquery.job.QueryJobConfig(),
+            annotations,
+        )
 
     def load_table_from_json(
         self, results: Iterable[Dict], table: str, job_config: bigquery.LoadJobConfig
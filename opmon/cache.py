@@ -0,0 +1,270 @@
+"""Persistent on-disk caches shared between opmon invocations."""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import attr
+import pytz
+from metric_config_parser.config import ConfigCollection
+from metric_config_parser.monitoring import MonitoringConfiguration
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("OPMON_CACHE_DIR", Path.home() / ".cache" / "opmon"))
+CACHE_VERSION = "2"
+
+
+def _package_versions() -> str:
+    """Return the versions of packages that affect cached results."""
+    try:
+        from importlib.metadata import version
+
+        return f"{version('mozilla-opmon')}:{version('mozilla-metric-config-parser')}"
+    except Exception:
+        return "unknown"
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Write data to a file without other processes ever seeing a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+@attr.s(auto_attribs=True)
+class ResolvedConfigCache:
+    """
+    On-disk cache of resolved monitoring configurations.
+
+    Entries are keyed by a hash of all inputs to the resolution, so changes to
+    any of the inputs result in a new entry. Entries that have not been used
+    for `max_age` and the least recently used entries exceeding `max_entries`
+    are evicted automatically.
+    """
+
+    directory: Optional[Path] = DEFAULT_CACHE_DIR / "configs"
+    max_entries: int = 5000
+    max_age: timedelta = timedelta(days=14)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+    _writes: int = attr.ib(default=0, init=False, repr=False)
+    # keys of config collections, keyed by their id
+    _collections: Dict[int, Tuple[ConfigCollection, str]] = attr.ib(
+        factory=dict, init=False, repr=False
+    )
+
+    @staticmethod
+    def key(inputs: Iterable[Any]) -> str:
+        """Return the cache key for the inputs of a config resolution."""
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{_package_versions()}".encode("utf-8"))
+        for value in inputs:
+            digest.update(b"\0")
+            digest.update(repr(value).encode("utf-8"))
+        return digest.hexdigest()
+
+    def collection_key(self, configs: ConfigCollection) -> str:
+        """
+        Return the key of everything in a config collection a resolution may read from.
+
+        Resolving a spec looks up metric, data source and segment definitions,
+        defaults and functions in the collection, so all of them are part of the
+        key. Keys are computed once per collection, collections are not expected
+        to change once loaded.
+        """
+        with self._lock:
+            cached = self._collections.get(id(configs))
+        if cached is not None and cached[0] is configs:
+            return cached[1]
+
+        key = self.key([configs.definitions, configs.defaults, configs.functions])
+        with self._lock:
+            self._collections[id(configs)] = (configs, key)
+        return key
+
+    def _path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{key}.pickle"
+
+    def get(self, key: str) -> Optional[MonitoringConfiguration]:
+        """Return the cached config for the key, if it exists."""
+        if self.directory is None:
+            return None
+
+        path = self._path(key)
+        try:
+            config = pickle.loads(path.read_bytes())
+            # mark entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+        if not isinstance(config, MonitoringConfiguration):
+            return None
+        return config
+
+    def put(self, key: str, config: MonitoringConfiguration) -> None:
+        """Store a resolved config."""
+        if self.directory is None:
+            return
+
+        try:
+            _write_atomic(self._path(key), pickle.dumps(config))
+        except Exception as e:
+            logger.warning(f"Unable to cache resolved config: {e}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes == 1
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove expired entries and the least recently used entries above the limit."""
+        if self.directory is None or not self.directory.exists():
+            return
+
+        entries = []
+        now = time.time()
+        for path in self.directory.glob("*.pickle"):
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+            if now - mtime > self.max_age.total_seconds():
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((mtime, path))
+
+        # keep the most recently used entries
+        entries.sort(reverse=True)
+        limit = self.max_entries
+        for _, path in entries[limit:]:
+            path.unlink(missing_ok=True)
+
+    def get_or_resolve(
+        self, inputs: Iterable[Any], resolve: Callable[[], MonitoringConfiguration]
+    ) -> MonitoringConfiguration:
+        """Return the cached config for the inputs or resolve and cache it."""
+        key = self.key(inputs)
+        config = self.get(key)
+        if config is None:
+            config = resolve()
+            self.put(key, config)
+        return config
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class CachedResponse:
+    """A cached HTTP response body with the headers required to revalidate it."""
+
+    url: str
+    body: str
+    fetched_at: datetime
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def is_fresh(self, max_age: timedelta) -> bool:
+        """Return whether the response can be used without revalidating it."""
+        return datetime.now(pytz.utc) - self.fetched_at < max_age
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Return the headers for a conditional request revalidating this response."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@attr.s(auto_attribs=True)
+class ResponseCache:
+    """
+    On-disk cache of HTTP responses.
+
+    Responses younger than `max_age` are used as is. Older responses are
+    revalidated using their ETag and Last-Modified headers, and are used as a
+    fallback if the server cannot be reached.
+    """
+
+    directory: Optional[Path] = DEFAULT_CACHE_DIR / "responses"
+    max_age: timedelta = timedelta(minutes=5)
+
+    def _path(self, url: str) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """Return the cached response for the URL, if it exists."""
+        if self.directory is None:
+            return None
+
+        path = self._path(url)
+        try:
+            entry = json.loads(path.read_text())
+            return CachedResponse(
+                url=entry["url"],
+                body=entry["body"],
+                fetched_at=datetime.fromisoformat(entry["fetched_at"]),
+                etag=entry.get("etag"),
+                last_modified=entry.get("last_modified"),
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+    def put(self, response: CachedResponse) -> None:
+        """Store a response."""
+        if self.directory is None:
+            return
+
+        entry = {
+            "url": response.url,
+            "body": response.body,
+            "fetched_at": response.fetched_at.isoformat(),
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+        }
+        try:
+            _write_atomic(self._path(response.url), json.dumps(entry).encode("utf-8"))
+        except Exception as e:
+            logger.warning(f"Unable to cache response for {response.url}: {e}")
+
+
+ConfigCache = ResolvedConfigCache()
+HttpCache = ResponseCache()
+
+
+def configure(directory: Optional[Path], max_age: Optional[timedelta] = None) -> None:
+    """
+    Set the directory of the on-disk caches; `None` disables caching.
+
+    `max_age` is the time for which HTTP responses are used without revalidating them.
+    """
+    ConfigCache.directory = directory / "configs" if directory else None
+    HttpCache.directory = directory / "responses" if directory else None
+    if max_age is not None:
+        HttpCache.max_age = max_age
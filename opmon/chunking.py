@@ -0,0 +1,106 @@
+"""Plan how the metrics of a project are split into separate metric queries.
+
+Every metric query repeats the population and scans each data source it
+references, so metrics of a data source are kept in the same query as long
+as the query stays within a complexity budget. Sources that exceed the
+budget on their own are split into evenly sized parts. The remaining parts
+are packed into as few queries as possible.
+"""
+
+import math
+import re
+from typing import Dict, List
+
+import attr
+from metric_config_parser.metric import Metric
+
+# Estimated complexity a single metric query can have.
+MAX_METRIC_QUERY_COST = 60.0
+
+# Added to the cost of a query for every data source it scans and joins.
+DATA_SOURCE_COST = 5.0
+
+# Expressions that make a metric more expensive to compute than a plain aggregate.
+_EXPENSIVE_EXPRESSIONS = re.compile(r"\b(SELECT|UNNEST|JOIN|OVER|mozfun\.)", re.IGNORECASE)
+
+
+def metric_cost(metric: Metric) -> float:
+    """Estimate the cost of computing a metric in the metric query."""
+    cost = 1.0 + len(metric.select_expression) / 500
+    cost += len(_EXPENSIVE_EXPRESSIONS.findall(metric.select_expression))
+    if metric.type == "histogram":
+        cost += 1.0
+    return cost
+
+
+@attr.s(auto_attribs=True)
+class _Chunk:
+    metrics_per_dataset: Dict[str, List[Metric]] = attr.Factory(dict)
+    cost: float = 0.0
+
+    def cost_with(self, data_source: str, cost: float) -> float:
+        if data_source in self.metrics_per_dataset:
+            return self.cost + cost
+        return self.cost + cost + DATA_SOURCE_COST
+
+    def add(self, data_source: str, metrics: List[Metric], cost: float) -> None:
+        self.cost = self.cost_with(data_source, cost)
+        self.metrics_per_dataset.setdefault(data_source, []).extend(metrics)
+
+
+def _split(metrics: List[Metric], parts: int) -> List[List[Metric]]:
+    """Split metrics into consecutive parts of roughly equal cost."""
+    target = sum(metric_cost(metric) for metric in metrics) / parts
+    split: List[List[Metric]] = [[]]
+    cost = 0.0
+    for metric in metrics:
+        if split[-1] and cost + metric_cost(metric) > target and len(split) < parts:
+            split.append([])
+            cost = 0.0
+        split[-1].append(metric)
+        cost += metric_cost(metric)
+    return split
+
+
+def plan_chunks(
+    metrics_per_dataset: Dict[str, List[Metric]],
+    max_cost: float = MAX_METRIC_QUERY_COST,
+) -> List[Dict[str, List[Metric]]]:
+    """
+    Return the metrics per data source of each metric query.
+
+    Data sources are only split if their metrics exceed `max_cost` on their own.
+    """
+    parts = []
+    for data_source, metrics in metrics_per_dataset.items():
+        if len(metrics) == 0:
+            continue
+        cost = sum(metric_cost(metric) for metric in metrics)
+        num_parts = max(1, math.ceil((cost + DATA_SOURCE_COST) / max_cost))
+        for part in _split(metrics, num_parts):
+            parts.append((data_source, part, sum(metric_cost(metric) for metric in part)))
+
+    # first fit decreasing, starting with the most expensive parts
+    chunks: List[_Chunk] = []
+    for data_source, metrics, cost in sorted(parts, key=lambda part: part[2], reverse=True):
+        for chunk in chunks:
+            if chunk.cost_with(data_source, cost) <= max_cost:
+                chunk.add(data_source, metrics, cost)
+                break
+        else:
+            chunk = _Chunk()
+            chunk.add(data_source, metrics, cost)
+            chunks.append(chunk)
+
+    if len(chunks) == 0:
+        return [{}]
+
+    # keep the data source order of the configuration within each query
+    order = list(metrics_per_dataset)
+    return [
+        {
+            data_source: chunk.metrics_per_dataset[data_source]
+            for data_source in sorted(chunk.metrics_per_dataset, key=order.index)
+        }
+        for chunk in chunks
+    ]
@@ -3,27 +3,60 @@ import copy
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time, timedelta
 from functools import partial
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from typing import Iterable, Optional, Tuple
+from typing import Iterable, List, Optional
 
 import click
 import pytz
 from click_option_group import RequiredAnyOptionGroup, optgroup
 from google.cloud import bigquery
 from metric_config_parser.config import DEFAULTS_DIR, DEFINITIONS_DIR, entity_from_path
+from metric_config_parser.definition import DefinitionSpecSub
 from metric_config_parser.monitoring import MonitoringConfiguration, MonitoringSpec
 
-from opmon.bigquery_client import BeforeExecuteCallback
-from opmon.config import DEFAULT_CONFIG_REPO, METRIC_HUB_REPO, ConfigLoader, validate
-from opmon.dryrun import DryRunFailedError
-from opmon.experimenter import ExperimentCollection
+from opmon import cache, templates
+from opmon.bigquery_client import (
+    DEFAULT_PART_PARALLELISM,
+    BeforeExecuteCallback,
+    BigQueryClient,
+)
+from opmon.cache import DEFAULT_CACHE_DIR, ConfigCache, HttpCache
+from opmon.config import (
+    DEFAULT_CONFIG_REPO,
+    METRIC_HUB_REPO,
+    ConfigLoader,
+    validate,
+    with_stable_order,
+)
+from opmon.costs import (
+    BytesBudget,
+    CostHistory,
+    format_bytes,
+    parse_bytes,
+    relative_costs,
+    unusual_costs,
+)
+from opmon.dryrun import DryRunFailedError, DryRunFailures
+from opmon.enrollment_index import plan_enrollment_indexes
+from opmon.experimenter import Experiment, ExperimentCollection
+from opmon.local_engine import DuckDBEngine
 from opmon.logging import LogConfiguration
 from opmon.metadata import Metadata
 from opmon.monitoring import SCHEMA_VERSIONS, Monitoring
+from opmon.scheduler import (
+    Scheduler,
+    backfill_tasks,
+    enrollment_index_task,
+    monitoring_tasks,
+    parse_stage_parallelism,
+    shared_scan_task,
+)
+from opmon.shared_scans import plan_shared_scans
 from opmon.utils import bq_normalize_name
+from opmon.views import ViewSync
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +79,21 @@ class ClickDate(click.ParamType):
         return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=pytz.utc)
 
 
+class ClickBytes(click.ParamType):
+    """Converter for click parameters with a number of bytes, e.g. 10TB."""
+
+    name = "bytes"
+
+    def convert(self, value, param, ctx):
+        """Convert a string to a number of bytes."""
+        if isinstance(value, int):
+            return value
+        try:
+            return parse_bytes(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
 project_id_option = click.option(
     "--project_id",
     "--project-id",
@@ -79,6 +127,15 @@ parallelism_option = click.option(
     "--parallelism", "-p", help="Number of processes to run monitoring analysis", default=8
 )
 
+part_parallelism_option = click.option(
+    "--part_parallelism",
+    "--part-parallelism",
+    help="Number of parts of a multipart metrics query of a project to run concurrently",
+    type=int,
+    default=DEFAULT_PART_PARALLELISM,
+    show_default=True,
+)
+
 sql_output_dir_option = click.option(
     "--sql-output-dir",
     "--sql_output_dir",
@@ -122,6 +179,26 @@ private_config_repos_option = click.option(
     "--log_table_id", "--log-table-id", default="opmon_logs_v1", help="Table to write logs to"
 )
 @click.option("--log_to_bigquery", "--log-to-bigquery", is_flag=True, default=False)
+@click.option(
+    "--cache_dir",
+    "--cache-dir",
+    envvar="OPMON_CACHE_DIR",
+    type=click.Path(file_okay=False),
+    default=str(DEFAULT_CACHE_DIR),
+    show_default=True,
+    help="Directory for caching data between invocations",
+)
+@click.option(
+    "--no_cache", "--no-cache", is_flag=True, default=False, help="Disable the on-disk cache"
+)
+@click.option(
+    "--cache_max_age",
+    "--cache-max-age",
+    type=int,
+    default=300,
+    show_default=True,
+    help="Seconds for which cached Experimenter responses are used without revalidating them",
+)
 @click.pass_context
 def cli(
     ctx,
@@ -129,8 +206,12 @@ def cli(
     log_dataset_id,
     log_table_id,
     log_to_bigquery,
+    cache_dir,
+    no_cache,
+    cache_max_age,
 ):
     """Initialize CLI."""
+    cache.configure(None if no_cache else Path(cache_dir), timedelta(seconds=cache_max_age))
     log_config = LogConfiguration(
         log_project_id,
         log_dataset_id,
@@ -155,6 +236,52 @@ def cli(
 )
 @slug_option
 @parallelism_option
+@part_parallelism_option
+@click.option(
+    "--stage_parallelism",
+    "--stage-parallelism",
+    help="Maximum number of concurrently running tasks of a stage, e.g. metrics=4. "
+    + "Stages without a limit use --parallelism.",
+    multiple=True,
+    metavar="STAGE=LIMIT",
+)
+@click.option(
+    "--shared_scans",
+    "--shared-scans",
+    is_flag=True,
+    default=False,
+    help="Scan data sources used by multiple projects aggregated by submission date only once",
+)
+@click.option(
+    "--enrollment_index",
+    "--enrollment-index",
+    is_flag=True,
+    default=False,
+    help="Read populations of projects from an index of enrollments built once per "
+    + "population data source and channel",
+)
+@click.option(
+    "--estimate_costs",
+    "--estimate-costs",
+    is_flag=True,
+    default=False,
+    help="Dry run every query to record the bytes it processes, start projects that usually "
+    + "process the most bytes first and report projects processing more bytes than usual",
+)
+@click.option(
+    "--max_bytes_per_project",
+    "--max-bytes-per-project",
+    type=ClickBytes(),
+    help="Maximum bytes the queries of a single project may process, e.g. 10TB. "
+    + "Implies --estimate-costs.",
+)
+@click.option(
+    "--max_bytes_per_run",
+    "--max-bytes-per-run",
+    type=ClickBytes(),
+    help="Maximum bytes the queries of all projects may process, e.g. 500TB. "
+    + "Implies --estimate-costs.",
+)
 @config_repos_option
 @private_config_repos_option
 @sql_output_dir_option
@@ -165,16 +292,28 @@ def run(
     date,
     slug,
     parallelism,
+    part_parallelism,
+    stage_parallelism,
+    shared_scans,
+    enrollment_index,
+    estimate_costs,
+    max_bytes_per_project,
+    max_bytes_per_run,
     config_repos,
     private_config_repos,
     sql_output_dir,
 ):
     """Execute the monitoring ETL for a specific date."""
+    try:
+        stage_limits = parse_stage_parallelism(parallelism, stage_parallelism)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--stage-parallelism")
+
     ConfigLoader.with_configs_from(config_repos).with_configs_from(
         private_config_repos, is_private=True
     )
     platform_definitions = ConfigLoader.configs.definitions
-    experiments = ExperimentCollection.from_experimenter().ever_launched()
+    experiments = ExperimentCollection.from_experimenter(cache=HttpCache).ever_launched()
 
     # get and resolve configs for projects
     configs = []
@@ -199,26 +338,24 @@ def run(
             continue
 
         # resolve config by applying platform and custom config specs
-        spec = MonitoringSpec.from_definition_spec(copy.deepcopy(platform_definitions))
-
+        specs = []
         if not external_config.spec.project.skip_default_metrics:
-            platform_defaults = ConfigLoader.configs.get_platform_defaults(platform)
-            if platform_defaults is not None:
-                spec.merge(platform_defaults)
+            specs.append(ConfigLoader.configs.get_platform_defaults(platform))
 
             if experiment and experiment.is_rollout:
-                platform_defaults = ConfigLoader.configs.get_platform_defaults("rollout")
-                if platform_defaults is not None:
-                    spec.merge(platform_defaults)
-        spec.merge(external_config.spec)
+                specs.append(ConfigLoader.configs.get_platform_defaults("rollout"))
+        specs.append(external_config.spec)
 
-        configs.append((external_config.slug, spec.resolve(experiment, ConfigLoader.configs)))
+        configs.append(
+            (external_config.slug, _resolve_config(platform_definitions, specs, experiment))
+        )
 
     # prepare rollouts that do not have an external config
     if slug is None:
+        configured_slugs = {config_slug for config_slug, _ in configs}
         rollouts = experiments.rollouts().experiments
         for rollout in rollouts:
-            if not any([c[0] == rollout.normandy_slug for c in configs]):
+            if rollout.normandy_slug not in configured_slugs:
                 platform = rollout.app_name or DEFAULT_PLATFORM
                 platform_definitions = ConfigLoader.configs.get_platform_definitions(platform)
 
@@ -230,18 +367,15 @@ def run(
                     )
                     continue
 
-                # resolve config by applying platform and custom config specs
-                spec = MonitoringSpec.from_definition_spec(copy.deepcopy(platform_definitions))
-
-                platform_defaults = ConfigLoader.configs.get_platform_defaults(platform)
-                if platform_defaults is not None:
-                    spec.merge(platform_defaults)
-
-                platform_defaults = ConfigLoader.configs.get_platform_defaults("rollout")
-                if platform_defaults is not None:
-                    spec.merge(platform_defaults)
-
-                configs.append((rollout.normandy_slug, spec.resolve(rollout, ConfigLoader.configs)))
+                # resolve config by applying platform and rollout defaults
+                specs = [
+                    ConfigLoader.configs.get_platform_defaults(platform),
+                    ConfigLoader.configs.get_platform_defaults("rollout"),
+                ]
+                configs.append(
+                    (rollout.normandy_slug, _resolve_config(platform_definitions, specs, rollout))
+                )
+                configured_slugs.add(rollout.normandy_slug)
 
     # filter out projects that have finished or not started
     prior_date = date - timedelta(days=1)
@@ -253,45 +387,102 @@ def run(
         and not cfg.project.skip
     ]
 
-    run = partial(
-        _run,
-        project_id,
-        dataset_id,
-        derived_dataset_id,
-        date,
+    # queries are dry run and charged to a budget shared by all projects
+    budget = None
+    cost_history = CostHistory(project_id, derived_dataset_id)
+    usual_bytes = {}
+    if estimate_costs or max_bytes_per_project or max_bytes_per_run:
+        budget = BytesBudget(project_bytes=max_bytes_per_project, run_bytes=max_bytes_per_run)
+        usual_bytes = cost_history.usual_bytes(date)
+    cost_factors = relative_costs(usual_bytes)
+
+    # client shared by all projects, views are only re-created if their definitions changed
+    client = BigQueryClient(
+        project=project_id,
+        dataset=dataset_id,
         before_execute_callback=partial(_before_execute_callback, sql_output_dir),
+        budget=budget,
     )
+    views = ViewSync(client)
+
+    monitorings = [
+        Monitoring(
+            project=project_id,
+            dataset=dataset_id,
+            derived_dataset=derived_dataset_id,
+            slug=config[0],
+            config=config[1],
+            before_execute_callback=partial(_before_execute_callback, sql_output_dir),
+            part_parallelism=part_parallelism,
+            budget=budget,
+            views=views,
+        )
+        for config in configs
+    ]
 
-    success = False
-    with ThreadPool(parallelism) as pool:
-        results = pool.map(run, configs)
-        success = all(results)
+    # tables shared by multiple projects are computed once before computing their metrics
+    shared_tables = {}
+    if enrollment_index:
+        for index in plan_enrollment_indexes(monitorings, date):
+            shared_tables[index.table_id] = enrollment_index_task(index, client)
+    if shared_scans:
+        # scans are restricted to the populations, which may be read from the indexes
+        for scan in plan_shared_scans(monitorings, date):
+            shared_tables[scan.table_id] = shared_scan_task(scan, client, shared_tables)
+
+    # split each project into stages and schedule them across all projects
+    tasks = list(shared_tables.values())
+    for monitoring in monitorings:
+        tasks += monitoring_tasks(
+            monitoring, date, shared_tables, cost_factors.get(monitoring.slug, 1.0)
+        )
+
+    scheduler = Scheduler(parallelism=parallelism, stage_parallelism=stage_limits)
+    results = scheduler.run(tasks)
+    success = all(results.values())
+
+    if budget is not None:
+        for cost_slug, billed, usual in unusual_costs(budget.billed(), usual_bytes):
+            logger.warning(
+                f"{cost_slug} processed {format_bytes(billed)}, "
+                + f"usually {format_bytes(usual)}",
+                extra={"experiment": cost_slug},
+            )
+        cost_history.write(date, budget)
 
     if len(configs) > 0:
-        Metadata(project_id, dataset_id, derived_dataset_id, configs).write()
+        Metadata(project_id, dataset_id, derived_dataset_id, configs, views=views).write()
 
     sys.exit(0 if success else 1)
 
 
-def _run(
-    project_id: str,
-    dataset_id: str,
-    derived_dataset_id: str,
-    submission_date: datetime,
-    config: Tuple[str, MonitoringConfiguration],
-    before_execute_callback: Optional[BeforeExecuteCallback] = None,
-):
-    """Execute by parallel processes."""
-    monitoring = Monitoring(
-        project=project_id,
-        dataset=dataset_id,
-        derived_dataset=derived_dataset_id,
-        slug=config[0],
-        config=config[1],
-        before_execute_callback=before_execute_callback,
+def _resolve_config(
+    platform_definitions: DefinitionSpecSub,
+    specs: List[Optional[DefinitionSpecSub]],
+    experiment: Optional[Experiment],
+) -> MonitoringConfiguration:
+    """
+    Resolve a project config from the platform definitions and the specs merged into them.
+
+    Resolved configs are cached on disk, keyed by all inputs of the resolution.
+    """
+
+    def resolve() -> MonitoringConfiguration:
+        spec = MonitoringSpec.from_definition_spec(copy.deepcopy(platform_definitions))
+        for other in specs:
+            if other is not None:
+                spec.merge(other)
+        return with_stable_order(spec.resolve(experiment, ConfigLoader.configs))
+
+    return ConfigCache.get_or_resolve(
+        [
+            platform_definitions,
+            specs,
+            experiment,
+            ConfigCache.collection_key(ConfigLoader.configs),
+        ],
+        resolve,
     )
-    monitoring.run(submission_date)
-    return True
 
 
 def _before_execute_callback(sql_output_dir: Optional[str], query, job_config, annotations={}):
@@ -358,6 +549,33 @@ def _before_execute_callback(sql_output_dir: Optional[str], query, job_config, a
     required=False,
     type=click.Path(exists=True),
 )
+@parallelism_option
+@part_parallelism_option
+@click.option(
+    "--days_per_job",
+    "--days-per-job",
+    type=int,
+    help="Number of dates for which metrics and statistics are computed by a single query. "
+    + "Only applies to projects using submission_date as x-axis.",
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--local_data",
+    "--local-data",
+    type=click.Path(exists=True, file_okay=False),
+    help="Run the SQL locally with DuckDB over the Parquet extracts in this directory, "
+    + "named by the table IDs they replace",
+    required=False,
+)
+@click.option(
+    "--local_database",
+    "--local-database",
+    type=click.Path(dir_okay=False),
+    help="DuckDB database the results of local runs are written to",
+    default="opmon.duckdb",
+    show_default=True,
+)
 @config_repos_option
 @private_config_repos_option
 @sql_output_dir_option
@@ -369,6 +587,11 @@ def backfill(
     end_date,
     slug,
     config_file,
+    parallelism,
+    part_parallelism,
+    days_per_job,
+    local_data,
+    local_database,
     config_repos,
     private_config_repos,
     sql_output_dir,
@@ -377,7 +600,7 @@ def backfill(
     ConfigLoader.with_configs_from(config_repos).with_configs_from(
         private_config_repos, is_private=True
     )
-    experiments = ExperimentCollection.from_experimenter().ever_launched()
+    experiments = ExperimentCollection.from_experimenter(cache=HttpCache).ever_launched()
 
     # get and resolve configs for projects
     config = None
@@ -402,14 +625,11 @@ def backfill(
             )
             continue
 
-        spec = MonitoringSpec.from_definition_spec(platform_definitions)
-
+        specs = []
         if not external_config.spec.project.skip_default_metrics:
-            platform_defaults = ConfigLoader.configs.get_platform_defaults(platform)
-            if platform_defaults is not None:
-                spec.merge(platform_defaults)
-        spec.merge(external_config.spec)
-        config = (external_config.slug, spec.resolve(experiment, ConfigLoader.configs))
+            specs.append(ConfigLoader.configs.get_platform_defaults(platform))
+        specs.append(external_config.spec)
+        config = (external_config.slug, _resolve_config(platform_definitions, specs, experiment))
         break
 
     # check if backfill is for a rollout
@@ -428,16 +648,15 @@ def backfill(
                     )
                     continue
 
-                # resolve config by applying platform and custom config specs
-                spec = MonitoringSpec.from_definition_spec(copy.deepcopy(platform_definitions))
-                platform_defaults = ConfigLoader.configs.get_platform_defaults(platform)
-                if platform_defaults is not None:
-                    spec.merge(platform_defaults)
-
-                platform_defaults = ConfigLoader.configs.get_platform_defaults("rollout")
-                if platform_defaults is not None:
-                    spec.merge(platform_defaults)
-                config = (rollout.normandy_slug, spec.resolve(rollout, ConfigLoader.configs))
+                # resolve config by applying platform and rollout defaults
+                specs = [
+                    ConfigLoader.configs.get_platform_defaults(platform),
+                    ConfigLoader.configs.get_platform_defaults("rollout"),
+                ]
+                config = (
+                    rollout.normandy_slug,
+                    _resolve_config(platform_definitions, specs, rollout),
+                )
                 break
 
     # determine backfill time frame based on start and end dates
@@ -452,28 +671,47 @@ def backfill(
         else min(config[1].project.end_date, end_date)
     )
 
-    success = True
-
     print(f"Start running backfill for {config[0]}: {start_date.date()} to {end_date.date()}")
-    # backfill needs to be run sequentially since data is required from previous runs
-    for date in [
-        start_date + timedelta(days=d) for d in range(0, (end_date - start_date).days + 1)
-    ]:
-        print(f"Backfill {date.date()}")
-        try:
-            _run(
-                project_id,
-                dataset_id,
-                derived_dataset_id,
-                date,
-                config,
+    dates = [start_date + timedelta(days=d) for d in range(0, (end_date - start_date).days + 1)]
+    client = None
+    views = None
+    if local_data:
+        client = DuckDBEngine(
+            project=project_id,
+            dataset=dataset_id,
+            data_dir=Path(local_data),
+            database=local_database,
+            before_execute_callback=partial(_before_execute_callback, sql_output_dir),
+        )
+    else:
+        views = ViewSync(
+            BigQueryClient(
+                project=project_id,
+                dataset=dataset_id,
                 before_execute_callback=partial(_before_execute_callback, sql_output_dir),
             )
-        except Exception as e:
-            print(f"Error backfilling {config[0]}: {e}")
-            success = False
+        )
+    monitoring = Monitoring(
+        project=project_id,
+        dataset=dataset_id,
+        derived_dataset=derived_dataset_id,
+        slug=config[0],
+        config=config[1],
+        client=client,
+        before_execute_callback=partial(_before_execute_callback, sql_output_dir),
+        part_parallelism=part_parallelism,
+        views=views,
+    )
 
-    Metadata(project_id, dataset_id, derived_dataset_id, [config]).write()
+    # dates only run sequentially where data is required from previous runs
+    results = Scheduler(parallelism=parallelism).run(
+        backfill_tasks(monitoring, dates, days_per_job=days_per_job)
+    )
+    success = all(results.values())
+
+    # project metadata is only used by dashboards reading from BigQuery
+    if not local_data:
+        Metadata(project_id, dataset_id, derived_dataset_id, [config], views=views).write()
 
     if not success:
         sys.exit(1)
@@ -598,6 +836,8 @@ def preview(
         end_date=end_date,
         slug=slug,
         config_file=config_file,
+        # compute all dates of the preview at once
+        days_per_job=(end_date - start_date).days + 1,
         config_repos=config_repos,
         private_config_repos=private_config_repos,
         sql_output_dir=sql_output_dir,
@@ -615,20 +855,31 @@ def preview(
 
 @cli.command("validate_config")
 @click.argument("path", type=click.Path(exists=True), nargs=-1)
+@click.option(
+    "--parallelism",
+    "-p",
+    help="Number of config files validated concurrently",
+    type=int,
+    default=1,
+    show_default=True,
+)
 @config_repos_option
 @private_config_repos_option
 @sql_output_dir_option
 def validate_config(
-    path: Iterable[os.PathLike], config_repos, private_config_repos, sql_output_dir
+    path: Iterable[os.PathLike], parallelism, config_repos, private_config_repos, sql_output_dir
 ):
-    """Validate config files."""
+    """Validate config files.
+
+    Config repositories are loaded once and shared by all files.
+    """
     dirty = False
     ConfigLoader.with_configs_from(config_repos).with_configs_from(
         private_config_repos, is_private=True
     )
-    experiments = ExperimentCollection.from_experimenter().ever_launched()
+    experiments = ExperimentCollection.from_experimenter(cache=HttpCache).ever_launched()
 
-    # get updated definition files
+    config_files = []
     for config_file in path:
         config_file = Path(config_file)
         if not config_file.is_file():
@@ -636,69 +887,97 @@ def validate_config(
         if ".example" in config_file.suffixes:
             print(f"Skipping example config {config_file}")
             continue
+        config_files.append(config_file)
 
+    # get updated definition files
+    for config_file in config_files:
         if config_file.parent.name == DEFINITIONS_DIR:
             ConfigLoader.configs.definitions.append(entity_from_path(config_file))
 
-    for config_file in path:
-        config_file = Path(config_file)
-        if not config_file.is_file():
-            continue
-        if ".example" in config_file.suffixes:
-            print(f"Skipping example config {config_file}")
-            continue
-        print(f"Evaluating {config_file}...")
-        entity = entity_from_path(config_file)
+    validate_file = partial(
+        _validate_config_file,
+        experiments=experiments,
+        before_execute_callback=partial(_before_execute_callback, sql_output_dir),
+    )
+    # errors are printed in the order of the files
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        for errors in executor.map(validate_file, config_files):
+            for error in errors:
+                print(error)
+            dirty = dirty or len(errors) > 0
+
+    sys.exit(1 if dirty else 0)
+
 
-        experiment = experiments.with_slug(entity.slug)
-        monitor_entire_population = False
+def _validate_config_file(
+    config_file: Path,
+    experiments: ExperimentCollection,
+    before_execute_callback: BeforeExecuteCallback,
+) -> List[str]:
+    """Validate a single config file and return its errors."""
+    print(f"Evaluating {config_file}...")
+    entity = entity_from_path(config_file)
+
+    experiment = experiments.with_slug(entity.slug)
+    monitor_entire_population = False
+    if config_file.parent.name != DEFINITIONS_DIR:
+        if entity.spec.project and entity.spec.project.population:
+            monitor_entire_population = entity.spec.project.population.monitor_entire_population
+
+    if config_file.parent.name != DEFINITIONS_DIR and config_file.parent.name != DEFAULTS_DIR:
+        if experiment is None and monitor_entire_population is False:
+            return [f"No experiment with slug {entity.slug} in Experimenter."]
+    else:
+        # set dummy date for validating defaults
         if config_file.parent.name != DEFINITIONS_DIR:
-            if entity.spec.project and entity.spec.project.population:
-                monitor_entire_population = entity.spec.project.population.monitor_entire_population
+            entity.spec.project.start_date = "2022-01-01"
 
-        if config_file.parent.name != DEFINITIONS_DIR and config_file.parent.name != DEFAULTS_DIR:
-            if experiment is None and monitor_entire_population is False:
-                print(f"No experiment with slug {entity.slug} in Experimenter.")
-                dirty = True
-                break
-        else:
-            # set dummy date for validating defaults
-            if config_file.parent.name != DEFINITIONS_DIR:
-                entity.spec.project.start_date = "2022-01-01"
+    if config_file.parent.name == DEFINITIONS_DIR:
+        return []
+
+    platform = (
+        entity.spec.project.platform
+        or (experiment.app_name if experiment else None)
+        or DEFAULT_PLATFORM
+    )
+    platform_definitions = ConfigLoader.configs.get_platform_definitions(platform)
+
+    if platform_definitions is None:
+        return [f"Invalid platform {platform}"]
+
+    spec = entity.spec
+    spec.merge(platform_definitions)
 
-        call = partial(
-            validate,
+    try:
+        validate(
             config=entity,
-            config_getter=ConfigLoader.with_configs_from(config_repos).with_configs_from(
-                private_config_repos, is_private=True
-            ),
+            config_getter=ConfigLoader,
             experiment=experiment,
-            before_execute_callback=partial(_before_execute_callback, sql_output_dir),
+            before_execute_callback=before_execute_callback,
         )
+    except DryRunFailedError as e:
+        return [_format_dry_run_failure(e)]
+    except DryRunFailures as e:
+        return [_format_dry_run_failure(failure) for failure in e.failures]
+    return []
 
-        if config_file.parent.name != DEFINITIONS_DIR:
-            platform = (
-                entity.spec.project.platform
-                or (experiment.app_name if experiment else None)
-                or DEFAULT_PLATFORM
-            )
-            platform_definitions = ConfigLoader.configs.get_platform_definitions(platform)
 
-            if platform_definitions is None:
-                print(f"Invalid platform {platform}")
-                dirty = True
-                continue
+def _format_dry_run_failure(e: DryRunFailedError) -> str:
+    """Return the SQL of a failed dry run with line numbers and the error."""
+    lines = ["Error evaluating SQL:"]
+    for i, line in enumerate(e.sql.split("\n")):
+        lines.append(f"{i+1: 4d} {line.rstrip()}")
+    lines.append("")
+    lines.append(str(e))
+    return "\n".join(lines)
 
-            spec = entity.spec
-            spec.merge(platform_definitions)
-
-            try:
-                call()
-            except DryRunFailedError as e:
-                print("Error evaluating SQL:")
-                for i, line in enumerate(e.sql.split("\n")):
-                    print(f"{i+1: 4d} {line.rstrip()}")
-                print("")
-                print(str(e))
-                dirty = True
-    sys.exit(1 if dirty else 0)
+
+@cli.command("compile_templates")
+@click.argument("target", type=click.Path(file_okay=False))
+def compile_templates(target):
+    """Precompile SQL templates into Python modules.
+
+    Set OPMON_COMPILED_TEMPLATES to the target directory to load templates from it.
+    """
+    templates.compile_templates(Path(target))
+    click.echo(f"Compiled templates to {target}")
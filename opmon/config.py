@@ -12,6 +12,7 @@ concrete resolved Configuration class.
 import datetime as dt
 from typing import List, Optional, Union
 
+import attr
 from metric_config_parser.config import (
     Config,
     ConfigCollection,
@@ -20,10 +21,11 @@ from metric_config_parser.config import (
     Outcome,
 )
 from metric_config_parser.experiment import Experiment
-from metric_config_parser.monitoring import MonitoringSpec
+from metric_config_parser.monitoring import MonitoringConfiguration, MonitoringSpec
 from pytz import UTC
 
 from opmon.bigquery_client import BeforeExecuteCallback
+from opmon.cache import ConfigCache
 
 DEFAULT_CONFIG_REPO = "https://github.com/mozilla/metric-hub/tree/main/opmon"
 METRIC_HUB_REPO = "https://github.com/mozilla/metric-hub"
@@ -68,6 +70,24 @@ class _ConfigLoader:
 ConfigLoader = _ConfigLoader()
 
 
+def with_stable_order(config: MonitoringConfiguration) -> MonitoringConfiguration:
+    """
+    Return a resolved config with its metrics, dimensions and alerts sorted by name.
+
+    Resolving a spec collects them from sets, so their order differs between
+    processes. Views and project metadata rendered from the config are compared
+    with the deployed ones and need to be the same for the same config.
+    """
+    return attr.evolve(
+        config,
+        metrics=sorted(
+            config.metrics, key=lambda summary: (summary.metric.name, summary.statistic.name)
+        ),
+        dimensions=sorted(config.dimensions, key=lambda dimension: dimension.name),
+        alerts=sorted(config.alerts, key=lambda alert: alert.name),
+    )
+
+
 def validate(
     config: Union[Outcome, Config, DefaultConfig, DefinitionConfig],
     experiment: Optional[Experiment] = None,
@@ -82,7 +102,10 @@ def validate(
         isinstance(config, DefaultConfig) or isinstance(config, DefinitionConfig)
     ):
         config.validate(config_getter.configs, experiment)
-        resolved_config = config.spec.resolve(experiment, config_getter.configs)
+        resolved_config = ConfigCache.get_or_resolve(
+            [config.spec, experiment, ConfigCache.collection_key(config_getter.configs)],
+            lambda: with_stable_order(config.spec.resolve(experiment, config_getter.configs)),
+        )
     elif isinstance(config, Outcome):
         config.validate(config_getter.configs)
         print("Outcomes are currently not supported in OpMon")
@@ -111,7 +134,7 @@ def validate(
 
         spec = MonitoringSpec.default_for_platform_or_type(app_name, config_getter.configs)
         spec.merge(config.spec)
-        resolved_config = spec.resolve(dummy_experiment, config_getter.configs)
+        resolved_config = with_stable_order(spec.resolve(dummy_experiment, config_getter.configs))
     else:
         raise Exception(f"Unable to validate config: {config}")
 
@@ -0,0 +1,210 @@
+"""Estimate and limit the bytes processed by the BigQuery jobs of a run.
+
+Before a job is submitted, a dry run estimates how many bytes it will
+process. A `BytesBudget` rejects jobs that would exceed the budget of their
+project or of the whole run and caps the bytes BigQuery may bill for the
+remaining jobs through `maximum_bytes_billed`.
+
+The bytes billed per project are stored in a history table. The history is
+used to start projects that usually process the most data first and to report
+projects that processed much more data than usual.
+"""
+
+import re
+import statistics
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import attr
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from opmon.errors import BudgetExceededException
+
+COSTS_TABLE = "costs_v1"
+# days of history the usual bytes processed by a project are derived from
+HISTORY_DAYS = 28
+# key used for jobs that don't belong to a project
+RUN_KEY = "_run"
+
+_UNITS = {
+    "": 1,
+    "B": 1,
+    "KB": 1024,
+    "MB": 1024**2,
+    "GB": 1024**3,
+    "TB": 1024**4,
+    "PB": 1024**5,
+}
+
+
+def parse_bytes(value: str) -> int:
+    """Parse a number of bytes with an optional binary unit, e.g. `10TB`."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGTP]?B)?\s*", value.upper())
+    if not match:
+        raise ValueError(f"Invalid number of bytes '{value}', expected e.g. 500GB or 10TB")
+    return int(float(match.group(1)) * _UNITS[match.group(2) or ""])
+
+
+def format_bytes(value: float) -> str:
+    """Return a human readable number of bytes."""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(value) < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} PB"
+
+
+@attr.s(auto_attribs=True)
+class BytesBudget:
+    """
+    Bytes budget of the jobs of a run, per project and in total.
+
+    Jobs are charged with their estimated bytes when they get submitted and
+    settled with the bytes actually billed once they finished. Budgets of
+    `None` are unlimited, but the bytes processed are still recorded.
+    """
+
+    project_bytes: Optional[int] = None
+    run_bytes: Optional[int] = None
+    _used: Dict[str, int] = attr.ib(factory=dict, init=False)
+    _estimated: Dict[str, int] = attr.ib(factory=dict, init=False)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    def charge(self, slug: Optional[str], estimated_bytes: int) -> Optional[int]:
+        """
+        Charge a job that is about to be submitted with its estimated bytes.
+
+        Returns the maximum bytes the job may bill without exceeding the budget,
+        or `None` if no budget applies. Raises `BudgetExceededException` if the
+        estimate alone exceeds the budget.
+        """
+        key = slug or RUN_KEY
+        with self._lock:
+            remaining = []
+            if self.project_bytes is not None and key != RUN_KEY:
+                remaining.append(self.project_bytes - self._used.get(key, 0))
+            if self.run_bytes is not None:
+                remaining.append(self.run_bytes - sum(self._used.values()))
+
+            maximum_bytes_billed = min(remaining) if remaining else None
+            if maximum_bytes_billed is not None and estimated_bytes > maximum_bytes_billed:
+                raise BudgetExceededException(
+                    key,
+                    f"Job would process an estimated {format_bytes(estimated_bytes)}, "
+                    + f"only {format_bytes(max(0, maximum_bytes_billed))} of the budget remain.",
+                )
+
+            self._used[key] = self._used.get(key, 0) + estimated_bytes
+            self._estimated[key] = self._estimated.get(key, 0) + estimated_bytes
+
+        return maximum_bytes_billed
+
+    def settle(self, slug: Optional[str], estimated_bytes: int, billed_bytes: int) -> None:
+        """Replace the estimate a job was charged with by the bytes it billed."""
+        key = slug or RUN_KEY
+        with self._lock:
+            self._used[key] = self._used.get(key, 0) - estimated_bytes + billed_bytes
+
+    def billed(self) -> Dict[str, int]:
+        """Return the bytes billed so far, keyed by project."""
+        with self._lock:
+            return dict(self._used)
+
+    def estimated(self) -> Dict[str, int]:
+        """Return the estimated bytes of all submitted jobs, keyed by project."""
+        with self._lock:
+            return dict(self._estimated)
+
+
+@attr.s(auto_attribs=True)
+class CostHistory:
+    """History of the bytes billed by the projects of each run, stored in BigQuery."""
+
+    project: str
+    dataset: str
+    _client: Optional[bigquery.client.Client] = None
+
+    @property
+    def client(self) -> bigquery.client.Client:
+        """Return BigQuery client instance."""
+        self._client = self._client or bigquery.client.Client(self.project)
+        return self._client
+
+    @property
+    def table_id(self) -> str:
+        """Return the ID of the history table."""
+        return f"{self.project}.{self.dataset}.{COSTS_TABLE}"
+
+    def usual_bytes(self, submission_date: datetime, days: int = HISTORY_DAYS) -> Dict[str, int]:
+        """Return the median bytes billed by each project over prior runs."""
+        query = f"""
+            SELECT slug, billed_bytes
+            FROM `{self.table_id}`
+            WHERE submission_date < DATE('{submission_date:%Y-%m-%d}')
+            AND submission_date >= DATE_SUB(DATE('{submission_date:%Y-%m-%d}'), INTERVAL {days} DAY)
+        """
+        try:
+            rows = self.client.query(query).result()
+        except NotFound:
+            return {}
+
+        history: Dict[str, List[int]] = {}
+        for row in rows:
+            history.setdefault(row["slug"], []).append(row["billed_bytes"])
+        return {slug: int(statistics.median(values)) for slug, values in history.items()}
+
+    def write(self, submission_date: datetime, budget: BytesBudget) -> None:
+        """Append the bytes billed by each project of a run to the history."""
+        estimated = budget.estimated()
+        rows = [
+            {
+                "submission_date": f"{submission_date:%Y-%m-%d}",
+                "slug": slug,
+                "estimated_bytes": estimated.get(slug, 0),
+                "billed_bytes": billed,
+            }
+            for slug, billed in sorted(budget.billed().items())
+            if slug != RUN_KEY
+        ]
+        if not rows:
+            return
+
+        job_config = bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("submission_date", "DATE"),
+                bigquery.SchemaField("slug", "STRING"),
+                bigquery.SchemaField("estimated_bytes", "INT64"),
+                bigquery.SchemaField("billed_bytes", "INT64"),
+            ],
+            time_partitioning=bigquery.TimePartitioning(field="submission_date"),
+            write_disposition=bigquery.job.WriteDisposition.WRITE_APPEND,
+        )
+        self.client.load_table_from_json(rows, self.table_id, job_config=job_config).result()
+
+
+def relative_costs(usual_bytes: Dict[str, int]) -> Dict[str, float]:
+    """
+    Return the usual bytes of each project relative to the median project.
+
+    Used to weight the tasks of projects, so that projects processing the most
+    data get started first.
+    """
+    if not usual_bytes:
+        return {}
+    median = statistics.median(usual_bytes.values())
+    if median <= 0:
+        return {}
+    return {slug: max(value / median, 0.01) for slug, value in usual_bytes.items()}
+
+
+def unusual_costs(
+    billed_bytes: Dict[str, int], usual_bytes: Dict[str, int], factor: float = 2.0
+) -> List[Tuple[str, int, int]]:
+    """Return the projects that billed more than `factor` times their usual bytes."""
+    return [
+        (slug, billed, usual_bytes[slug])
+        for slug, billed in sorted(billed_bytes.items())
+        if usual_bytes.get(slug) and billed > factor * usual_bytes[slug]
+    ]
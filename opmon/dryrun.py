@@ -9,20 +9,38 @@ the queries directly, but there is no way to restrict permissions such that
 only dry runs can be performed. In order to reduce risk of CI or local users
 accidentally running queries during tests, leaking and overwriting production
 data, we proxy the queries through the dry run service endpoint.
+
+Requests share a pooled HTTP session, multiple queries are dry run
+concurrently and results are cached in memory by the hash of the SQL, since
+different configs often generate identical queries.
 """
 
+import hashlib
 import json
 import logging
-from typing import Any, List, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
 
 import requests
 import requests.exceptions
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
 # https://console.cloud.google.com/functions/details/us-central1/jetstream-dryrun?project=moz-fx-data-experiments
 DRY_RUN_URL = "https://us-central1-moz-fx-data-experiments.cloudfunctions.net/jetstream-dryrun"
 
+# maximum number of queries that are dry run at the same time
+DEFAULT_DRY_RUN_PARALLELISM = 8
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# errors of queries that have been dry run, keyed by SQL hash; None if the query is valid
+_results: Dict[str, Optional[Any]] = {}
+_results_lock = threading.Lock()
+
 
 class DryRunFailedError(Exception):
     """Exception raised when dry run fails."""
@@ -33,14 +51,88 @@ class DryRunFailedError(Exception):
         super().__init__(error)
 
 
+class DryRunFailures(Exception):
+    """Exception raised when the dry runs of multiple queries fail."""
+
+    def __init__(self, failures: List[DryRunFailedError]):
+        """Initialize exception."""
+        self.failures = failures
+        super().__init__(f"Dry run of {len(failures)} queries failed")
+
+
+def _get_session() -> requests.Session:
+    """Return the HTTP session shared by all dry runs."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount("https://", HTTPAdapter(pool_maxsize=DEFAULT_DRY_RUN_PARALLELISM))
+        return _session
+
+
+def _sql_hash(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf8")).hexdigest()
+
+
+def clear_cache() -> None:
+    """Forget the results of all previous dry runs."""
+    with _results_lock:
+        _results.clear()
+
+
 def dry_run_query(sql: Union[str, List[str]]) -> None:
-    """Dry run the provided SQL query."""
+    """
+    Dry run the provided SQL query.
+
+    Multiple queries are dry run concurrently. If more than one of them fails,
+    `DryRunFailures` is raised with all failures.
+    """
     if isinstance(sql, list):
-        for query in sql:
-            dry_run_query(sql)
+        failures = dry_run_queries(sql)
+        if len(failures) == 1:
+            raise failures[0]
+        if failures:
+            raise DryRunFailures(failures)
         return
+
+    key = _sql_hash(sql)
+    with _results_lock:
+        cached = key in _results
+        error = _results.get(key)
+
+    if not cached:
+        # errors reaching the dry run service are raised and not cached
+        error = _dry_run(sql)
+        with _results_lock:
+            _results[key] = error
+
+    if error is not None:
+        raise DryRunFailedError(error, sql=sql)
+
+
+def dry_run_queries(
+    queries: List[str], parallelism: int = DEFAULT_DRY_RUN_PARALLELISM
+) -> List[DryRunFailedError]:
+    """Dry run queries concurrently and return the failures of all of them."""
+    if len(queries) == 0:
+        return []
+
+    def run(query: str) -> Optional[DryRunFailedError]:
+        try:
+            dry_run_query(query)
+        except DryRunFailedError as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(queries)))) as executor:
+        return [failure for failure in executor.map(run, queries) if failure is not None]
+
+
+def _dry_run(sql: str) -> Optional[Any]:
+    """Dry run a single query and return its error, or `None` if it is valid."""
+    r = None
     try:
-        r = requests.post(
+        r = _get_session().post(
             DRY_RUN_URL,
             headers={"Content-Type": "application/json"},
             data=json.dumps({"dataset": "mozanalysis", "query": sql}).encode("utf8"),
@@ -50,14 +142,15 @@ def dry_run_query(sql: Union[str, List[str]]) -> None:
         # This may be a JSONDecode exception or something else.
         # If we got a HTTP exception, that's probably the most interesting thing to raise.
         try:
-            r.raise_for_status()
+            if r is not None:
+                r.raise_for_status()
         except requests.exceptions.RequestException as request_exception:
             e = request_exception
         raise DryRunFailedError(e, sql)
 
     if response["valid"]:
         logger.info("Dry run OK")
-        return
+        return None
 
     if "errors" in response and len(response["errors"]) == 1:
         error = response["errors"][0]
@@ -74,6 +167,6 @@ def dry_run_query(sql: Union[str, List[str]]) -> None:
         # we expect CREATE VIEW and CREATE TABLE to throw specific
         # exceptions.
         logger.info("Dry run OK")
-        return
+        return None
 
-    raise DryRunFailedError((error and error.get("message", None)) or response["errors"], sql=sql)
+    return (error and error.get("message", None)) or response["errors"]
@@ -0,0 +1,188 @@
+"""Index the enrollments of all projects reading from the same population source.
+
+The population of a project is derived from the experiments map of every
+ping in its population data source. Instead of evaluating the map over the
+raw pings for every project, the enrollments of all projects using the same
+data source, platform and channel are extracted once per day into a compact
+table clustered by slug. Besides the enrollments, the table has a row with
+the number of pings of every client, so that rollouts can still tell which
+clients sent pings without being enrolled.
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import attr
+from metric_config_parser.data_source import DataSource
+from metric_config_parser.monitoring import MonitoringConfiguration
+from metric_config_parser.project import MonitoringPeriod
+
+from .bigquery_client import BigQueryClient
+from .templates import render_template
+
+if TYPE_CHECKING:
+    from .monitoring import Monitoring
+
+logger = logging.getLogger(__name__)
+
+ENROLLMENT_INDEX_QUERY_FILENAME = "enrollment_index_query.sql"
+# enrollment indexes are only read by metric queries of the same run
+ENROLLMENT_INDEX_EXPIRATION_HOURS = 24
+# minimum number of projects that read from a population source for it to be indexed
+MIN_INDEXED_PROJECTS = 2
+
+
+def uses_enrollment_index(config: MonitoringConfiguration) -> bool:
+    """
+    Return whether the population of a project can be read from an enrollment index.
+
+    The population needs to be derived from the experiments map for a single
+    date. Dimensions are computed from the raw pings, so projects using them
+    are not supported.
+    """
+    project = config.project
+    if project is None or project.skip or project.xaxis != MonitoringPeriod.DAY:
+        return False
+
+    population = project.population
+    if population.data_source is None or population.monitor_entire_population:
+        return False
+    if population.boolean_pref and population.branches is None:
+        return False
+
+    return len(config.dimensions) == 0
+
+
+@attr.s(auto_attribs=True)
+class EnrollmentIndex:
+    """Enrollments of all indexed projects reading from a population source for a single date."""
+
+    project: str
+    dataset: str
+    data_source: DataSource
+    from_expression: str
+    is_glean_app: bool
+    channel: Optional[str]
+    submission_date: datetime
+    slugs: List[str] = attr.Factory(list)
+    # whether the number of pings of clients that are not enrolled is indexed for rollouts
+    clients: bool = False
+    # failed indexes are not read from, projects derive their population from the pings
+    failed: bool = attr.ib(default=False, init=False)
+
+    @property
+    def table_name(self) -> str:
+        """Return the name of the table the enrollments are written to."""
+        source = "\n".join(
+            [
+                self.from_expression,
+                self.data_source.submission_date_column,
+                self.data_source.client_id_column,
+                str(self.is_glean_app),
+                str(self.channel),
+            ]
+        )
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        return f"enrollment_index_{key}_{self.submission_date:%Y%m%d}"
+
+    @property
+    def table_id(self) -> str:
+        """Return the fully qualified ID of the table the enrollments are written to."""
+        return f"{self.project}.{self.dataset}.{self.table_name}"
+
+    def sql(self) -> str:
+        """Return the SQL that extracts the enrollments into the index table."""
+        return render_template(
+            ENROLLMENT_INDEX_QUERY_FILENAME,
+            {
+                "header": "-- Generated via opmon\n",
+                "table_id": self.table_id,
+                "expiration_hours": ENROLLMENT_INDEX_EXPIRATION_HOURS,
+                "data_source": self.data_source,
+                "from_expression": self.from_expression,
+                "is_glean_app": self.is_glean_app,
+                "channel": self.channel,
+                "submission_date": self.submission_date,
+                "slugs": self.slugs,
+                "clients": self.clients,
+            },
+        )
+
+    def run(self, bigquery: BigQueryClient) -> None:
+        """
+        Build the index.
+
+        Errors are not raised. The index is marked as failed instead, so that
+        the metrics of the projects reading from it are still computed.
+        """
+        try:
+            bigquery.execute(
+                self.sql(),
+                annotations={
+                    "slug": self.table_name,
+                    "type": "enrollment_index_query",
+                    "submission_date": self.submission_date,
+                },
+            )
+        except Exception as e:
+            self.failed = True
+            logger.warning(
+                f"Enrollment index {self.table_name} failed, {', '.join(self.slugs)} "
+                + f"will read their population from {self.from_expression} instead: {e}",
+                exc_info=e,
+            )
+
+
+def plan_enrollment_indexes(
+    monitorings: List["Monitoring"],
+    submission_date: datetime,
+    min_projects: int = MIN_INDEXED_PROJECTS,
+) -> List[EnrollmentIndex]:
+    """
+    Return the enrollment indexes used by projects running for a date.
+
+    The indexes are assigned to the `enrollment_index` of each project
+    reading its population from them.
+    """
+    sources: Dict[Tuple[str, str, str, bool, Optional[str]], List["Monitoring"]] = {}
+    for monitoring in monitorings:
+        if not uses_enrollment_index(monitoring.config):
+            continue
+
+        render_kwargs = monitoring._population_render_kwargs(submission_date)
+        population = monitoring.config.project.population
+        key = (
+            population.data_source.from_expr_for(render_kwargs["app_id"]),
+            population.data_source.submission_date_column,
+            population.data_source.client_id_column,
+            render_kwargs["is_glean_app"],
+            population.channel.value if population.channel else None,
+        )
+        sources.setdefault(key, []).append(monitoring)
+
+    indexes = []
+    for (from_expression, _, _, is_glean_app, channel), readers in sources.items():
+        slugs = list(dict.fromkeys(monitoring.slug for monitoring in readers))
+        if len(slugs) < min_projects:
+            continue
+
+        index = EnrollmentIndex(
+            project=readers[0].project,
+            dataset=readers[0].derived_dataset,
+            data_source=readers[0].config.project.population.data_source,
+            from_expression=from_expression,
+            is_glean_app=is_glean_app,
+            channel=channel,
+            submission_date=submission_date,
+            slugs=slugs,
+            clients=any(
+                len(monitoring.config.project.population.branches) == 0 for monitoring in readers
+            ),
+        )
+        for monitoring in readers:
+            monitoring.enrollment_index = index
+        indexes.append(index)
+
+    return indexes
@@ -39,3 +39,11 @@ class StatisticNotImplementedForTypeException(OpmonException):
     def __init__(self, slug, message="Statistic not implemented for metric type."):
         """Initialize exception."""
         super().__init__(f"{slug} -> {message}")
+
+
+class BudgetExceededException(OpmonException):
+    """Exception thrown when a job would exceed the bytes budget of a project or run."""
+
+    def __init__(self, slug, message="Bytes budget exceeded."):
+        """Initialize exception."""
+        super().__init__(f"{slug} -> {message}")
@@ -2,7 +2,9 @@
 
 import datetime as dt
 import logging
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import attr
 import cattr
@@ -10,6 +12,7 @@ import pytz
 import requests
 from metric_config_parser.experiment import Channel
 
+from .cache import ResponseCache
 from .utils import retry_get
 
 logger = logging.getLogger(__name__)
@@ -74,14 +77,19 @@ class ExperimentV1:
         return dt.datetime.fromtimestamp(num / 1e3, pytz.utc)
 
     @classmethod
-    def from_dict(cls, d) -> "ExperimentV1":
-        """Create an experiment from a dictionary."""
+    @lru_cache(maxsize=None)
+    def _converter(cls) -> cattr.Converter:
         converter = cattr.Converter()
         converter.register_structure_hook(
             dt.datetime,
             lambda num, _: cls._unix_millis_to_datetime(num),
         )
-        return converter.structure(d, cls)
+        return converter
+
+    @classmethod
+    def from_dict(cls, d) -> "ExperimentV1":
+        """Create an experiment from a dictionary."""
+        return cls._converter().structure(d, cls)
 
     def to_experiment(self) -> "Experiment":
         """Convert to Experiment."""
@@ -138,8 +146,8 @@ class ExperimentV6:
         return self._appId or "firefox-desktop"
 
     @classmethod
-    def from_dict(cls, d) -> "ExperimentV6":
-        """Create an experiment from a dictionary."""
+    @lru_cache(maxsize=None)
+    def _converter(cls) -> cattr.GenConverter:
         converter = cattr.GenConverter()
         converter.register_structure_hook(
             dt.datetime,
@@ -156,7 +164,12 @@ class ExperimentV6:
             # Ignore type check for now as it appears to be a bug in cattrs library
             # for more info see issue: https://github.com/mozilla/jetstream/issues/995
         )
-        return converter.structure(d, cls)
+        return converter
+
+    @classmethod
+    def from_dict(cls, d) -> "ExperimentV6":
+        """Create an experiment from a dictionary."""
+        return cls._converter().structure(d, cls)
 
     def to_experiment(self) -> "Experiment":
         """Convert to Experiment."""
@@ -188,9 +201,27 @@ class ExperimentV6:
 
 @attr.s(auto_attribs=True)
 class ExperimentCollection:
-    """Collection of all the experiments from experimenter."""
+    """
+    Collection of all the experiments from experimenter.
+
+    Lookups are served from indexes that are built on first use, so the
+    collection must not be modified after it has been queried.
+    """
 
     experiments: List[Experiment] = attr.Factory(list)
+    # indexes are caches, they don't take part in comparisons
+    _by_slug: Optional[Dict[str, Experiment]] = attr.ib(
+        default=None, init=False, repr=False, eq=False, hash=False
+    )
+    _by_app_name: Optional[Dict[str, "ExperimentCollection"]] = attr.ib(
+        default=None, init=False, repr=False, eq=False, hash=False
+    )
+    _ever_launched: Optional["ExperimentCollection"] = attr.ib(
+        default=None, init=False, repr=False, eq=False, hash=False
+    )
+    _rollouts: Optional["ExperimentCollection"] = attr.ib(
+        default=None, init=False, repr=False, eq=False, hash=False
+    )
 
     MAX_RETRIES = 3
     EXPERIMENTER_API_URL_V1 = "https://experimenter.services.mozilla.com/api/v1/experiments/"
@@ -203,55 +234,102 @@ class ExperimentCollection:
 
     @classmethod
     def from_experimenter(
-        cls, session: Optional[requests.Session] = None
+        cls, session: Optional[requests.Session] = None, cache: Optional[ResponseCache] = None
     ) -> "ExperimentCollection":
-        """Fetch all experiments from Experimenter."""
+        """
+        Fetch all experiments from Experimenter.
+
+        If a response cache is provided, API responses are cached and revalidated.
+        """
         session = session or requests.Session()
-        legacy_experiments_json = retry_get(
-            session, cls.EXPERIMENTER_API_URL_V1, cls.MAX_RETRIES, cls.USER_AGENT
-        )
-        legacy_experiments = []
 
-        for experiment in legacy_experiments_json:
-            if experiment["type"] != "rapid":
-                try:
-                    legacy_experiments.append(ExperimentV1.from_dict(experiment).to_experiment())
-                except Exception as e:
-                    logger.exception(str(e), exc_info=e, extra={"experiment": experiment["slug"]})
+        # both endpoints are slow to respond, fetch them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            legacy_future = executor.submit(
+                retry_get,
+                session,
+                cls.EXPERIMENTER_API_URL_V1,
+                cls.MAX_RETRIES,
+                cls.USER_AGENT,
+                cache,
+            )
+            nimbus_future = executor.submit(
+                retry_get,
+                session,
+                cls.EXPERIMENTER_API_URL_V6,
+                cls.MAX_RETRIES,
+                cls.USER_AGENT,
+                cache,
+            )
+            legacy_experiments_json = legacy_future.result()
+            nimbus_experiments_json = nimbus_future.result()
 
-        nimbus_experiments_json = retry_get(
-            session, cls.EXPERIMENTER_API_URL_V6, cls.MAX_RETRIES, cls.USER_AGENT
+        legacy_experiments = cls.parse_experiments(
+            [experiment for experiment in legacy_experiments_json if experiment["type"] != "rapid"],
+            ExperimentV1.from_dict,
         )
-        nimbus_experiments = []
+        nimbus_experiments = cls.parse_experiments(nimbus_experiments_json, ExperimentV6.from_dict)
+
+        return cls(nimbus_experiments + legacy_experiments)
 
-        for experiment in nimbus_experiments_json:
+    @staticmethod
+    def parse_experiments(
+        experiments_json: List[Dict[str, Any]],
+        from_dict: Callable[[Dict[str, Any]], Union[ExperimentV1, ExperimentV6]],
+    ) -> List[Experiment]:
+        """
+        Parse a list of Experimenter API experiments.
+
+        Experiments that cannot be parsed are logged and skipped.
+        """
+        experiments = []
+        for experiment in experiments_json:
             try:
-                nimbus_experiments.append(ExperimentV6.from_dict(experiment).to_experiment())
+                experiments.append(from_dict(experiment).to_experiment())
             except Exception as e:
                 logger.exception(str(e), exc_info=e, extra={"experiment": experiment["slug"]})
-
-        return cls(nimbus_experiments + legacy_experiments)
+        return experiments
 
     def ever_launched(self) -> "ExperimentCollection":
         """Return all experiments that have ever been live."""
-        cls = type(self)
-        return cls(
-            [
-                ex
-                for ex in self.experiments
-                if ex.status in ("Complete", "Live") or ex.status is None
-            ]
-        )
+        if self._ever_launched is None:
+            cls = type(self)
+            self._ever_launched = cls(
+                [
+                    ex
+                    for ex in self.experiments
+                    if ex.status in ("Complete", "Live") or ex.status is None
+                ]
+            )
+        return self._ever_launched
 
     def with_slug(self, slug: str) -> Optional[Experiment]:
-        """Return all experiments with a specific slug."""
-        for ex in self.experiments:
-            if ex.experimenter_slug == slug or ex.normandy_slug == slug:
-                return ex
-
-        return None
+        """Return the first experiment with a specific experimenter or normandy slug."""
+        if self._by_slug is None:
+            by_slug: Dict[str, Experiment] = {}
+            for ex in self.experiments:
+                # the first experiment with a matching slug takes precedence
+                if ex.experimenter_slug is not None:
+                    by_slug.setdefault(ex.experimenter_slug, ex)
+                if ex.normandy_slug is not None:
+                    by_slug.setdefault(ex.normandy_slug, ex)
+            self._by_slug = by_slug
+
+        return self._by_slug.get(slug)
 
     def rollouts(self) -> "ExperimentCollection":
         """Return all rollouts."""
-        cls = type(self)
-        return cls([ex for ex in self.experiments if ex.is_rollout])
+        if self._rollouts is None:
+            cls = type(self)
+            self._rollouts = cls([ex for ex in self.experiments if ex.is_rollout])
+        return self._rollouts
+
+    def by_app_name(self) -> Dict[str, "ExperimentCollection"]:
+        """Return the experiments grouped by the app they were launched on."""
+        if self._by_app_name is None:
+            groups: Dict[str, List[Experiment]] = {}
+            for ex in self.experiments:
+                groups.setdefault(ex.app_name, []).append(ex)
+            cls = type(self)
+            self._by_app_name = {app_name: cls(group) for app_name, group in groups.items()}
+        return self._by_app_name
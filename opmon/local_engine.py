@@ -0,0 +1,623 @@
+"""Execute the generated SQL locally with DuckDB over Parquet extracts.
+
+Tables referenced by the SQL are read from Parquet files in a local data
+directory, named by their fully qualified BigQuery table ID, for example
+`moz-fx-data-shared-prod.telemetry.main.parquet` or a directory of that name
+containing Parquet files. Results are written to tables of the DuckDB
+database that are named the same way.
+
+BigQuery specific SQL is translated before execution. Temporary functions
+of the templates and the `mozfun` functions they use are replaced by DuckDB
+macros. JavaScript UDFs and sketches are not supported.
+
+DuckDB is an optional dependency: `pip install duckdb`.
+"""
+
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import attr
+from google.cloud import bigquery
+
+from .bigquery_client import BeforeExecuteCallback
+
+# macros replacing the temporary functions defined by the templates,
+# these only use list functions since DuckDB doesn't support unnesting
+# correlated lists in subqueries
+TEMPORARY_FUNCTIONS = {
+    "histogram_normalized_sum": """
+        CREATE OR REPLACE MACRO histogram_normalized_sum(arrs, weight) AS list_transform(
+            list_sort(list_distinct(list_transform(
+                flatten(list_transform(arrs, a -> a."values")), b -> CAST(b.key AS DOUBLE)
+            ))),
+            k -> struct_pack(
+                key := k,
+                value := COALESCE(
+                    list_sum(list_transform(
+                        list_filter(
+                            flatten(list_transform(arrs, a -> a."values")),
+                            b -> CAST(b.key AS DOUBLE) = k
+                        ),
+                        b -> b.value
+                    )) / NULLIF(list_sum(list_transform(
+                        flatten(list_transform(arrs, a -> a."values")), b -> b.value
+                    )), 0),
+                    0
+                ) * weight
+            )
+        )
+    """,
+    "merge_histogram_values": """
+        CREATE OR REPLACE MACRO merge_histogram_values(arrs) AS struct_pack(
+            "values" := list_transform(
+                list_sort(list_distinct(list_transform(arrs, h -> h.key))),
+                k -> struct_pack(
+                    key := k,
+                    value := list_sum(list_transform(
+                        list_filter(arrs, h -> h.key = k), h -> h.value
+                    ))
+                )
+            )
+        )
+    """,
+    "binomial_percentile_ci": """
+        CREATE OR REPLACE MACRO binomial_percentile_ci(
+            percentiles, histogram, metric, statistic, z_score
+        ) AS list_transform(
+            list_sort(percentiles),
+            p -> struct_pack(
+                metric := metric,
+                statistic := statistic,
+                point := COALESCE(
+                    _first_key_above(
+                        histogram."values", _histogram_total(histogram."values") * p / 100
+                    ),
+                    list_max(list_transform(histogram."values", b -> b.key))
+                ),
+                lower := _first_key_above(
+                    histogram."values",
+                    _histogram_total(histogram."values") * p / 100
+                    - _rank_spread(_histogram_total(histogram."values"), p, z_score)
+                ),
+                upper := COALESCE(
+                    _first_key_above(
+                        histogram."values",
+                        _histogram_total(histogram."values") * p / 100
+                        + _rank_spread(_histogram_total(histogram."values"), p, z_score)
+                    ),
+                    list_max(list_transform(histogram."values", b -> b.key))
+                ),
+                parameter := CAST(p AS VARCHAR)
+            )
+        )
+    """,
+}
+
+# macros replacing BigQuery and mozfun functions used by the templates
+MACROS = [
+    """
+    CREATE OR REPLACE MACRO bq_date(x) AS CAST(substr(CAST(x AS VARCHAR), 1, 10) AS DATE)
+    """,
+    """
+    CREATE OR REPLACE MACRO mozfun_map_get_key(m, k) AS
+        list_filter(m, e -> e.key = k)[1].value
+    """,
+    """
+    CREATE OR REPLACE MACRO mozfun_glam_histogram_bucket_from_value(buckets, val) AS
+        list_max(list_filter(list_transform(buckets, b -> CAST(b AS DOUBLE)), b -> b <= val))
+    """,
+    """
+    CREATE OR REPLACE MACRO mozfun_glam_histogram_generate_scalar_buckets(
+        min_bucket, max_bucket, num_buckets
+    ) AS CASE
+        WHEN min_bucket >= max_bucket THEN []
+        ELSE list_transform(
+            range(CAST(num_buckets AS BIGINT)),
+            i -> ROUND(POW(2, (max_bucket - min_bucket) / num_buckets * i), 2)
+        )
+    END
+    """,
+    # helpers of binomial_percentile_ci
+    """
+    CREATE OR REPLACE MACRO _histogram_total(buckets) AS
+        list_sum(list_transform(buckets, b -> b.value))
+    """,
+    """
+    CREATE OR REPLACE MACRO _rank_spread(total, p, z_score) AS
+        z_score * SQRT(total * p / 100 * (1 - p / 100))
+    """,
+    """
+    CREATE OR REPLACE MACRO _first_key_above(buckets, rank) AS list_min(list_filter(
+        list_transform(
+            buckets,
+            (b, i) -> CASE
+                WHEN list_sum(list_transform(buckets[1:i], x -> x.value)) >= rank THEN b.key
+            END
+        ),
+        key -> key IS NOT NULL
+    ))
+    """,
+]
+
+_TYPES = {"FLOAT64": "DOUBLE", "INT64": "BIGINT", "STRING": "VARCHAR", "BOOL": "BOOLEAN"}
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|--[^\n]*")
+_PLACEHOLDER = re.compile(r"\x00(\d+)\x00")
+
+
+class LocalEngineException(Exception):
+    """Exception for SQL that can't be executed by the local engine."""
+
+    pass
+
+
+def _matching(sql: str, start: int, open_char: str = "(", close_char: str = ")") -> int:
+    """Return the index of the bracket closing the one at `start`."""
+    depth = 0
+    for i in range(start, len(sql)):
+        if sql[i] == open_char:
+            depth += 1
+        elif sql[i] == close_char:
+            depth -= 1
+            if depth == 0:
+                return i
+    raise LocalEngineException(f"Unbalanced {open_char} in SQL: {sql[start:start + 80]}")
+
+
+def _split_args(args: str, brackets: str = "()[]") -> List[str]:
+    """Split arguments at top-level commas."""
+    parts = []
+    depth = 0
+    current = ""
+    for char in args:
+        if char in brackets[::2]:
+            depth += 1
+        elif char in brackets[1::2]:
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _replace(sql: str, start: int, end: int, replacement: str) -> str:
+    """Replace the SQL between two positions."""
+    return sql[:start] + replacement + sql[end:]
+
+
+def _rewrite_calls(sql: str, name: str, rewrite: Callable[[List[str]], str]) -> str:
+    """Replace every call of a function with the result of `rewrite` for its arguments."""
+    pattern = re.compile(rf"(?<![\w.]){name}\s*\(", re.IGNORECASE)
+    # rewrite from the last call, so that calls nested in arguments are rewritten first
+    matches = list(pattern.finditer(sql))
+    for match in reversed(matches):
+        start = match.end()
+        end = _matching(sql, start - 1)
+        sql = _replace(sql, match.start(), end + 1, rewrite(_split_args(sql[start:end])))
+    return sql
+
+
+def _struct_field(arg: str, idx: int) -> str:
+    """Return a `struct_pack` field for an argument of `STRUCT(...)`."""
+    aliased = re.match(r"(?s)(.*)\s+AS\s+(\w+)$", arg, re.IGNORECASE)
+    if aliased:
+        return f'"{aliased.group(2)}" := {aliased.group(1)}'
+    name = re.match(r"^(?:\w+\.)*(\w+)$", arg)
+    return f'"{name.group(1) if name else f"_field{idx}"}" := {arg}'
+
+
+def _duckdb_type(bigquery_type: str) -> str:
+    """Return the DuckDB type of a BigQuery type."""
+    bigquery_type = bigquery_type.strip()
+    parameterized = re.match(r"(?s)(ARRAY|STRUCT)\s*<(.*)>$", bigquery_type, re.IGNORECASE)
+    if parameterized is None:
+        return _TYPES.get(bigquery_type.upper(), bigquery_type)
+    if parameterized.group(1).upper() == "ARRAY":
+        return f"{_duckdb_type(parameterized.group(2))}[]"
+    fields = []
+    for field in _split_args(parameterized.group(2), "()[]<>"):
+        name, field_type = field.split(None, 1)
+        fields.append(f'"{name}" {_duckdb_type(field_type)}')
+    return f"STRUCT({', '.join(fields)})"
+
+
+def _rewrite_typed_constructors(sql: str) -> str:
+    """Rewrite `ARRAY<...>[...]` and `STRUCT<...>(...)` constructors to casts."""
+    while True:
+        match = re.search(r"\b(ARRAY|STRUCT)\s*<", sql)
+        if match is None:
+            return sql
+        start = match.start()
+        type_start = match.end()
+        type_end = _matching(sql, type_start - 1, "<", ">")
+        values_start = type_end + 1
+        duckdb_type = _duckdb_type(sql[start:values_start])
+        while sql[values_start].isspace():
+            values_start += 1
+        if match.group(1) == "STRUCT":
+            if sql[values_start] != "(":
+                raise LocalEngineException("STRUCT types are only supported in constructors")
+            args_start = values_start + 1
+            args_end = _matching(sql, values_start)
+            values_end = args_end + 1
+            names = [field.split()[0] for field in _split_args(sql[type_start:type_end], "()[]<>")]
+            args = _split_args(sql[args_start:args_end])
+            fields = ", ".join(f'"{name}" := {arg}' for name, arg in zip(names, args))
+            values = f"struct_pack({fields})"
+        else:
+            if sql[values_start] != "[":
+                raise LocalEngineException("ARRAY types are only supported in constructors")
+            values_end = _matching(sql, values_start, "[", "]") + 1
+            values = sql[values_start:values_end]
+        sql = _replace(sql, start, values_end, f"CAST({values} AS {duckdb_type})")
+
+
+def _array_subquery(args: List[str]) -> str:
+    """
+    Rewrite `ARRAY(SELECT expr FROM UNNEST(list) AS x [ORDER BY x])` to a list function.
+
+    DuckDB can't reference columns of the outer query from lambdas in subqueries.
+    """
+    subquery = args[0] if len(args) == 1 else ""
+    select = re.match(r"(?s)\s*SELECT\s+(.*?)\s+FROM\s+UNNEST\s*\(", subquery, re.IGNORECASE)
+    if select:
+        start = select.end()
+        end = _matching(subquery, start - 1)
+        rest = re.compile(r"(?s)\s*AS\s+(\w+)(?:\s+ORDER\s+BY\s+(\w+))?\s*$", re.IGNORECASE).match(
+            subquery, end + 1
+        )
+        if rest and rest.group(2) in (None, rest.group(1)):
+            values = subquery[start:end]
+            if rest.group(2):
+                values = f"list_sort({values})"
+            return f"list_transform({values}, {rest.group(1)} -> {select.group(1)})"
+    return f"ARRAY({', '.join(args)})"
+
+
+def _remove_temporary_functions(sql: str) -> str:
+    """Remove temporary function definitions that get replaced by macros."""
+    pattern = re.compile(r"CREATE\s+TEMP(?:ORARY)?\s+FUNCTION\s+(\w+)\s*\(", re.IGNORECASE)
+    while True:
+        match = pattern.search(sql)
+        if match is None:
+            return sql
+        if match.group(1) not in TEMPORARY_FUNCTIONS:
+            raise LocalEngineException(f"Temporary function {match.group(1)} is not supported")
+        params_end = _matching(sql, match.end() - 1)
+        body = re.compile(r"\s*AS\s*\(", re.IGNORECASE).match(sql, params_end + 1)
+        if body is None:
+            raise LocalEngineException(f"Unexpected definition of {match.group(1)}")
+        end = _matching(sql, body.end() - 1) + 1
+        semicolon = re.compile(r"\s*;").match(sql, end)
+        sql = _replace(sql, match.start(), semicolon.end() if semicolon else end, "")
+
+
+def _depths(sql: str) -> List[int]:
+    """Return the parenthesis depth at every position."""
+    depths = []
+    depth = 0
+    for char in sql:
+        if char == ")":
+            depth -= 1
+        depths.append(depth)
+        if char == "(":
+            depth += 1
+    return depths
+
+
+def _expand_group_by_aliases(sql: str) -> str:
+    """
+    Replace aliases of the select list in GROUP BY clauses by their expressions.
+
+    BigQuery resolves GROUP BY names to aliases of the select list first,
+    DuckDB to columns of the FROM clause.
+    """
+    for group_by in reversed(list(re.finditer(r"\bGROUP\s+BY\b", sql, re.IGNORECASE))):
+        depths = _depths(sql)
+        depth = depths[group_by.start()]
+        select = None
+        for i in range(group_by.start(), -1, -1):
+            if depths[i] < depth:
+                break
+            if depths[i] == depth and re.match(r"SELECT\b", sql[i:], re.IGNORECASE):
+                select = i
+                break
+        if select is None:
+            continue
+        from_clause = next(
+            (
+                match.start()
+                for match in re.compile(r"\bFROM\b", re.IGNORECASE).finditer(
+                    sql, select, group_by.start()
+                )
+                if depths[match.start()] == depth
+            ),
+            None,
+        )
+        if from_clause is None:
+            continue
+
+        aliases = {}
+        items_start = select + len("SELECT")
+        for item in _split_args(sql[items_start:from_clause]):
+            aliased = re.match(r"(?s)(.*\S)\s+AS\s+(\w+)$", item, re.IGNORECASE)
+            if aliased and not re.match(r"^\d+$", aliased.group(1)):
+                aliases[aliased.group(2)] = aliased.group(1)
+
+        end = len(sql)
+        for i in range(group_by.end(), len(sql)):
+            if depths[i] < depth or (
+                depths[i] == depth
+                and re.match(
+                    r"(HAVING|QUALIFY|WINDOW|ORDER\s+BY|LIMIT|UNION|INTERSECT)\b|;",
+                    sql[i:],
+                    re.IGNORECASE,
+                )
+            ):
+                end = i
+                break
+        start = group_by.end()
+        items = [aliases.get(item, item) for item in _split_args(sql[start:end])]
+        sql = _replace(sql, start, end, " " + ", ".join(items) + "\n")
+    return sql
+
+
+def translate(sql: str) -> str:
+    """Translate BigQuery SQL generated from the templates to DuckDB SQL."""
+    literals: List[str] = []
+
+    def hide(match: "re.Match[str]") -> str:
+        literal = match.group(0)
+        if literal.startswith("--"):
+            return ""
+        if literal.startswith("`"):
+            if ".udf_js." in literal:
+                raise LocalEngineException(
+                    f"JavaScript UDF {literal} is not supported, "
+                    + "use the binomial_percentile statistic for local runs"
+                )
+            literal = '"' + literal[1:-1] + '"'
+        elif literal.startswith('"'):
+            literal = "'" + literal[1:-1].replace('\\"', '"').replace("'", "''") + "'"
+        literals.append(literal)
+        return f"\x00{len(literals) - 1}\x00"
+
+    sql = _LITERALS.sub(hide, sql)
+
+    if re.search(r"\bKLL_QUANTILES\.", sql):
+        raise LocalEngineException("KLL sketches are not supported")
+
+    sql = _remove_temporary_functions(sql)
+    # unquoted table IDs would be read as catalog.schema.table
+    sql = re.sub(
+        r"\b(FROM|JOIN)\s+([\w-]+\.[\w-]+\.[\w-]+)\b",
+        r'\1 "\2"',
+        sql,
+        flags=re.IGNORECASE,
+    )
+    sql = re.sub(r"\bmozfun\.(\w+)\.(\w+)\s*\(", r"mozfun_\1_\2(", sql)
+
+    # DDL options without a local equivalent
+    sql = _rewrite_calls(sql, "OPTIONS", lambda args: "")
+    sql = re.sub(r"\bCLUSTER\s+BY\s+[\w\s,]+?(?=\bAS\b)", "", sql, flags=re.IGNORECASE)
+
+    sql = _rewrite_calls(
+        sql,
+        "STRUCT",
+        lambda args: f"struct_pack({', '.join(_struct_field(a, i) for i, a in enumerate(args))})",
+    )
+    # after STRUCT calls, since the casts use STRUCT types
+    sql = _rewrite_typed_constructors(sql)
+    sql = _rewrite_calls(sql, "ARRAY", _array_subquery)
+    sql = _rewrite_calls(
+        sql,
+        "APPROX_QUANTILES",
+        lambda args: f"quantile_disc({args[0]}, "
+        + f"[{', '.join(str(i / int(args[1])) for i in range(int(args[1]) + 1))}])",
+    )
+    sql = re.sub(r"\[\s*(?:SAFE_)?OFFSET\s*\(", "[1 + (", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\[\s*(?:SAFE_)?ORDINAL\s*\(", "[(", sql, flags=re.IGNORECASE)
+
+    sql = _rewrite_calls(sql, "DATE", lambda args: f"bq_date({args[0]})")
+    sql = _rewrite_calls(sql, "DATE_SUB", lambda args: f"CAST(({args[0]}) - {args[1]} AS DATE)")
+    sql = _rewrite_calls(sql, "DATE_ADD", lambda args: f"CAST(({args[0]}) + {args[1]} AS DATE)")
+    sql = _rewrite_calls(
+        sql, "PARSE_DATE", lambda args: f"CAST(strptime({args[1]}, {args[0]}) AS DATE)"
+    )
+    sql = _rewrite_calls(sql, "TIMESTAMP", lambda args: f"CAST({args[0]} AS TIMESTAMP)")
+    sql = _rewrite_calls(sql, "CURRENT_DATE", lambda args: "current_date")
+    sql = _rewrite_calls(sql, "CURRENT_TIMESTAMP", lambda args: "current_timestamp")
+    sql = _rewrite_calls(
+        sql,
+        "LOG",
+        lambda args: f"log({args[1]}, {args[0]})" if len(args) == 2 else f"ln({args[0]})",
+    )
+    sql = _rewrite_calls(sql, "SAFE_DIVIDE", lambda args: f"({args[0]}) / NULLIF({args[1]}, 0)")
+    sql = _rewrite_calls(sql, "ARRAY_CONCAT_AGG", lambda args: f"flatten(list({args[0]}))")
+    sql = _rewrite_calls(sql, "TO_JSON_STRING", lambda args: f"CAST(to_json({args[0]}) AS VARCHAR)")
+    sql = re.sub(r"\bSAFE_CAST\s*\(", "TRY_CAST(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bFORMAT\s*\(", "printf(", sql)
+    sql = re.sub(r"\bCOUNTIF\s*\(", "count_if(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bLOGICAL_OR\s*\(", "bool_or(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bLOGICAL_AND\s*\(", "bool_and(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\*\s*EXCEPT\s*\(", "* EXCLUDE(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\b(" + "|".join(_TYPES) + r")\b", lambda m: _TYPES[m.group(1)], sql)
+
+    # unnesting correlated lists is only supported in select lists
+    unnests = list(re.finditer(r"(?<![\w.])UNNEST\s*\(", sql, re.IGNORECASE))
+    for unnest in reversed(unnests):
+        start = unnest.end()
+        end = _matching(sql, start - 1)
+        alias = re.compile(r"\s+AS\s+(\w+)\b(?!\s*\()", re.IGNORECASE).match(sql, end + 1)
+        if alias:
+            sql = _replace(
+                sql,
+                unnest.start(),
+                alias.end(),
+                f"(SELECT unnest({sql[start:end]}) AS {alias.group(1)})",
+            )
+
+    sql = _expand_group_by_aliases(sql)
+    return _PLACEHOLDER.sub(lambda match: literals[int(match.group(1))], sql)
+
+
+@attr.s(auto_attribs=True)
+class DuckDBEngine:
+    """Execution engine running the generated SQL with DuckDB over local Parquet files."""
+
+    project: str
+    dataset: str
+    data_dir: Path
+    database: str = ":memory:"
+    before_execute_callback: Optional[BeforeExecuteCallback] = None
+    _connection: Any = attr.ib(default=None, init=False, repr=False)
+    _lock: threading.RLock = attr.ib(factory=threading.RLock, init=False, repr=False)
+
+    @property
+    def connection(self) -> Any:
+        """Return the DuckDB connection with macros and source tables registered."""
+        with self._lock:
+            if self._connection is None:
+                try:
+                    import duckdb
+                except ImportError:
+                    raise LocalEngineException(
+                        "The local engine requires DuckDB, install it with `pip install duckdb`"
+                    )
+
+                self._connection = duckdb.connect(self.database)
+                for macro in MACROS + list(TEMPORARY_FUNCTIONS.values()):
+                    self._connection.execute(macro)
+                for path in sorted(Path(self.data_dir).iterdir()):
+                    self._register(path)
+            return self._connection
+
+    def _register(self, path: Path) -> None:
+        """Register a Parquet extract as view named by its table ID."""
+        if path.suffix == ".parquet":
+            table_id = path.stem
+            files = str(path)
+        elif path.is_dir() and any(path.glob("*.parquet")):
+            table_id = path.name
+            files = str(path / "*.parquet")
+        else:
+            return
+        self._connection.execute(
+            f"CREATE OR REPLACE VIEW \"{table_id}\" AS SELECT * FROM read_parquet('{files}')"
+        )
+
+    def _table_id(self, table: str, dataset: Optional[str] = None) -> str:
+        if table.count(".") >= 2:
+            return table
+        dataset = dataset or self.dataset
+        if "." in dataset:
+            return f"{dataset}.{table}"
+        return f"{self.project}.{dataset}.{table}"
+
+    def table_exists(self, table_id: str) -> bool:
+        """Return whether the table with the fully qualified ID exists."""
+        with self._lock:
+            return (
+                self.connection.execute(
+                    "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                    [table_id],
+                ).fetchone()[0]
+                > 0
+            )
+
+    def delete_table(self, table_id: str) -> None:
+        """Delete the table with the fully qualified ID if it exists."""
+        with self._lock:
+            self.connection.execute(f'DROP TABLE IF EXISTS "{table_id}"')
+
+    def execute(
+        self,
+        query: Union[str, List[str]],
+        destination_table: Optional[str] = None,
+        write_disposition: Optional[bigquery.job.WriteDisposition] = None,
+        clustering: Optional[List[str]] = None,
+        time_partitioning: Optional[str] = None,
+        partition_expiration_ms: Optional[int] = None,
+        dataset: Optional[str] = None,
+        join_keys: Optional[List[str]] = None,
+        annotations: Dict[str, Any] = {},
+        partition_range: Optional[Tuple[datetime, datetime]] = None,
+    ) -> None:
+        """
+        Execute a SQL query with the semantics of `BigQueryClient.execute`.
+
+        Partitions of the destination table are the rows with the same value
+        of the `time_partitioning` column.
+        """
+        if isinstance(query, list):
+            if not join_keys:
+                raise ValueError("multipart query specified without join keys")
+            query = self._joined(query, join_keys)
+
+        if callable(self.before_execute_callback):
+            self.before_execute_callback(query, None, annotations)
+
+        sql = translate(query)
+        with self._lock:
+            if destination_table is None:
+                self.connection.execute(sql)
+                return
+
+            table, _, partition = destination_table.partition("$")
+            table_id = self._table_id(table, dataset)
+            self.connection.execute(f'CREATE OR REPLACE TEMP TABLE "_results" AS {sql}')
+
+            if not self.table_exists(table_id):
+                self.connection.execute(f'CREATE TABLE "{table_id}" AS SELECT * FROM "_results"')
+                self.connection.execute('DROP TABLE "_results"')
+                return
+
+            self._add_columns(table_id)
+            if partition_range and time_partitioning:
+                start_date, end_date = partition_range
+                self.connection.execute(
+                    f'DELETE FROM "{table_id}" WHERE {time_partitioning} '
+                    + f"BETWEEN DATE '{start_date:%Y-%m-%d}' AND DATE '{end_date:%Y-%m-%d}'"
+                )
+            elif write_disposition == bigquery.job.WriteDisposition.WRITE_TRUNCATE:
+                if partition and time_partitioning:
+                    date = datetime.strptime(partition, "%Y%m%d")
+                    self.connection.execute(
+                        f'DELETE FROM "{table_id}" '
+                        + f"WHERE {time_partitioning} = DATE '{date:%Y-%m-%d}'"
+                    )
+                else:
+                    self.connection.execute(f'DELETE FROM "{table_id}"')
+            self.connection.execute(f'INSERT INTO "{table_id}" BY NAME SELECT * FROM "_results"')
+            self.connection.execute('DROP TABLE "_results"')
+
+    def _add_columns(self, table_id: str) -> None:
+        """Add columns of the results that are missing in the destination table."""
+        existing = {row[0] for row in self.connection.execute(f'DESCRIBE "{table_id}"').fetchall()}
+        for name, column_type, *_ in self.connection.execute('DESCRIBE "_results"').fetchall():
+            if name not in existing:
+                self.connection.execute(
+                    f'ALTER TABLE "{table_id}" ADD COLUMN "{name}" {column_type}'
+                )
+
+    def _joined(self, queries: List[str], join_keys: List[str]) -> str:
+        """Return a query joining the results of all parts on the join keys."""
+        parts = ",\n".join(f"_part{i} AS (\n{query}\n)" for i, query in enumerate(queries))
+        joins = "".join(
+            f"JOIN _part{i} ON "
+            + " AND ".join(f"_part0.{key} IS NOT DISTINCT FROM _part{i}.{key}" for key in join_keys)
+            + "\n"
+            for i in range(1, len(queries))
+        )
+        columns = ", ".join(
+            ["_part0.*"]
+            + [f"_part{i}.* EXCEPT({', '.join(join_keys)})" for i in range(1, len(queries))]
+        )
+        return f"WITH {parts}\nSELECT {columns}\nFROM _part0\n{joins}"
@@ -4,7 +4,7 @@ from typing import Optional
 
 import attr
 
-from .bigquery_log_handler import BigQueryLogHandler
+from .bigquery_log_handler import AsyncBigQueryLogHandler, BigQueryLogHandler
 
 
 @attr.s(auto_attribs=True)
@@ -16,6 +16,8 @@ class LogConfiguration:
     log_table_id: Optional[str]
     log_to_bigquery: bool = False
     capacity: int = 50
+    # write logs from a background thread instead of the thread that logged
+    asynchronous: bool = True
 
     def setup_logger(self, client=None):
         """Set up the logger."""
@@ -26,7 +28,8 @@ class LogConfiguration:
         logger = logging.getLogger()
 
         if self.log_to_bigquery:
-            bigquery_handler = BigQueryLogHandler(
+            handler_class = AsyncBigQueryLogHandler if self.asynchronous else BigQueryLogHandler
+            bigquery_handler = handler_class(
                 self.log_project_id, self.log_dataset_id, self.log_table_id, client, self.capacity
             )
             bigquery_handler.setLevel(logging.WARNING)
@@ -1,12 +1,32 @@
 """BigQuery Logger."""
 
 import datetime
+import logging
+import queue
+import threading
+import time
 from logging.handlers import BufferingHandler
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from google.cloud import bigquery
 
 
+def _record_to_json(record: logging.LogRecord) -> Dict[str, Any]:
+    """Convert a log record to a row of the logs table."""
+    return {
+        "timestamp": datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S"),
+        "slug": None if not hasattr(record, "slug") else record.slug,
+        "message": record.getMessage(),
+        "log_level": record.levelname,
+        "exception": str(record.exc_info),
+        "filename": record.filename,
+        "func_name": record.funcName,
+        "exception_type": (
+            record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        ),
+    }
+
+
 class BigQueryLogHandler(BufferingHandler):
     """Custom logging handler for writing logs to BigQuery."""
 
@@ -30,21 +50,7 @@ class BigQueryLogHandler(BufferingHandler):
 
     def _buffer_to_json(self, buffer):
         """Convert the records in the buffer to JSON."""
-        return [
-            {
-                "timestamp": datetime.datetime.fromtimestamp(record.created).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                ),
-                "slug": None if not hasattr(record, "slug") else record.slug,
-                "message": record.getMessage(),
-                "log_level": record.levelname,
-                "exception": str(record.exc_info),
-                "filename": record.filename,
-                "func_name": record.funcName,
-                "exception_type": None if not record.exc_info else record.exc_info[0].__name__,
-            }
-            for record in buffer
-        ]
+        return [_record_to_json(record) for record in buffer]
 
     def flush(self):
         """
@@ -65,3 +71,140 @@ class BigQueryLogHandler(BufferingHandler):
             pass
         finally:
             self.release()
+
+
+class AsyncBigQueryLogHandler(logging.Handler):
+    """
+    Logging handler writing logs to BigQuery from a background thread.
+
+    Records are converted to rows when they are logged and put into a bounded
+    queue, so logging never waits for BigQuery. A writer thread loads rows in
+    batches of up to `capacity` rows, or whatever has been queued after
+    `flush_interval` seconds. If the queue is full, new records are dropped and
+    the number of dropped records is logged with the next batch. Remaining rows
+    are written when the handler is closed, which `logging` does at exit.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        client: Optional[bigquery.Client] = None,
+        capacity: int = 50,
+        flush_interval: float = 5.0,
+        max_queue_size: int = 10000,
+        close_timeout: float = 30.0,
+    ):
+        """Instantiate an `AsyncBigQueryLogHandler` and start its writer thread."""
+        super().__init__()
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+        self.client = client or bigquery.Client(project_id)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.close_timeout = close_timeout
+        self.dropped = 0
+
+        # queued rows, and events set once the rows queued before a flush are written
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue_size)
+        self._flushes: "queue.Queue[threading.Event]" = queue.Queue()
+        self._stopped = threading.Event()
+        self._writer = threading.Thread(
+            target=self._write_batches, name="bigquery-log-writer", daemon=True
+        )
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Queue a record without blocking, dropping it if the queue is full."""
+        if self._stopped.is_set():
+            return
+        try:
+            self._queue.put_nowait(_record_to_json(record))
+        except queue.Full:
+            with self.lock:  # type: ignore
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """Wait until all queued records are written, for at most `close_timeout` seconds."""
+        if not self._writer.is_alive():
+            return
+
+        done = threading.Event()
+        self._flushes.put(done)
+        done.wait(self.close_timeout)
+
+    def close(self) -> None:
+        """Write the remaining records and stop the writer thread."""
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._writer.join(self.close_timeout)
+        super().close()
+
+    def _write_batches(self) -> None:
+        """Write queued rows in batches until the handler is closed."""
+        while True:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + self.flush_interval
+            flushes = []
+
+            while len(batch) < self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped.is_set() or not self._flushes.empty():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+                except queue.Empty:
+                    pass
+
+            # rows queued before a flush was requested are drained with the batch
+            while not self._flushes.empty():
+                flushes.append(self._flushes.get_nowait())
+            if flushes or self._stopped.is_set():
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            with self.lock:  # type: ignore
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                batch.append(self._dropped_row(dropped))
+
+            for start in range(0, len(batch), self.capacity):
+                end = start + self.capacity
+                self._write(batch[start:end])
+
+            for done in flushes:
+                done.set()
+            if self._stopped.is_set() and self._queue.empty():
+                return
+
+    def _dropped_row(self, dropped: int) -> Dict[str, Any]:
+        """Return a row reporting records that were dropped since the queue was full."""
+        return _record_to_json(
+            logging.LogRecord(
+                name=__name__,
+                level=logging.WARNING,
+                pathname=__file__,
+                lineno=0,
+                msg=f"Dropped {dropped} log records, the log queue was full",
+                args=None,
+                exc_info=None,
+                func="emit",
+            )
+        )
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        """Load rows into the logs table."""
+        if not rows:
+            return
+        try:
+            destination_table = f"{self.project_id}.{self.dataset_id}.{self.table_id}"
+            self.client.load_table_from_json(rows, destination_table).result()
+        except Exception as e:
+            print(f"Exception while flushing logs: {e}")
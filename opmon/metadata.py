@@ -1,20 +1,57 @@
 """Metadata handler for opmon projects."""
 
+import hashlib
+import json
 import os
+import uuid
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 import attr
-from jinja2 import Environment, FileSystemLoader
+from google.api_core.exceptions import BadRequest
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
 from metric_config_parser.monitoring import MonitoringConfiguration
 
-from opmon.bigquery_client import BigQueryClient
+from opmon.bigquery_client import STAGING_TABLE_EXPIRATION_HOURS, BigQueryClient
 from opmon.statistic import Summary
+from opmon.templates import render_template
+from opmon.views import ViewSync
 
 PATH = Path(os.path.dirname(__file__))
 PROJECTS_TABLE = "projects_v1"
 PROJECTS_FILENAME = "projects.sql"
-TEMPLATE_FOLDER = PATH / "templates"
+# maximum number of rows loaded into the staging table by a single job
+DEFAULT_BATCH_SIZE = 500
+
+PROJECTS_SCHEMA = [
+    bigquery.SchemaField("slug", "STRING"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("xaxis", "STRING"),
+    bigquery.SchemaField("branches", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("dimensions", "STRING", mode="REPEATED"),
+    bigquery.SchemaField(
+        "summaries",
+        "RECORD",
+        mode="REPEATED",
+        fields=[
+            bigquery.SchemaField("statistic", "STRING"),
+            bigquery.SchemaField("metric", "STRING"),
+            bigquery.SchemaField("metric_groups", "STRING", mode="REPEATED"),
+        ],
+    ),
+    bigquery.SchemaField("start_date", "DATE"),
+    bigquery.SchemaField("end_date", "DATE"),
+    bigquery.SchemaField("group_by_dimension", "STRING"),
+    bigquery.SchemaField("alerting", "BOOLEAN"),
+    bigquery.SchemaField("compact_visualization", "BOOLEAN"),
+    bigquery.SchemaField("fingerprint", "STRING"),
+]
+
+
+def _date(value: Optional[datetime]) -> Optional[str]:
+    return f"{value:%Y-%m-%d}" if value else None
 
 
 @attr.s(auto_attribs=True)
@@ -26,6 +63,9 @@ class Metadata:
     derived_dataset: str
     projects: List[Tuple[str, MonitoringConfiguration]]
     _client: Optional[BigQueryClient] = None
+    batch_size: int = DEFAULT_BATCH_SIZE
+    # if set, the view is only created if its definition changed
+    views: Optional[ViewSync] = None
 
     @property
     def bigquery(self):
@@ -35,36 +75,73 @@ class Metadata:
 
     def _render_sql(self, template_file: str, render_kwargs: Dict[str, Any]):
         """Render and return the SQL from a template."""
-        file_loader = FileSystemLoader(TEMPLATE_FOLDER)
-        env = Environment(loader=file_loader)
-        template = env.get_template(template_file)
-        sql = template.render(**render_kwargs)
-        return sql
-
-    def write(self) -> None:
-        """Update the BQ table with project metadata."""
-        destination_table = f"{self.project}.{self.derived_dataset}.{PROJECTS_TABLE}"
+        return render_template(template_file, render_kwargs)
+
+    def _project_row(self, slug: str, config: MonitoringConfiguration) -> Dict[str, Any]:
+        """Return the row of the projects table for a project."""
+        metric_groups: Dict[str, List[str]] = {}
+        for metric_group in config.project.metric_groups:
+            for metric in metric_group.metrics:
+                metric_groups.setdefault(metric.name, []).append(metric_group.name)
+
+        population = config.project.population
+        if len(population.branches) > 0:
+            branches = list(population.branches)
+        elif population.monitor_entire_population:
+            branches = ["active"]
+        else:
+            branches = ["enabled", "disabled"]
+
+        row = {
+            "slug": slug,
+            "name": config.project.name,
+            "xaxis": config.project.xaxis.value,
+            "branches": branches,
+            "dimensions": [dimension.name for dimension in config.dimensions],
+            "summaries": [
+                {
+                    "statistic": Summary.from_config(summary).statistic.name(),
+                    "metric": summary.metric.name,
+                    "metric_groups": metric_groups.get(summary.metric.name, []),
+                }
+                for summary in config.metrics
+            ],
+            "start_date": _date(config.project.start_date),
+            "end_date": _date(config.project.end_date),
+            "group_by_dimension": (
+                population.group_by_dimension.name if population.group_by_dimension else None
+            ),
+            "alerting": len(config.alerts) > 0,
+            "compact_visualization": bool(config.project.compact_visualization),
+        }
+        row["fingerprint"] = hashlib.sha256(
+            json.dumps(row, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return row
 
-        # check if projects metadata table exists; otherwise it needs to be created
-        first_run = True
+    def _fingerprints(self, destination_table: str) -> Dict[str, str]:
+        """Return the fingerprints of the rows in the projects table, keyed by slug."""
         try:
-            self.bigquery.client.get_table(destination_table)
-            first_run = False
-        except Exception:
-            first_run = True
+            rows = self.bigquery.client.query(
+                f"SELECT slug, fingerprint FROM `{destination_table}`"
+            ).result()
+            return {row["slug"]: row["fingerprint"] for row in rows}
+        except (NotFound, BadRequest):
+            # the table or its fingerprint column don't exist yet
+            return {}
 
-        project_metadata: List[Dict[str, Any]] = []
+    def write(self) -> None:
+        """
+        Update the BQ table with project metadata.
 
-        for slug, config in self.projects:
-            summaries = config.metrics
-            render_summaries = [
-                {
-                    "metric": summary.metric.name,
-                    "statistic": Summary.from_config(summary).statistic.name(),
-                }
-                for summary in summaries
-            ]
+        Only rows of projects whose metadata changed are written. They are
+        loaded into a staging table in batches of at most `batch_size` rows
+        and merged into the projects table by a single statement.
+        """
+        destination_table = f"{self.project}.{self.derived_dataset}.{PROJECTS_TABLE}"
 
+        rows: Dict[str, Dict[str, Any]] = {}
+        for slug, config in self.projects:
             if (
                 config.project
                 and config.project.end_date
@@ -72,45 +149,58 @@ class Metadata:
                 and config.project.end_date <= config.project.start_date
             ):
                 continue
-
-            metric_groups: Dict[str, List[Any]] = {}
-            for metric_group in config.project.metric_groups:
-                for metric in metric_group.metrics:
-                    if metric.name in metric_groups:
-                        metric_groups[metric.name].append(metric_group.name)
-                    else:
-                        metric_groups[metric.name] = [metric_group.name]
-
-            project_metadata.append(
-                {
-                    "slug": slug,
-                    "dimensions": config.dimensions,
-                    "summaries": render_summaries,
-                    "config": config.project,
-                    "alerts": config.alerts,
-                    "metric_groups": metric_groups,
-                }
-            )
-
-        render_kwargs = {
-            "gcp_project": self.project,
-            "dataset": self.dataset,
-            "derived_dataset": self.derived_dataset,
-            "table": PROJECTS_TABLE,
-            "projects": project_metadata,
-            "first_run": first_run,
-        }
-        query = self._render_sql(PROJECTS_FILENAME, render_kwargs=render_kwargs)
-        self.bigquery.execute(query)
+            rows[slug] = self._project_row(slug, config)
+
+        fingerprints = self._fingerprints(destination_table)
+        changed = [
+            row for slug, row in rows.items() if fingerprints.get(slug) != row["fingerprint"]
+        ]
+        if len(changed) == 0:
+            print("Project metadata is up to date")
+            return
+
+        staging_table = f"{PROJECTS_TABLE}_staging_{uuid.uuid4().hex[:12]}"
+        staging_table_id = f"{self.project}.{self.derived_dataset}.{staging_table}"
+        # the staging table expires in case it doesn't get deleted
+        staging = bigquery.Table(staging_table_id, schema=PROJECTS_SCHEMA)
+        staging.expires = datetime.now(timezone.utc) + timedelta(
+            hours=STAGING_TABLE_EXPIRATION_HOURS
+        )
+        job_config = bigquery.LoadJobConfig(
+            schema=PROJECTS_SCHEMA,
+            write_disposition=bigquery.job.WriteDisposition.WRITE_APPEND,
+        )
+        try:
+            self.bigquery.client.create_table(staging)
+            for start in range(0, len(changed), self.batch_size):
+                end = start + self.batch_size
+                self.bigquery.client.load_table_from_json(
+                    changed[start:end], staging_table_id, job_config=job_config
+                ).result()
+
+            render_kwargs = {
+                "gcp_project": self.project,
+                "derived_dataset": self.derived_dataset,
+                "table": PROJECTS_TABLE,
+                "staging_table": staging_table,
+                "columns": [field.name for field in PROJECTS_SCHEMA],
+            }
+            query = self._render_sql(PROJECTS_FILENAME, render_kwargs=render_kwargs)
+            self.bigquery.execute(query)
+        finally:
+            self.bigquery.client.delete_table(staging_table_id, not_found_ok=True)
 
         # Create view
         view_name = PROJECTS_TABLE.split("_")[0]
         view_query = f"""
             CREATE OR REPLACE VIEW `{self.project}.{self.dataset}.{view_name}` AS (
-                SELECT *
+                SELECT * EXCEPT(fingerprint)
                 FROM `{self.project}.{self.derived_dataset}.{PROJECTS_TABLE}`
             )
         """
 
-        self.bigquery.execute(view_query)
+        if self.views is None:
+            self.bigquery.execute(view_query)
+        else:
+            self.views.create(view_query)
         print("Updated project metadata")
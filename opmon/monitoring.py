@@ -3,40 +3,55 @@
 import itertools
 import os
 import re
+import uuid
 from asyncio.log import logger
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 
 import attr
-from google import cloud
 from google.cloud import bigquery
-from jinja2 import Environment, FileSystemLoader
 from metric_config_parser.alert import AlertType
 from metric_config_parser.monitoring import MonitoringConfiguration
+from metric_config_parser.project import MonitoringPeriod
 
 from opmon.platform import PLATFORM_CONFIGS
 
 from . import errors
-from .bigquery_client import BeforeExecuteCallback, BigQueryClient
+from .bigquery_client import (
+    DEFAULT_PART_PARALLELISM,
+    BeforeExecuteCallback,
+    BigQueryClient,
+    ExecutionEngine,
+)
+from .chunking import plan_chunks
+from .costs import BytesBudget
 from .dryrun import dry_run_query
+from .enrollment_index import EnrollmentIndex
 from .logging import LogConfiguration
-from .statistic import Summary
+from .shared_scans import SharedScan, shared_column_name
+from .statistic import BUCKETED_STATISTICS, Summary
+from .templates import render_template
 from .utils import bq_normalize_name
+from .views import ViewSync, parse_view
 
 PATH = Path(os.path.dirname(__file__))
 
 METRIC_QUERY_FILENAME = "metric_query.sql"
+POPULATION_QUERY_FILENAME = "population_query.sql"
 METRIC_VIEW_FILENAME = "metric_view.sql"
 ALERTS_QUERY_FILENAME = "alerts_query.sql"
 ALERTS_VIEW_FILENAME = "alerts_view.sql"
 STATISTICS_QUERY_FILENAME = "statistics_query.sql"
 STATISTICS_VIEW_FILENAME = "statistics_view.sql"
-TEMPLATE_FOLDER = PATH / "templates"
+STATISTICS_ROLLING_VIEW_FILENAME = "statistics_rolling_view.sql"
 DATA_TYPES = {"histogram", "scalar"}  # todo: enum
 SCHEMA_VERSIONS = {"metric": 1, "statistic": 2, "alert": 2}
 METRICS_JOIN_KEYS = ["client_id", "submission_date", "build_id", "branch"]
-MAX_DIMENSIONS_PER_METRIC_QUERY = 40
+# the population table is deleted after the metrics ran, expiration cleans up after failures
+POPULATION_TABLE_EXPIRATION_HOURS = 24
+# number of days statistics with a mergeable state are aggregated over in the rolling view
+ROLLING_WINDOW_DAYS = 7
 
 
 @attr.s(auto_attribs=True)
@@ -49,7 +64,8 @@ class Monitoring:
     slug: str
     config: MonitoringConfiguration
     log_config: Optional[LogConfiguration] = None
-    _client: Optional[BigQueryClient] = None
+    # Engine the SQL is executed with, defaults to BigQuery.
+    _client: Optional[ExecutionEngine] = None
 
     # Optional callback invoked before each BigQuery `execute`.  Parameters are
     # the BigQuery SQL string, the BigQuery job configuration (or `None`, when
@@ -57,11 +73,33 @@ class Monitoring:
     # e.g., including a relevant date, query type, etc.
     before_execute_callback: Optional[BeforeExecuteCallback] = None
 
+    # Maximum number of parts of a multipart metrics query that run concurrently.
+    part_parallelism: int = DEFAULT_PART_PARALLELISM
+
+    # Scans shared with other projects, keyed by the name of the data source they replace.
+    shared_scans: Dict[str, SharedScan] = attr.Factory(dict)
+
+    # Index the population of the project is read from, shared with other projects.
+    enrollment_index: Optional[EnrollmentIndex] = None
+
+    # Budget of bytes processed shared with other projects of the run, queries
+    # are dry run first if set.
+    budget: Optional[BytesBudget] = None
+
+    # Views shared with other projects, views are only created if their definition
+    # changed if set.
+    views: Optional[ViewSync] = None
+
     @property
     def bigquery(self):
-        """Return the BigQuery client instance."""
+        """Return the engine executing the SQL, a BigQuery client unless set otherwise."""
         if not self._client:
-            self._client = BigQueryClient(project=self.project, dataset=self.dataset)
+            self._client = BigQueryClient(
+                project=self.project,
+                dataset=self.dataset,
+                part_parallelism=self.part_parallelism,
+                budget=self.budget,
+            )
             self._client.before_execute_callback = self.before_execute_callback
         return self._client
 
@@ -76,11 +114,28 @@ class Monitoring:
             print(f"Skipping {self.slug}")
             return True
 
+        self.run_metrics(submission_date)
+        self.create_metrics_view(submission_date)
+        self.run_statistics(submission_date)
+        self.create_statistics_view(submission_date)
+        self.run_alerts(submission_date)
+
+        return True
+
+    def run_metrics(self, submission_date: datetime, start_date: Optional[datetime] = None) -> None:
+        """
+        Run the metrics stage of the ETL for a specific date.
+
+        If `start_date` is set, all dates from `start_date` to `submission_date` are
+        computed in a single job.
+        """
         print(f"Run metrics query for {self.slug}")
-        self._run_metrics_sql(submission_date)
+        self._run_metrics_sql(submission_date, start_date)
 
+    def create_metrics_view(self, submission_date: datetime) -> None:
+        """Run the metrics view stage of the ETL."""
         print(f"Create metrics view for {self.slug}")
-        self.bigquery.execute(
+        self._create_view(
             self._get_metric_view_sql(),
             annotations={
                 "slug": self.slug,
@@ -89,11 +144,22 @@ class Monitoring:
             },
         )
 
+    def run_statistics(
+        self, submission_date: datetime, start_date: Optional[datetime] = None
+    ) -> None:
+        """
+        Run the statistics stage of the ETL for a specific date.
+
+        If `start_date` is set, all dates from `start_date` to `submission_date` are
+        computed in a single job.
+        """
         print(f"Calculate statistics for {self.slug}")
-        self._run_statistics_sql(submission_date)
+        self._run_statistics_sql(submission_date, start_date)
 
+    def create_statistics_view(self, submission_date: datetime) -> None:
+        """Run the statistics view stage of the ETL."""
         print(f"Create statistics view for {self.slug}")
-        self.bigquery.execute(
+        self._create_view(
             self._get_statistics_view_sql(),
             annotations={
                 "slug": self.slug,
@@ -102,12 +168,47 @@ class Monitoring:
             },
         )
 
+        rolling_view_sql = self._get_statistics_rolling_view_sql()
+        if rolling_view_sql:
+            self._create_view(
+                rolling_view_sql,
+                annotations={
+                    "slug": self.slug,
+                    "type": "statistics_rolling_view",
+                    "submission_date": submission_date,
+                },
+            )
+
+    def _create_view(self, sql: str, annotations: Dict[str, Any]) -> None:
+        """Create a view, unless `views` is set and the deployed view is up to date."""
+        if self.views is None:
+            self.bigquery.execute(sql, annotations=annotations)
+        elif not self.views.create(sql, annotations=annotations):
+            print(f"View {parse_view(sql)[0]} is up to date")
+
+    def run_alerts(self, submission_date: datetime) -> None:
+        """Run the alerts stage of the ETL for a specific date."""
         print(f"Create alerts data for {self.slug}")
         self._run_sql_for_alerts(submission_date)
 
-        return True
+    def supports_date_ranges(self) -> bool:
+        """Return whether multiple dates can be computed in a single job."""
+        return self.config.project is not None and self.config.project.xaxis == MonitoringPeriod.DAY
+
+    def _partition_args(
+        self, table_name: str, submission_date: datetime, start_date: Optional[datetime]
+    ) -> Dict[str, Any]:
+        """Return the destination arguments for writing one or multiple date partitions."""
+        if start_date is None:
+            return {"destination_table": f"{table_name}${submission_date:%Y%m%d}"}
+
+        if not self.supports_date_ranges():
+            raise errors.ConfigurationException(
+                self.slug, "Date ranges are only supported for projects using submission_date."
+            )
+        return {"destination_table": table_name, "partition_range": (start_date, submission_date)}
 
-    def _run_metrics_sql(self, submission_date: datetime):
+    def _run_metrics_sql(self, submission_date: datetime, start_date: Optional[datetime] = None):
         """Generate and execute the ETL for a specific data type."""
         try:
             self._check_runnable(submission_date)
@@ -117,88 +218,112 @@ class Monitoring:
 
         table_name = f"{self.normalized_slug}_v{SCHEMA_VERSIONS['metric']}"
 
-        join_keys = METRICS_JOIN_KEYS
-        for dimension in self.config.dimensions:
-            join_keys.append(dimension.name)
+        join_keys = METRICS_JOIN_KEYS + [dimension.name for dimension in self.config.dimensions]
 
-        self.bigquery.execute(
-            self._get_metrics_sql(submission_date=submission_date, table_name=table_name),
-            destination_table=f"{table_name}${submission_date:%Y%m%d}",
-            clustering=["build_id"],
-            time_partitioning="submission_date",
-            write_disposition=bigquery.job.WriteDisposition.WRITE_TRUNCATE,
-            dataset=self.derived_dataset,
-            join_keys=join_keys,
-            annotations={
-                "slug": self.slug,
-                "type": "metrics_query",
-                "submission_date": submission_date,
-            },
-        )
+        # metrics split into multiple queries share a population that is computed once
+        population_table = None
+        if len(plan_chunks(self._metrics_per_dataset())) > 1:
+            population_table = self._population_table_name(submission_date, start_date)
+            self.bigquery.execute(
+                self._get_population_sql(submission_date, population_table, start_date),
+                annotations={
+                    "slug": self.slug,
+                    "type": "population_query",
+                    "submission_date": submission_date,
+                },
+            )
+
+        try:
+            self.bigquery.execute(
+                self._get_metrics_sql(
+                    submission_date=submission_date,
+                    table_name=table_name,
+                    start_date=start_date,
+                    population_table=population_table,
+                ),
+                clustering=["build_id"],
+                time_partitioning="submission_date",
+                write_disposition=bigquery.job.WriteDisposition.WRITE_TRUNCATE,
+                dataset=self.derived_dataset,
+                join_keys=join_keys,
+                annotations={
+                    "slug": self.slug,
+                    "type": "metrics_query",
+                    "submission_date": submission_date,
+                },
+                **self._partition_args(table_name, submission_date, start_date),
+            )
+        finally:
+            if population_table:
+                self.bigquery.delete_table(
+                    f"{self.project}.{self.derived_dataset}.{population_table}"
+                )
 
     def _render_sql(self, template_file: str, render_kwargs: Dict[str, Any]):
         """Render and return the SQL from a template."""
-        file_loader = FileSystemLoader(TEMPLATE_FOLDER)
-        env = Environment(loader=file_loader)
-        template = env.get_template(template_file)
-        sql = template.render(**render_kwargs)
-        return sql
+        return render_template(template_file, render_kwargs)
 
     def _app_id_to_bigquery_dataset(self, app_id: Optional[str]) -> Optional[str]:
         if app_id is None:
             return None
         return re.sub(r"[^a-zA-Z0-9]", "_", app_id).lower()
 
-    def _get_metrics_sql(
-        self,
-        submission_date: datetime,
-        first_run: Optional[bool] = None,
-        table_name: Optional[str] = None,
-    ) -> Union[str, List[str]]:
-        """Return SQL for data_type ETL."""
-        metrics = self.config.metrics
-
-        if len(metrics) == 0:
-            # There are no metrics for this data source + data type combo
-            logger.warning(
-                f"No metrics configured for {self.slug}.",
-                extra={"experiment": self.slug},
-            )
-
-        # group metrics that are part of the same dataset
-        # necessary for creating the SQL template
-        metrics_per_dataset = {}
-        for metric in metrics:
+    def _metrics_per_dataset(self) -> Dict[str, List[Any]]:
+        """Group metrics that are part of the same dataset."""
+        metrics_per_dataset: Dict[str, List[Any]] = {}
+        for metric in self.config.metrics:
             if metric.metric.data_source.name not in metrics_per_dataset:
                 metrics_per_dataset[metric.metric.data_source.name] = [metric.metric]
             else:
                 if metric.metric not in metrics_per_dataset[metric.metric.data_source.name]:
                     metrics_per_dataset[metric.metric.data_source.name].append(metric.metric)
+        return metrics_per_dataset
+
+    def _shared_scan_tables(
+        self, submission_date: datetime, start_date: Optional[datetime] = None
+    ) -> Dict[str, str]:
+        """Return the tables of shared scans keyed by the data source they replace."""
+        # shared tables only contain the date they were planned for
+        return {
+            data_source: scan.table_id
+            for data_source, scan in self.shared_scans.items()
+            if start_date is None and scan.submission_date == submission_date and not scan.failed
+        }
 
-        # check if this is the first time the queries are executed
-        # the queries are referencing the destination table if build_id is used for the time frame
-        if first_run is None:
-            first_run = True
-            if table_name is not None:
-                try:
-                    self.bigquery.client.get_table(
-                        f"{self.project}.{self.derived_dataset}.{table_name}"
-                    )
-                except cloud.exceptions.NotFound:
-                    first_run = True
-                else:
-                    first_run = False
-
-        render_kwargs = {
+    def _enrollment_index_table(
+        self, submission_date: datetime, start_date: Optional[datetime] = None
+    ) -> Optional[str]:
+        """Return the table of the enrollment index the population is read from."""
+        if (
+            self.enrollment_index is None
+            or start_date is not None
+            or self.enrollment_index.submission_date != submission_date
+            or self.enrollment_index.failed
+        ):
+            return None
+        return self.enrollment_index.table_id
+
+    def shared_tables(self, submission_date: datetime) -> List[str]:
+        """Return the IDs of tables shared with other projects the metrics of a date read from."""
+        tables = list(self._shared_scan_tables(submission_date).values())
+        enrollment_index = self._enrollment_index_table(submission_date)
+        if enrollment_index:
+            tables.append(enrollment_index)
+        return tables
+
+    def _population_render_kwargs(
+        self, submission_date: datetime, start_date: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """Return the parameters for rendering the population of the project."""
+        return {
             "header": "-- Generated via opmon\n",
             "gcp_project": self.project,
             "submission_date": submission_date,
+            "start_date": start_date,
             "config": self.config.project,
             "dataset": self.dataset,
-            "first_run": first_run,
             "slug": self.slug,
             "normalized_slug": self.normalized_slug,
-            "table_version": SCHEMA_VERSIONS["metric"],
             "is_glean_app": PLATFORM_CONFIGS[
                 self.config.project.app_name or "firefox_desktop"
                 if self.config.project
@@ -217,34 +342,89 @@ class Monitoring:
                 )
             ),
             "dimensions": self.config.dimensions,
+            "enrollment_index": self._enrollment_index_table(submission_date, start_date),
         }
 
-        sql_filename = METRIC_QUERY_FILENAME
+    def _population_table_name(
+        self, submission_date: datetime, start_date: Optional[datetime] = None
+    ) -> str:
+        dates = f"{submission_date:%Y%m%d}"
+        if start_date:
+            dates = f"{start_date:%Y%m%d}_{dates}"
+        # concurrent runs for the same dates, e.g. a backfill and a daily run, use their own table
+        return f"{self.normalized_slug}_population_{dates}_{uuid.uuid4().hex[:12]}"
 
-        # chunk queries and render multiple times
-        i = MAX_DIMENSIONS_PER_METRIC_QUERY
-        metrics_chunk: Dict[str, Any] = {}
-        sql = []
-        for data_source, metrics in metrics_per_dataset.items():
-            for metric in metrics:
-                if i <= 0:
-                    sql.append(
-                        self._render_sql(
-                            sql_filename, {"metrics_per_dataset": metrics_chunk, **render_kwargs}
-                        )
-                    )
-                    i = MAX_DIMENSIONS_PER_METRIC_QUERY
-                    metrics_chunk = {}
+    def _get_population_sql(
+        self,
+        submission_date: datetime,
+        population_table: str,
+        start_date: Optional[datetime] = None,
+    ) -> str:
+        """Return the SQL that materializes the population into a short-lived table."""
+        render_kwargs = {
+            **self._population_render_kwargs(submission_date, start_date),
+            "derived_dataset": self.derived_dataset,
+            "population_table": population_table,
+            "expiration_hours": POPULATION_TABLE_EXPIRATION_HOURS,
+        }
+        return self._render_sql(POPULATION_QUERY_FILENAME, render_kwargs)
 
-                if data_source not in metrics_chunk:
-                    metrics_chunk[data_source] = [metric]
-                else:
-                    metrics_chunk[data_source].append(metric)
-                i -= 1
+    def _get_metrics_sql(
+        self,
+        submission_date: datetime,
+        first_run: Optional[bool] = None,
+        table_name: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        population_table: Optional[str] = None,
+    ) -> Union[str, List[str]]:
+        """
+        Return SQL for data_type ETL.
+
+        If `start_date` is set, the SQL computes all dates from `start_date`
+        to `submission_date`. If `population_table` is set, the population is
+        read from that table instead of being computed by every query. Metrics
+        of data sources with a shared scan for `submission_date` are read from
+        the table of the scan, the population is read from the enrollment index
+        if one is set for `submission_date`.
+        """
+        if len(self.config.metrics) == 0:
+            # There are no metrics for this data source + data type combo
+            logger.warning(
+                f"No metrics configured for {self.slug}.",
+                extra={"experiment": self.slug},
+            )
+
+        # group metrics that are part of the same dataset
+        # necessary for creating the SQL template
+        metrics_per_dataset = self._metrics_per_dataset()
 
-        sql.append(
+        # check if this is the first time the queries are executed
+        # the queries are referencing the destination table if build_id is used for the time frame
+        if first_run is None:
+            first_run = True
+            if table_name is not None:
+                first_run = not self.bigquery.table_exists(
+                    f"{self.project}.{self.derived_dataset}.{table_name}"
+                )
+
+        render_kwargs = {
+            **self._population_render_kwargs(submission_date, start_date),
+            "first_run": first_run,
+            "shared_scans": self._shared_scan_tables(submission_date, start_date),
+            "shared_column": shared_column_name,
+            "table_version": SCHEMA_VERSIONS["metric"],
+            "population_table": f"{self.project}.{self.derived_dataset}.{population_table}"
+            if population_table
+            else None,
+        }
+
+        sql_filename = METRIC_QUERY_FILENAME
+
+        # split metrics into multiple queries, keeping metrics of a data source together
+        sql = [
             self._render_sql(sql_filename, {"metrics_per_dataset": metrics_chunk, **render_kwargs})
-        )
+            for metrics_chunk in plan_chunks(metrics_per_dataset)
+        ]
 
         if len(sql) == 1:
             return sql[0]
@@ -263,18 +443,18 @@ class Monitoring:
         sql = self._render_sql(METRIC_VIEW_FILENAME, render_kwargs)
         return sql
 
-    def _run_statistics_sql(self, submission_date):
+    def _run_statistics_sql(self, submission_date, start_date: Optional[datetime] = None):
         table_name = f"{self.normalized_slug}_statistics_v{SCHEMA_VERSIONS['statistic']}"
         self.bigquery.execute(
-            self._get_statistics_sql(submission_date=submission_date),
-            destination_table=f"{table_name}${submission_date:%Y%m%d}",
+            self._get_statistics_sql(submission_date=submission_date, start_date=start_date),
             clustering=["build_id"],
             time_partitioning="submission_date",
             write_disposition=bigquery.job.WriteDisposition.WRITE_TRUNCATE,
             dataset=self.derived_dataset,
+            **self._partition_args(table_name, submission_date, start_date),
         )
 
-    def _get_statistics_sql(self, submission_date) -> str:
+    def _get_statistics_sql(self, submission_date, start_date: Optional[datetime] = None) -> str:
         """Return the SQL to run the statistics."""
         render_kwargs = {
             "gcp_project": self.project,
@@ -289,7 +469,9 @@ class Monitoring:
                 if any(i)
             ],
             "summaries": [Summary.from_config(summary) for summary in self.config.metrics],
+            "bucketed_statistics": BUCKETED_STATISTICS,
             "submission_date": submission_date,
+            "start_date": start_date,
             "table_version": SCHEMA_VERSIONS["metric"],
         }
         sql = self._render_sql(STATISTICS_QUERY_FILENAME, render_kwargs)
@@ -310,6 +492,34 @@ class Monitoring:
         sql = self._render_sql(STATISTICS_VIEW_FILENAME, render_kwargs)
         return sql
 
+    def _get_statistics_rolling_view_sql(self) -> Optional[str]:
+        """
+        Return the SQL to create a view of statistics over rolling windows.
+
+        Only statistics with a mergeable state are part of the view. Returns
+        `None` if there are none or the project is not aggregated by submission date.
+        """
+        summaries = [
+            summary
+            for summary in (Summary.from_config(summary) for summary in self.config.metrics)
+            if summary.statistic.state(summary.metric) is not None
+        ]
+        if len(summaries) == 0 or not self.supports_date_ranges():
+            return None
+
+        render_kwargs = {
+            "header": "-- Generated via opmon\n",
+            "gcp_project": self.project,
+            "dataset": self.dataset,
+            "derived_dataset": self.derived_dataset,
+            "normalized_slug": self.normalized_slug,
+            "table_version": SCHEMA_VERSIONS["statistic"],
+            "summaries": summaries,
+            "dimensions": self.config.dimensions,
+            "window_days": ROLLING_WINDOW_DAYS,
+        }
+        return self._render_sql(STATISTICS_ROLLING_VIEW_FILENAME, render_kwargs)
+
     def _check_runnable(self, current_date: Optional[datetime] = None) -> bool:
         """Check whether the opmon project can be run based on configuration parameters."""
         if self.config.project is None:
@@ -376,7 +586,7 @@ class Monitoring:
         )
 
         print(f"Create alerts view for {self.slug}")
-        self.bigquery.execute(
+        self._create_view(
             self._get_alerts_view_sql(),
             annotations={
                 "slug": self.slug,
@@ -398,7 +608,12 @@ class Monitoring:
         return sql
 
     def validate(self) -> None:
-        """Validate ETL and configs of opmon project."""
+        """
+        Validate ETL and configs of opmon project.
+
+        The metrics, statistics and alerts SQL is dry run concurrently. If
+        multiple queries are invalid, `DryRunFailures` is raised with all of them.
+        """
         self._check_runnable()
 
         if self.config.project and self.config.project.skip:
@@ -408,6 +623,8 @@ class Monitoring:
             submission_date=self.config.project.start_date,  # type: ignore
             first_run=True,
         )
+        # independent queries are collected and dry run concurrently
+        queries: List[str] = list(metrics_sql) if isinstance(metrics_sql, list) else [metrics_sql]
         print(f"Dry run metrics SQL for {self.normalized_slug}")
 
         if callable(self.before_execute_callback):
@@ -454,7 +671,6 @@ class Monitoring:
                         "submission_date": self.config.project.start_date,
                     },
                 )
-        dry_run_query(metrics_sql)
 
         dummy_metrics = {}
         for summary in self.config.metrics:
@@ -523,7 +739,7 @@ class Monitoring:
                     "submission_date": self.config.project.start_date,
                 },
             )
-        dry_run_query(statistics_sql)
+        queries.append(statistics_sql)
 
         total_alerts = 0
         for _ in self.config.alerts:
@@ -578,4 +794,7 @@ class Monitoring:
                         "submission_date": self.config.project.start_date,
                     },
                 )
-            dry_run_query(alerts_sql)
+            queries.append(alerts_sql)
+
+        # raises with the failures of all queries
+        dry_run_query(queries)
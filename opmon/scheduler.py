@@ -0,0 +1,428 @@
+"""Schedule the stages of opmon projects as a dependency graph.
+
+Instead of running the whole ETL chain of a project on a single worker, every
+project-day is split into stage tasks. Tasks become ready once all of their
+dependencies have finished and are run across all projects, with a separate
+concurrency limit for each type of stage. Ready tasks on the longest remaining
+critical path are started first.
+"""
+
+import enum
+import heapq
+import itertools
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import attr
+from metric_config_parser.alert import AlertType
+from metric_config_parser.project import MonitoringPeriod
+
+from opmon.bigquery_client import BigQueryClient
+from opmon.enrollment_index import EnrollmentIndex
+from opmon.monitoring import Monitoring
+from opmon.shared_scans import SharedScan
+from opmon.statistic import BUCKETED_STATISTICS
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(enum.Enum):
+    """Stages of the monitoring ETL."""
+
+    METRICS = "metrics"
+    METRICS_VIEW = "metrics_view"
+    STATISTICS = "statistics"
+    STATISTICS_VIEW = "statistics_view"
+    ALERTS = "alerts"
+
+
+# Relative weight of a stage, used to estimate the length of critical paths.
+STAGE_WEIGHTS = {
+    Stage.METRICS: 10.0,
+    Stage.METRICS_VIEW: 0.1,
+    Stage.STATISTICS: 5.0,
+    Stage.STATISTICS_VIEW: 0.1,
+    Stage.ALERTS: 1.0,
+}
+
+
+@attr.s(auto_attribs=True, eq=False)
+class Task:
+    """A single stage of a project that can be scheduled."""
+
+    name: str
+    stage: Stage
+    run: Callable[[], Any]
+    cost: float = 1.0
+    dependencies: List["Task"] = attr.Factory(list)
+    slug: Optional[str] = None
+
+
+@attr.s(auto_attribs=True)
+class Scheduler:
+    """Run tasks in dependency order with per-stage concurrency limits."""
+
+    parallelism: int = 8
+    stage_parallelism: Dict[Stage, int] = attr.Factory(dict)
+
+    def _limit(self, stage: Stage) -> int:
+        return max(1, self.stage_parallelism.get(stage, self.parallelism))
+
+    @staticmethod
+    def _critical_paths(tasks: List[Task]) -> Dict[Task, float]:
+        """Return the cost of the longest path starting at each task."""
+        dependents: Dict[Task, List[Task]] = {task: [] for task in tasks}
+        for task in tasks:
+            for dependency in task.dependencies:
+                dependents[dependency].append(task)
+
+        paths: Dict[Task, float] = {}
+        visiting = set()
+
+        def visit(task: Task) -> float:
+            if task in paths:
+                return paths[task]
+            if task in visiting:
+                raise ValueError(f"Cyclic dependency detected for task {task.name}")
+            visiting.add(task)
+            paths[task] = task.cost + max(
+                (visit(dependent) for dependent in dependents[task]), default=0.0
+            )
+            visiting.remove(task)
+            return paths[task]
+
+        for task in tasks:
+            visit(task)
+        return paths
+
+    def run(self, tasks: List[Task]) -> Dict[str, bool]:
+        """
+        Run all tasks and return whether each of them succeeded, keyed by task name.
+
+        Tasks that depend on a failed task are not run and are reported as failed.
+        """
+        for task in tasks:
+            for dependency in task.dependencies:
+                if dependency not in tasks:
+                    raise ValueError(f"Dependency {dependency.name} of {task.name} not scheduled")
+
+        critical_paths = self._critical_paths(tasks)
+        remaining = {task: len(set(task.dependencies)) for task in tasks}
+        dependents: Dict[Task, List[Task]] = {task: [] for task in tasks}
+        for task in tasks:
+            for dependency in set(task.dependencies):
+                dependents[dependency].append(task)
+
+        counter = itertools.count()
+        ready: List[Tuple[float, int, Task]] = []
+        for task in tasks:
+            if remaining[task] == 0:
+                heapq.heappush(ready, (-critical_paths[task], next(counter), task))
+
+        results: Dict[str, bool] = {}
+        running: Dict[Future, Task] = {}
+        running_per_stage = {stage: 0 for stage in Stage}
+
+        def skip(task: Task) -> None:
+            for dependent in dependents[task]:
+                if dependent.name not in results:
+                    results[dependent.name] = False
+                    logger.warning(
+                        f"Skipping {dependent.name} since {task.name} did not succeed",
+                        extra={"experiment": dependent.slug},
+                    )
+                    skip(dependent)
+
+        workers = sum(self._limit(stage) for stage in Stage)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while ready or running:
+                deferred = []
+                while ready:
+                    entry = heapq.heappop(ready)
+                    task = entry[2]
+                    if running_per_stage[task.stage] >= self._limit(task.stage):
+                        deferred.append(entry)
+                        continue
+                    running_per_stage[task.stage] += 1
+                    running[executor.submit(task.run)] = task
+                for entry in deferred:
+                    heapq.heappush(ready, entry)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    running_per_stage[task.stage] -= 1
+                    exception = future.exception()
+
+                    if exception is not None:
+                        logger.exception(
+                            f"Error running {task.name}: {exception}",
+                            exc_info=exception,
+                            extra={"experiment": task.slug},
+                        )
+                        results[task.name] = False
+                        skip(task)
+                        continue
+
+                    results[task.name] = True
+                    for dependent in dependents[task]:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0 and dependent.name not in results:
+                            heapq.heappush(
+                                ready, (-critical_paths[dependent], next(counter), dependent)
+                            )
+
+        return results
+
+
+def monitoring_tasks(
+    monitoring: Monitoring,
+    submission_date: datetime,
+    shared_tables: Optional[Dict[str, Task]] = None,
+    cost_factor: float = 1.0,
+) -> List[Task]:
+    """
+    Return the stage tasks for running a project for a specific date.
+
+    `shared_tables` are the tasks computing tables shared by multiple projects,
+    keyed by table ID. The metrics of the project are computed after the shared
+    tables it reads from.
+
+    The costs of the metrics and statistics tasks are scaled by `cost_factor`,
+    e.g. the bytes the project usually processes relative to other projects.
+    """
+    config = monitoring.config
+    name = f"{monitoring.slug}:{submission_date:%Y-%m-%d}"
+    metrics_count = max(1, len(config.metrics))
+
+    metrics = Task(
+        name=f"{name}:{Stage.METRICS.value}",
+        stage=Stage.METRICS,
+        run=partial(monitoring.run_metrics, submission_date),
+        cost=STAGE_WEIGHTS[Stage.METRICS] * metrics_count * cost_factor,
+        slug=monitoring.slug,
+    )
+    if shared_tables:
+        metrics.dependencies = [
+            shared_tables[table]
+            for table in monitoring.shared_tables(submission_date)
+            if table in shared_tables
+        ]
+    metrics_view = Task(
+        name=f"{name}:{Stage.METRICS_VIEW.value}",
+        stage=Stage.METRICS_VIEW,
+        run=partial(monitoring.create_metrics_view, submission_date),
+        cost=STAGE_WEIGHTS[Stage.METRICS_VIEW],
+        dependencies=[metrics],
+        slug=monitoring.slug,
+    )
+    statistics = Task(
+        name=f"{name}:{Stage.STATISTICS.value}",
+        stage=Stage.STATISTICS,
+        run=partial(monitoring.run_statistics, submission_date),
+        cost=STAGE_WEIGHTS[Stage.STATISTICS] * metrics_count * cost_factor,
+        dependencies=[metrics_view],
+        slug=monitoring.slug,
+    )
+    statistics_view = Task(
+        name=f"{name}:{Stage.STATISTICS_VIEW.value}",
+        stage=Stage.STATISTICS_VIEW,
+        run=partial(monitoring.create_statistics_view, submission_date),
+        cost=STAGE_WEIGHTS[Stage.STATISTICS_VIEW],
+        dependencies=[statistics],
+        slug=monitoring.slug,
+    )
+    alerts = Task(
+        name=f"{name}:{Stage.ALERTS.value}",
+        stage=Stage.ALERTS,
+        run=partial(monitoring.run_alerts, submission_date),
+        cost=STAGE_WEIGHTS[Stage.ALERTS] * max(1, len(config.alerts)),
+        dependencies=[statistics_view],
+        slug=monitoring.slug,
+    )
+
+    return [metrics, metrics_view, statistics, statistics_view, alerts]
+
+
+def shared_scan_task(
+    scan: SharedScan,
+    bigquery: BigQueryClient,
+    enrollment_indexes: Optional[Dict[str, Task]] = None,
+) -> Task:
+    """
+    Return the task computing a scan shared by multiple projects.
+
+    `enrollment_indexes` are the tasks building enrollment indexes keyed by
+    table ID. The scan is computed after the indexes the populations of its
+    projects are read from.
+
+    The task doesn't fail if the scan fails, the projects reading from the scan
+    then scan the data source themselves.
+    """
+    task = Task(
+        name=f"{scan.table_name}:{Stage.METRICS.value}",
+        stage=Stage.METRICS,
+        run=partial(scan.run, bigquery),
+        cost=STAGE_WEIGHTS[Stage.METRICS] * max(1, len(scan.expressions)),
+    )
+    if enrollment_indexes:
+        task.dependencies = [
+            enrollment_indexes[table]
+            for table in scan.enrollment_indexes()
+            if table in enrollment_indexes
+        ]
+    return task
+
+
+def enrollment_index_task(index: EnrollmentIndex, bigquery: BigQueryClient) -> Task:
+    """
+    Return the task building an enrollment index shared by multiple projects.
+
+    The task doesn't fail if the index fails, the projects reading from the
+    index then derive their population from the data source themselves.
+    """
+    return Task(
+        name=f"{index.table_name}:{Stage.METRICS.value}",
+        stage=Stage.METRICS,
+        run=partial(index.run, bigquery),
+        cost=STAGE_WEIGHTS[Stage.METRICS],
+    )
+
+
+def backfill_tasks(
+    monitoring: Monitoring, dates: List[datetime], days_per_job: int = 1
+) -> List[Task]:
+    """
+    Return the stage tasks for backfilling a project over multiple dates.
+
+    Dates are only chained where results of one date are used by another:
+
+    * metrics of projects aggregated by build ID depend on the previous date
+    * statistics depend on the metrics of all prior dates if percentiles are
+      computed, since their buckets are derived from the metrics history
+    * alerts depend on the statistics of all prior dates if they compare
+      against historical windows
+
+    Views are independent of the date and only get created once.
+
+    For projects that support date ranges, metrics and statistics of up to
+    `days_per_job` consecutive dates are computed by a single task.
+    Projects configured to be skipped don't get any tasks.
+    """
+    config = monitoring.config
+    if len(dates) == 0:
+        return []
+    if config.project is not None and config.project.skip:
+        print(f"Skipping {monitoring.slug}")
+        return []
+
+    metrics_count = max(1, len(config.metrics))
+    by_build_id = config.project is not None and config.project.xaxis == MonitoringPeriod.BUILD_ID
+    uses_metrics_history = any(
+        summary.statistic.name in BUCKETED_STATISTICS for summary in config.metrics
+    )
+    uses_statistics_history = any(alert.type == AlertType.AVG_DIFF for alert in config.alerts)
+
+    if days_per_job < 1 or not monitoring.supports_date_ranges():
+        days_per_job = 1
+    windows: List[List[datetime]] = []
+    for date in dates:
+        if len(windows) == 0 or len(windows[-1]) == days_per_job:
+            windows.append([])
+        windows[-1].append(date)
+
+    def task(stage: Stage, window: List[datetime], run: Callable[[], Any], cost: float) -> Task:
+        date = f"{window[0]:%Y-%m-%d}"
+        if len(window) > 1:
+            date += f"..{window[-1]:%Y-%m-%d}"
+        return Task(
+            name=f"{monitoring.slug}:{date}:{stage.value}",
+            stage=stage,
+            run=run,
+            cost=cost * len(window),
+            slug=monitoring.slug,
+        )
+
+    def window_args(window: List[datetime]) -> Dict[str, Any]:
+        if len(window) == 1:
+            return {"submission_date": window[0]}
+        return {"submission_date": window[-1], "start_date": window[0]}
+
+    metrics: List[Task] = []
+    for window in windows:
+        metrics.append(
+            task(
+                Stage.METRICS,
+                window,
+                partial(monitoring.run_metrics, **window_args(window)),
+                STAGE_WEIGHTS[Stage.METRICS] * metrics_count,
+            )
+        )
+        if by_build_id and len(metrics) > 1:
+            metrics[-1].dependencies.append(metrics[-2])
+
+    metrics_view = task(
+        Stage.METRICS_VIEW,
+        dates[:1],
+        partial(monitoring.create_metrics_view, dates[0]),
+        STAGE_WEIGHTS[Stage.METRICS_VIEW],
+    )
+    metrics_view.dependencies.append(metrics[0])
+
+    statistics: List[Task] = []
+    for i, window in enumerate(windows):
+        statistics.append(
+            task(
+                Stage.STATISTICS,
+                window,
+                partial(monitoring.run_statistics, **window_args(window)),
+                STAGE_WEIGHTS[Stage.STATISTICS] * metrics_count,
+            )
+        )
+        statistics[-1].dependencies.append(metrics_view)
+        statistics[-1].dependencies += metrics[: i + 1] if uses_metrics_history else [metrics[i]]
+
+    statistics_view = task(
+        Stage.STATISTICS_VIEW,
+        dates[:1],
+        partial(monitoring.create_statistics_view, dates[0]),
+        STAGE_WEIGHTS[Stage.STATISTICS_VIEW],
+    )
+    statistics_view.dependencies.append(statistics[0])
+
+    # alerts are always computed per date
+    alerts: List[Task] = []
+    for i, window in enumerate(windows):
+        for date in window:
+            alerts.append(
+                task(
+                    Stage.ALERTS,
+                    [date],
+                    partial(monitoring.run_alerts, date),
+                    STAGE_WEIGHTS[Stage.ALERTS] * max(1, len(config.alerts)),
+                )
+            )
+            alerts[-1].dependencies.append(statistics_view)
+            alerts[-1].dependencies += (
+                statistics[: i + 1] if uses_statistics_history else [statistics[i]]
+            )
+
+    return metrics + [metrics_view] + statistics + [statistics_view] + alerts
+
+
+def parse_stage_parallelism(parallelism: int, values: List[str]) -> Dict[Stage, int]:
+    """Parse `<stage>=<limit>` values into per-stage concurrency limits."""
+    stage_parallelism = {stage: parallelism for stage in Stage}
+    for value in values:
+        stage, _, limit = value.partition("=")
+        try:
+            stage_parallelism[Stage(stage.strip())] = int(limit)
+        except ValueError:
+            raise ValueError(
+                f"Invalid stage parallelism '{value}', expected <stage>=<limit> with stage one "
+                + f"of {', '.join(s.value for s in Stage)}"
+            )
+    return stage_parallelism
@@ -0,0 +1,204 @@
+"""Share scans of data sources between projects running for the same date.
+
+Projects aggregated by submission date compute each metric per client and
+day. If several projects read metrics from the same data source, a single
+query computes the union of their metric expressions for every client of the
+day and stores the results in a short-lived table. The metric queries of
+these projects read from this table instead of scanning the data source
+again, so the bytes scanned per day scale with the number of data sources
+rather than with the number of projects. Only clients that are part of the
+population of at least one of the projects are aggregated.
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
+
+import attr
+from metric_config_parser.data_source import DataSource
+from metric_config_parser.project import MonitoringPeriod
+
+from .bigquery_client import BigQueryClient
+from .templates import render_template
+
+if TYPE_CHECKING:
+    from .monitoring import Monitoring
+
+logger = logging.getLogger(__name__)
+
+SHARED_SCAN_QUERY_FILENAME = "shared_scan_query.sql"
+POPULATION_FILENAME = "population.sql"
+# shared scan tables are only read by metric queries of the same run
+SHARED_SCAN_EXPIRATION_HOURS = 24
+# minimum number of projects that read from a data source for its scan to be shared
+MIN_SHARED_PROJECTS = 2
+
+
+def shared_column_name(expression: str) -> str:
+    """Return the column of a shared scan table containing the values of an expression."""
+    return "m_" + hashlib.sha256(expression.encode("utf-8")).hexdigest()[:16]
+
+
+@attr.s(auto_attribs=True)
+class SharedScan:
+    """A scan of a data source for a single date shared by multiple projects."""
+
+    project: str
+    dataset: str
+    data_source: DataSource
+    from_expression: str
+    submission_date: datetime
+    expressions: Dict[str, str] = attr.Factory(dict)
+    slugs: List[str] = attr.Factory(list)
+    # projects reading from the scan, the scanned clients are restricted to their populations
+    monitorings: List["Monitoring"] = attr.ib(factory=list, repr=False, eq=False)
+    # failed scans are not read from, projects scan the data source themselves
+    failed: bool = attr.ib(default=False, init=False)
+
+    @property
+    def table_name(self) -> str:
+        """Return the name of the table the results of the scan are written to."""
+        source = "\n".join(
+            [
+                self.from_expression,
+                self.data_source.submission_date_column,
+                self.data_source.client_id_column,
+            ]
+        )
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        return f"shared_scan_{key}_{self.submission_date:%Y%m%d}"
+
+    @property
+    def table_id(self) -> str:
+        """Return the fully qualified ID of the table the results are written to."""
+        return f"{self.project}.{self.dataset}.{self.table_name}"
+
+    def add(self, monitoring: "Monitoring", expressions: List[str]) -> None:
+        """Add the metric expressions of a project to the scan."""
+        for expression in expressions:
+            self.expressions.setdefault(shared_column_name(expression), expression)
+        if monitoring.slug not in self.slugs:
+            self.slugs.append(monitoring.slug)
+            self.monitorings.append(monitoring)
+
+    def enrollment_indexes(self) -> List[str]:
+        """Return the IDs of the enrollment indexes the populations are read from."""
+        tables = [
+            monitoring._enrollment_index_table(self.submission_date)
+            for monitoring in self.monitorings
+        ]
+        return list(dict.fromkeys(table for table in tables if table))
+
+    def populations(self) -> List[str]:
+        """
+        Return the SQL of the populations of the projects reading from the scan.
+
+        No populations are returned if a project monitors the entire population,
+        since all clients of the day are needed then.
+        """
+        if any(
+            monitoring.config.project.population.monitor_entire_population
+            for monitoring in self.monitorings
+        ):
+            return []
+        return [
+            render_template(
+                POPULATION_FILENAME, monitoring._population_render_kwargs(self.submission_date)
+            )
+            for monitoring in self.monitorings
+        ]
+
+    def sql(self) -> str:
+        """Return the SQL that computes all expressions and writes them to the table."""
+        return render_template(
+            SHARED_SCAN_QUERY_FILENAME,
+            {
+                "header": "-- Generated via opmon\n",
+                "table_id": self.table_id,
+                "expiration_hours": SHARED_SCAN_EXPIRATION_HOURS,
+                "data_source": self.data_source,
+                "from_expression": self.from_expression,
+                "submission_date": self.submission_date,
+                "expressions": self.expressions,
+                "slugs": self.slugs,
+                "populations": self.populations(),
+            },
+        )
+
+    def run(self, bigquery: BigQueryClient) -> None:
+        """
+        Execute the scan.
+
+        Errors are not raised. The scan is marked as failed instead, so that
+        the metrics of the projects reading from it are still computed.
+        """
+        try:
+            bigquery.execute(
+                self.sql(),
+                annotations={
+                    "slug": self.table_name,
+                    "type": "shared_scan_query",
+                    "submission_date": self.submission_date,
+                },
+            )
+        except Exception as e:
+            self.failed = True
+            logger.warning(
+                f"Shared scan {self.table_name} failed, {', '.join(self.slugs)} "
+                + f"will scan {self.from_expression} instead: {e}",
+                exc_info=e,
+            )
+
+
+def plan_shared_scans(
+    monitorings: List["Monitoring"],
+    submission_date: datetime,
+    min_projects: int = MIN_SHARED_PROJECTS,
+) -> List[SharedScan]:
+    """
+    Return the scans shared by projects running for a date.
+
+    Only projects aggregated by submission date share scans. Data sources are
+    considered equal if they read from the same table for the same clients,
+    independent of their name in the project configurations. The shared scans
+    are assigned to the `shared_scans` of each project that reads from them.
+    """
+    sources: Dict[Tuple[str, str, str], List[Tuple["Monitoring", str, List[str]]]] = {}
+    for monitoring in monitorings:
+        project = monitoring.config.project
+        if project is None or project.skip or project.xaxis != MonitoringPeriod.DAY:
+            continue
+
+        app_id = monitoring._population_render_kwargs(submission_date)["app_id"]
+        for data_source_name, metrics in monitoring._metrics_per_dataset().items():
+            data_source = metrics[0].data_source
+            key = (
+                data_source.from_expr_for(app_id),
+                data_source.submission_date_column,
+                data_source.client_id_column,
+            )
+            sources.setdefault(key, []).append(
+                (monitoring, data_source_name, [metric.select_expression for metric in metrics])
+            )
+
+    scans = []
+    for (from_expression, _, _), readers in sources.items():
+        slugs: Set[str] = {monitoring.slug for monitoring, _, _ in readers}
+        if len(slugs) < min_projects:
+            continue
+
+        first, first_name, _ = readers[0]
+        scan = SharedScan(
+            project=first.project,
+            dataset=first.derived_dataset,
+            data_source=first._metrics_per_dataset()[first_name][0].data_source,
+            from_expression=from_expression,
+            submission_date=submission_date,
+        )
+        for monitoring, data_source_name, expressions in readers:
+            scan.add(monitoring, expressions)
+            monitoring.shared_scans[data_source_name] = scan
+        scans.append(scan)
+
+    return scans
@@ -3,7 +3,8 @@
 import copy
 import re
 from abc import ABC
-from typing import Any, Dict, List
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
 
 import attr
 from metric_config_parser import metric as parser_metric
@@ -11,6 +12,9 @@ from metric_config_parser.metric import Metric
 
 from opmon.errors import StatisticNotImplementedForTypeException
 
+# statistics of scalar metrics computed over histograms with buckets derived from the metric values
+BUCKETED_STATISTICS = ["percentile", "binomial_percentile"]
+
 
 @attr.s(auto_attribs=True)
 class Statistic(ABC):
@@ -61,6 +65,26 @@ class Statistic(ABC):
             f"Statistic {self.name()} not implemented for type {metric.type} ({metric.name})"
         )
 
+    def state(self, metric: Metric) -> Optional[str]:
+        """
+        Return SQL aggregating the per-client values into a mergeable state.
+
+        The state is stored next to the statistic, so that results over multiple
+        partitions can be computed by merging states instead of rescanning the
+        per-client values. Statistics without a mergeable state return `None`.
+        """
+        return None
+
+    def merge(self, metric: Metric, state: str) -> str:
+        """
+        Return SQL computing the statistic by aggregating the stored `state` column.
+
+        The SQL returns the same type as `compute`.
+        """
+        raise StatisticNotImplementedForTypeException(
+            f"Statistic {self.name()} does not support merging ({metric.name})"
+        )
+
     @classmethod
     def from_dict(cls, config_dict: Dict[str, Any]):
         """Create a class instance with the specified config parameters."""
@@ -176,24 +200,7 @@ class Percentile(Statistic):
         return f"""
             `moz-fx-data-shared-prod.udf_js.bootstrap_percentile_ci`(
                 {self.percentiles},
-                merge_histogram_values(
-                    ARRAY_CONCAT_AGG(
-                        histogram_normalized_sum(
-                            [IF({self.remove_nulls} AND {metric.name} IS NULL,
-                                NULL,
-                                STRUCT<values ARRAY<STRUCT<key FLOAT64, value FLOAT64>>>(
-                                [STRUCT<key FLOAT64, value FLOAT64>(
-                                    COALESCE(
-                                        mozfun.glam.histogram_bucket_from_value(
-                                            {metric.name}_buckets,
-                                            SAFE_CAST({metric.name} AS FLOAT64)
-                                        ), 0.0
-                                    ), 1.0
-                                )]
-                            ))], 1.0
-                        )
-                    )
-                ),
+                {_scalar_histogram(metric, self.remove_nulls)},
                 "{metric.name}"
             )
         """
@@ -202,16 +209,53 @@ class Percentile(Statistic):
         return f"""
             `moz-fx-data-shared-prod.udf_js.bootstrap_percentile_ci`(
                 {self.percentiles},
-                merge_histogram_values(
-                    ARRAY_CONCAT_AGG(
-                        histogram_normalized_sum({metric.name}, 1.0)
-                    )
-                ),
+                {_merged_histogram(metric)},
                 "{metric.name}"
             )
         """
 
 
+@attr.s(auto_attribs=True)
+class BinomialPercentile(Statistic):
+    """
+    Percentile with confidence interval statistic computed in SQL.
+
+    Confidence intervals are the histogram buckets of the order statistics
+    at the bounds of the binomial confidence interval of the percentile rank.
+    """
+
+    percentiles: List[int] = [50, 90, 99]
+    remove_nulls: bool = False
+    confidence: float = 0.95
+
+    @property
+    def z_score(self) -> float:
+        """Return the standard score of the two-sided confidence interval."""
+        return NormalDist().inv_cdf(0.5 + self.confidence / 2)
+
+    def _scalar_compute(self, metric: Metric):
+        return f"""
+            binomial_percentile_ci(
+                {self.percentiles},
+                {_scalar_histogram(metric, self.remove_nulls)},
+                "{metric.name}",
+                "{self.name()}",
+                {self.z_score}
+            )
+        """
+
+    def _histogram_compute(self, metric: Metric):
+        return f"""
+            binomial_percentile_ci(
+                {self.percentiles},
+                {_merged_histogram(metric)},
+                "{metric.name}",
+                "{self.name()}",
+                {self.z_score}
+            )
+        """
+
+
 @attr.s(auto_attribs=True)
 class TotalRatio(Statistic):
     """Compute the ratio of the sum of two metrics."""
@@ -238,6 +282,132 @@ class TotalRatio(Statistic):
         ]"""
 
 
+def _scalar_histogram(metric: Metric, remove_nulls: bool) -> str:
+    """Return the SQL merging the bucketed values of a scalar metric into a histogram."""
+    return f"""merge_histogram_values(
+                    ARRAY_CONCAT_AGG(
+                        histogram_normalized_sum(
+                            [IF({remove_nulls} AND {metric.name} IS NULL,
+                                NULL,
+                                STRUCT<values ARRAY<STRUCT<key FLOAT64, value FLOAT64>>>(
+                                [STRUCT<key FLOAT64, value FLOAT64>(
+                                    COALESCE(
+                                        mozfun.glam.histogram_bucket_from_value(
+                                            {metric.name}_buckets,
+                                            SAFE_CAST({metric.name} AS FLOAT64)
+                                        ), 0.0
+                                    ), 1.0
+                                )]
+                            ))], 1.0
+                        )
+                    )
+                )"""
+
+
+def _merged_histogram(metric: Metric) -> str:
+    """Return the SQL merging the normalized histograms of all clients."""
+    return f"""merge_histogram_values(
+                    ARRAY_CONCAT_AGG(
+                        histogram_normalized_sum({metric.name}, 1.0)
+                    )
+                )"""
+
+
+def _check_scalar(statistic: Statistic, metric: Metric) -> None:
+    if metric.type != "scalar":
+        raise StatisticNotImplementedForTypeException(
+            f"Statistic {statistic.name()} not implemented for type {metric.type} ({metric.name})"
+        )
+
+
+def _statistics_array(
+    metric: Metric, statistic: str, points: List[Tuple[str, Optional[str]]]
+) -> str:
+    """Return the statistics type for the SQL of point estimates and their parameters."""
+    return (
+        """ARRAY<STRUCT<
+                metric STRING,
+                statistic STRING,
+                point FLOAT64,
+                lower FLOAT64,
+                upper FLOAT64,
+                parameter STRING
+            >>["""
+        + ",".join(
+            f"""
+            STRUCT(
+                "{metric.name}" AS metric,
+                "{statistic}" AS statistic,
+                {point} AS point,
+                NULL AS lower,
+                NULL AS upper,
+                {f"'{parameter}'" if parameter is not None else "NULL"} AS parameter
+            )"""
+            for point, parameter in points
+        )
+        + "\n        ]"
+    )
+
+
+@attr.s(auto_attribs=True)
+class SketchMean(Statistic):
+    """Mean statistic storing the sum and count of values as mergeable state."""
+
+    def _scalar_compute(self, metric: Metric):
+        return _statistics_array(metric, self.name(), [(f"AVG({metric.name})", None)])
+
+    def state(self, metric: Metric) -> Optional[str]:
+        """Return the sum and count of the values."""
+        _check_scalar(self, metric)
+        return f"""STRUCT(
+                SUM(SAFE_CAST({metric.name} AS FLOAT64)) AS sum,
+                COUNT({metric.name}) AS count
+            )"""
+
+    def merge(self, metric: Metric, state: str) -> str:
+        """Return the mean of all merged values."""
+        _check_scalar(self, metric)
+        return _statistics_array(
+            metric, self.name(), [(f"SUM({state}.sum) / NULLIF(SUM({state}.count), 0)", None)]
+        )
+
+
+@attr.s(auto_attribs=True)
+class SketchQuantile(Statistic):
+    """Approximate quantiles storing a KLL sketch of the values as mergeable state."""
+
+    quantiles: List[int] = [50, 90, 99]
+    precision: int = 1000
+
+    def _scalar_compute(self, metric: Metric):
+        sketch = self.state(metric)
+        return _statistics_array(
+            metric,
+            self.name(),
+            [
+                (f"KLL_QUANTILES.EXTRACT_POINT_FLOAT64({sketch}, {quantile / 100})", str(quantile))
+                for quantile in self.quantiles
+            ],
+        )
+
+    def state(self, metric: Metric) -> Optional[str]:
+        """Return the KLL sketch of the values."""
+        _check_scalar(self, metric)
+        return f"KLL_QUANTILES.INIT_FLOAT64(SAFE_CAST({metric.name} AS FLOAT64), {self.precision})"
+
+    def merge(self, metric: Metric, state: str) -> str:
+        """Return the quantiles of the merged sketches."""
+        _check_scalar(self, metric)
+        return _statistics_array(
+            metric,
+            self.name(),
+            [
+                (f"KLL_QUANTILES.MERGE_POINT_FLOAT64({state}, {quantile / 100})", str(quantile))
+                for quantile in self.quantiles
+            ],
+        )
+
+
 @attr.s(auto_attribs=True)
 class Summary:
     """Represents a metric with a statistical treatment."""
@@ -1 +1,54 @@
-"""SQL Templates."""
+"""SQL Templates.
+
+Templates are rendered through a single shared Jinja environment that keeps
+compiled templates in memory. If `OPMON_COMPILED_TEMPLATES` points to a
+directory created by `opmon compile_templates`, templates are loaded from
+their precompiled Python modules instead of being parsed from the SQL files.
+"""
+
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from jinja2 import BaseLoader, ChoiceLoader, Environment, FileSystemLoader, ModuleLoader
+
+TEMPLATE_FOLDER = Path(os.path.dirname(__file__))
+COMPILED_TEMPLATES_ENV_VAR = "OPMON_COMPILED_TEMPLATES"
+TEMPLATE_CACHE_SIZE = 50
+
+
+def _compiled_templates_folder() -> Optional[Path]:
+    folder = os.environ.get(COMPILED_TEMPLATES_ENV_VAR)
+    if folder and Path(folder).is_dir():
+        return Path(folder)
+    return None
+
+
+@lru_cache(maxsize=None)
+def environment(compiled_templates: Optional[Path] = None) -> Environment:
+    """Return the shared environment, optionally loading precompiled templates first."""
+    loader: BaseLoader = FileSystemLoader(TEMPLATE_FOLDER)
+    if compiled_templates:
+        # templates that have not been compiled are still parsed from their SQL file
+        loader = ChoiceLoader([ModuleLoader(str(compiled_templates)), loader])
+
+    # templates are part of the package and do not change at runtime
+    return Environment(loader=loader, cache_size=TEMPLATE_CACHE_SIZE, auto_reload=False)
+
+
+def render_template(template_file: str, render_kwargs: Dict[str, Any]) -> str:
+    """Render and return the SQL from a template."""
+    template = environment(_compiled_templates_folder()).get_template(template_file)
+    return template.render(**render_kwargs)
+
+
+def compile_templates(target: Path) -> None:
+    """Compile all SQL templates into Python modules stored in the target directory."""
+    target.mkdir(parents=True, exist_ok=True)
+    environment().compile_templates(
+        str(target),
+        extensions=["sql"],
+        zip=None,
+        ignore_errors=False,
+    )
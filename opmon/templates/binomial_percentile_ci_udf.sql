@@ -0,0 +1,51 @@
+CREATE TEMPORARY FUNCTION binomial_percentile_ci(
+  percentiles ARRAY<INT64>,
+  histogram STRUCT<values ARRAY<STRUCT<key FLOAT64, value FLOAT64>>>,
+  metric STRING,
+  statistic STRING,
+  z_score FLOAT64
+) AS (
+  -- Input: histogram merged from the normalized histograms of all clients,
+  -- so the total of its values is the number of clients.
+  -- The rank of a percentile p among n clients is binomially distributed,
+  -- its confidence interval is approximated by n * p +/- z * sqrt(n * p * (1 - p)).
+  -- Returns the buckets at the percentile rank and at the bounds of its interval.
+  ARRAY(
+    WITH cdf AS (
+      SELECT
+        bucket.key,
+        SUM(bucket.value) OVER (ORDER BY bucket.key) AS cumulative,
+        SUM(bucket.value) OVER () AS total
+      FROM
+        UNNEST(histogram.values) AS bucket
+    ),
+    ranks AS (
+      SELECT
+        percentile,
+        total * percentile / 100 AS rank,
+        z_score * SQRT(total * percentile / 100 * (1 - percentile / 100)) AS spread
+      FROM
+        UNNEST(percentiles) AS percentile
+      CROSS JOIN
+        (SELECT MAX(total) AS total FROM cdf)
+    )
+    SELECT AS STRUCT
+      metric AS metric,
+      statistic AS statistic,
+      COALESCE(MIN(IF(cdf.cumulative >= ranks.rank, cdf.key, NULL)), MAX(cdf.key)) AS point,
+      MIN(IF(cdf.cumulative >= ranks.rank - ranks.spread, cdf.key, NULL)) AS lower,
+      COALESCE(
+        MIN(IF(cdf.cumulative >= ranks.rank + ranks.spread, cdf.key, NULL)),
+        MAX(cdf.key)
+      ) AS upper,
+      CAST(ranks.percentile AS STRING) AS parameter
+    FROM
+      ranks
+    CROSS JOIN
+      cdf
+    GROUP BY
+      ranks.percentile
+    ORDER BY
+      ranks.percentile
+  )
+);
\ No newline at end of file
@@ -0,0 +1,64 @@
+{{ header }}
+-- enrollments of {{ slugs|join(", ") }}
+
+CREATE OR REPLACE TABLE
+  `{{ table_id }}`
+CLUSTER BY
+  slug
+OPTIONS (
+  expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {{ expiration_hours }} HOUR)
+)
+AS
+WITH pings AS (
+    SELECT
+        DATE({{ data_source.submission_date_column }}) AS submission_date,
+        {{ data_source.client_id_column }} AS client_id,
+        {% if is_glean_app -%}
+        ping_info.experiments AS experiments,
+        {% else -%}
+        environment.experiments AS experiments,
+        {% endif %}
+    FROM
+        {{ from_expression }}
+    WHERE
+        DATE({{ data_source.submission_date_column }}) = DATE('{{ submission_date }}')
+        {% if channel -%}
+        AND normalized_channel = '{{ channel }}'
+        {% endif %}
+)
+{% if clients -%}
+-- number of pings of every client, rollouts treat clients without enrollment as disabled
+SELECT
+    submission_date,
+    client_id,
+    CAST(NULL AS STRING) AS slug,
+    CAST(NULL AS STRING) AS branch,
+    COUNT(*) AS pings,
+FROM
+    pings
+GROUP BY
+    submission_date,
+    client_id
+UNION ALL
+{% endif -%}
+SELECT
+    submission_date,
+    client_id,
+    experiment.key AS slug,
+    experiment.value.branch AS branch,
+    COUNT(*) AS pings,
+FROM
+    pings,
+    UNNEST(experiments) AS experiment
+WHERE
+    experiment.key IN (
+        {% for slug in slugs -%}
+        "{{ slug }}"{{ "," if not loop.last else "" }}
+        {% endfor -%}
+    )
+    AND experiment.value.branch IS NOT NULL
+GROUP BY
+    submission_date,
+    client_id,
+    slug,
+    branch
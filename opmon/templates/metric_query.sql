@@ -1,10 +1,47 @@
 {{ header }}
 
+{% if population_table -%}
+WITH population AS (
+    SELECT
+        *
+    FROM
+        `{{ population_table }}`
+),
+{% else -%}
 {% include 'population.sql' %},
+{% endif %}
+
+-- clients of the population that metrics get joined with
+population_clients AS (
+    SELECT
+        client_id AS population_client_id,
+        submission_date AS population_submission_date,
+        build_id AS population_build_id,
+    FROM
+        population
+    GROUP BY
+        population_client_id,
+        population_submission_date,
+        population_build_id
+),
 
 -- for each data source that is used
 -- select the metric values
 {% for data_source, metrics in metrics_per_dataset.items() -%}
+{% if data_source in shared_scans -%}
+-- metric values are read from a scan of the data source shared with other projects
+merged_metrics_{{ data_source }} AS (
+    SELECT
+        submission_date,
+        client_id,
+        NULL AS build_id,
+        {% for metric in metrics -%}
+        {{ shared_column(metric.select_expression) }} AS {{ metric.name }},
+        {% endfor -%}
+    FROM
+        `{{ shared_scans[data_source] }}`
+),
+{% else -%}
 merged_metrics_{{ data_source }} AS (
     SELECT
         DATE({{ metrics[0].data_source.submission_date_column }}) AS submission_date,
@@ -16,19 +53,7 @@ merged_metrics_{{ data_source }} AS (
     FROM
         {{ metrics[0].data_source.from_expr_for(app_id) }}
     RIGHT JOIN
-        (
-            SELECT
-                client_id AS population_client_id,
-                submission_date AS population_submission_date,
-                build_id AS population_build_id,
-            FROM
-                population
-            GROUP BY
-                population_client_id,
-                population_submission_date,
-                population_build_id
-
-        ) AS p
+        population_clients AS p
     ON
         {{ metrics[0].data_source.submission_date_column }} = p.population_submission_date
         AND {{ metrics[0].data_source.client_id_column }} = p.population_client_id
@@ -39,7 +64,11 @@ merged_metrics_{{ data_source }} AS (
         {% endif %}
     WHERE
         {% if config.xaxis.value == "submission_date" %}
+        {% if start_date -%}
+        DATE({{ metrics[0].data_source.submission_date_column }}) BETWEEN DATE('{{ start_date }}') AND DATE('{{ submission_date }}')
+        {% else -%}
         DATE({{ metrics[0].data_source.submission_date_column }}) = DATE('{{ submission_date }}')
+        {% endif -%}
         {% else %}
         -- when aggregating by build_id, only use the most recent 14 days of data
         DATE({{ metrics[0].data_source.submission_date_column }}) BETWEEN DATE_SUB(DATE('{{ submission_date }}'), INTERVAL 14 DAY) AND DATE('{{ submission_date }}')
@@ -49,6 +78,7 @@ merged_metrics_{{ data_source }} AS (
         build_id,
         client_id
 ),
+{% endif -%}
 {% endfor %}
 
 -- combine the metrics from all the data sources
@@ -96,7 +126,13 @@ normalized_metrics AS (
     )
     {% endif %}
 )
-{% if first_run or config.xaxis.value == "submission_date" -%}
+{% if start_date -%}
+-- multiple dates are computed at once, keep the date of each row
+SELECT
+    *
+FROM
+    normalized_metrics
+{% elif first_run or config.xaxis.value == "submission_date" -%}
 SELECT
     * REPLACE(DATE('{{ submission_date }}') AS submission_date)
 FROM
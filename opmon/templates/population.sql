@@ -1,3 +1,47 @@
+{% if enrollment_index -%}
+-- enrollments are read from an index shared with other projects
+WITH population AS (
+    SELECT
+        submission_date,
+        client_id,
+        NULL AS build_id,
+        branch,
+    FROM
+        {% if config.population.branches|length > 0 -%}
+        `{{ enrollment_index }}`
+    WHERE
+        slug = "{{ slug }}"
+        {% else -%}
+        (
+            SELECT
+                submission_date,
+                client_id,
+                SUM(IF(slug IS NULL, pings, 0)) AS pings,
+                SUM(IF(slug = "{{ slug }}", pings, 0)) AS enrolled_pings,
+            FROM
+                `{{ enrollment_index }}`
+            WHERE
+                slug IS NULL
+                OR slug = "{{ slug }}"
+            GROUP BY
+                submission_date,
+                client_id
+        ),
+        -- clients with pings with and without the slug are part of both branches
+        UNNEST([
+            IF(enrolled_pings > 0, 'enabled', NULL),
+            IF(enrolled_pings < pings, 'disabled', NULL)
+        ]) AS branch
+    WHERE
+        branch IS NOT NULL
+        {% endif %}
+    GROUP BY
+        submission_date,
+        client_id,
+        build_id,
+        branch
+)
+{%- else -%}
 WITH population AS (
     SELECT
         DATE({{ config.population.data_source.submission_date_column }}) AS submission_date,
@@ -53,7 +97,11 @@ WITH population AS (
         {%- endif %}
     WHERE
         {% if config.xaxis.value == "submission_date" %}
+        {% if start_date -%}
+        DATE({{ config.population.data_source.submission_date_column }}) BETWEEN DATE('{{ start_date }}') AND DATE('{{ submission_date }}')
+        {% else -%}
         DATE({{ config.population.data_source.submission_date_column }}) = DATE('{{ submission_date }}')
+        {% endif -%}
         {% else %}
         -- when aggregating by build_id, only use the most recent 14 days of data
         DATE({{ config.population.data_source.submission_date_column }}) BETWEEN DATE_SUB(DATE('{{ submission_date }}'), INTERVAL 14 DAY) AND DATE('{{ submission_date }}')
@@ -69,4 +117,5 @@ WITH population AS (
           {{ dimension.name }},
         {% endfor -%}
         branch
-)
\ No newline at end of file
+)
+{%- endif %}
\ No newline at end of file
@@ -0,0 +1,13 @@
+{{ header }}
+
+CREATE OR REPLACE TABLE
+  `{{ gcp_project }}.{{ derived_dataset }}.{{ population_table }}`
+OPTIONS (
+  expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {{ expiration_hours }} HOUR)
+)
+AS
+{% include 'population.sql' %}
+SELECT
+    *
+FROM
+    population
@@ -0,0 +1,41 @@
+{{ header }}
+-- metrics of {{ slugs|join(", ") }}
+
+CREATE OR REPLACE TABLE
+  `{{ table_id }}`
+OPTIONS (
+  expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {{ expiration_hours }} HOUR)
+)
+AS
+SELECT
+    DATE({{ data_source.submission_date_column }}) AS submission_date,
+    {{ data_source.client_id_column }} AS client_id,
+    {% for column, expression in expressions.items() -%}
+    {{ expression }} AS {{ column }},
+    {% endfor -%}
+FROM
+    {{ from_expression }}
+WHERE
+    DATE({{ data_source.submission_date_column }}) = DATE('{{ submission_date }}')
+    {%- if populations %}
+    -- only clients that are part of the population of any of the projects are aggregated
+    AND {{ data_source.client_id_column }} IN (
+        {%- for population in populations %}
+        {%- if not loop.first %}
+        UNION DISTINCT
+        {%- endif %}
+        SELECT
+            client_id
+        FROM (
+            {{ population | indent(12) }}
+            SELECT
+                client_id
+            FROM
+                population
+        )
+        {%- endfor %}
+    )
+    {%- endif %}
+GROUP BY
+    submission_date,
+    client_id
@@ -4,6 +4,8 @@
 
 {% include 'merge_histogram_values_udf.sql' %}
 
+{% include 'binomial_percentile_ci_udf.sql' %}
+
 WITH filtered_metrics AS (
     SELECT *
     FROM `{{ gcp_project }}.{{ dataset }}.{{ normalized_slug }}`
@@ -16,7 +18,7 @@ log_min_max AS (
     NULL AS dummy,
     {% set seen_metrics = [] %}
     {% for summary in summaries %}
-        {% if summary.statistic.name() == "percentile" %}
+        {% if summary.statistic.name() in bucketed_statistics %}
             {% if summary.metric.type == "scalar" -%}
                 {% if summary.metric.name not in seen_metrics %}
                     {% if seen_metrics.append(summary.metric.name) %} {% endif %}
@@ -36,7 +38,7 @@ buckets_by_metric AS (
     NULL AS dummy,
     {% set seen_metrics = [] %}
     {% for summary in summaries %}
-        {% if summary.statistic.name() == "percentile" %}
+        {% if summary.statistic.name() in bucketed_statistics %}
             {% if summary.metric.type == "scalar" -%}
                 {% if summary.metric.name not in seen_metrics %}
                 {% if seen_metrics.append(summary.metric.name) %} {% endif %}
@@ -99,12 +101,20 @@ SELECT
     branch,
     {% for summary in summaries %}
         {{ summary.statistic.compute(summary.metric) }} AS {{ summary.metric.name }}_{{ summary.statistic.name() }}
+        {% set state = summary.statistic.state(summary.metric) %}
+        {% if state -%}
+        , {{ state }} AS {{ summary.metric.name }}_{{ summary.statistic.name() }}_state
+        {% endif -%}
         {{ "," if not loop.last else "" }}
     {% endfor %}
 FROM
     `{{ gcp_project }}.{{ derived_dataset }}.{{ normalized_slug }}_v{{ table_version }}` 
 CROSS JOIN buckets_by_metric
+{% if start_date -%}
+WHERE submission_date BETWEEN DATE("{{ start_date }}") AND DATE("{{ submission_date }}")
+{% else -%}
 WHERE submission_date = DATE("{{ submission_date }}")
+{% endif -%}
 GROUP BY
     submission_date,
     build_id,
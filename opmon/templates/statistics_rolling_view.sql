@@ -0,0 +1,71 @@
+{{ header }}
+
+CREATE OR REPLACE VIEW
+  `{{ gcp_project }}.{{ dataset }}.{{ normalized_slug }}_statistics_rolling`
+AS
+
+-- statistics over the last {{ window_days }} days, computed by merging the stored states
+WITH windowed_states AS (
+    SELECT
+        windows.submission_date,
+        {% for dimension in dimensions -%}
+            stats.{{ dimension.name }},
+        {% endfor -%}
+        stats.branch,
+        {% for summary in summaries -%}
+            stats.{{ summary.metric.name }}_{{ summary.statistic.name() }}_state,
+        {% endfor %}
+    FROM
+        `{{ gcp_project }}.{{ derived_dataset }}.{{ normalized_slug }}_statistics_v{{ table_version }}` AS stats
+    JOIN (
+        SELECT DISTINCT
+            submission_date
+        FROM
+            `{{ gcp_project }}.{{ derived_dataset }}.{{ normalized_slug }}_statistics_v{{ table_version }}`
+    ) AS windows
+    ON
+        stats.submission_date BETWEEN DATE_SUB(windows.submission_date, INTERVAL {{ window_days - 1 }} DAY)
+        AND windows.submission_date
+),
+
+merged AS (
+    SELECT
+        submission_date,
+        {% for dimension in dimensions -%}
+            {{ dimension.name }},
+        {% endfor -%}
+        branch,
+        {% for summary in summaries -%}
+            {{ summary.statistic.merge(summary.metric, summary.metric.name ~ "_" ~ summary.statistic.name() ~ "_state") }} AS {{ summary.metric.name }}_{{ summary.statistic.name() }},
+        {% endfor %}
+    FROM
+        windowed_states
+    GROUP BY
+        submission_date,
+        {% for dimension in dimensions -%}
+            {{ dimension.name }},
+        {% endfor -%}
+        branch
+)
+
+{% for summary in summaries %}
+    SELECT
+        submission_date,
+        TIMESTAMP(submission_date) AS submission_timestamp,
+        NULL AS build_id,
+        {% for dimension in dimensions -%}
+            {{ dimension.name }},
+        {% endfor -%}
+        branch,
+        statistic.metric AS metric,
+        statistic.statistic AS statistic,
+        statistic.point AS point,
+        statistic.lower AS lower,
+        statistic.upper AS upper,
+        SAFE_CAST(statistic.parameter AS FLOAT64) AS parameter,
+        {{ window_days }} AS window_days
+    FROM
+        merged,
+        UNNEST({{ summary.metric.name }}_{{ summary.statistic.name() }}) AS statistic
+    {{ "UNION ALL" if not loop.last else "" }}
+{% endfor %}
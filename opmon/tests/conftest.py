@@ -1,5 +1,9 @@
 """Test configs."""
 import pytest
+from metric_config_parser.config import ConfigCollection
+from metric_config_parser.monitoring import MonitoringSpec
+
+from opmon.monitoring import Monitoring
 
 
 @pytest.fixture
@@ -12,3 +16,61 @@ def projects():
 def experiments():
     """Experiments."""
     return []
+
+
+@pytest.fixture
+def monitoring_factory():
+    """
+    Return a factory of projects reading all metrics from a single data source.
+
+    Metrics are given by name and either their select expression or their
+    config. Remaining keyword arguments are passed on to `Monitoring`.
+    """
+
+    def factory(
+        slug="test-foo",
+        metrics=None,
+        statistics=None,
+        population=None,
+        dimensions=(),
+        alerts=None,
+        xaxis="submission_date",
+        from_expression="`project.dataset.main`",
+        skip=False,
+        **kwargs,
+    ):
+        metrics = metrics or {"a": "SUM(a)"}
+        alerts = alerts or {}
+        spec = MonitoringSpec.from_dict(
+            {
+                "project": {
+                    "metrics": list(metrics),
+                    "alerts": list(alerts),
+                    "start_date": "2022-01-01",
+                    "xaxis": xaxis,
+                    "skip": skip,
+                    "population": {"data_source": "main", **(population or {})},
+                },
+                "metrics": {
+                    name: {
+                        "data_source": "main",
+                        "type": "scalar",
+                        "statistics": statistics or {"sum": {}},
+                        **({"select_expression": metric} if isinstance(metric, str) else metric),
+                    }
+                    for name, metric in metrics.items()
+                },
+                "dimensions": {
+                    name: {"select_expression": name, "data_source": "main"} for name in dimensions
+                },
+                "alerts": alerts,
+                "data_sources": {"main": {"from_expression": from_expression}},
+            }
+        )
+        return Monitoring(
+            slug=slug,
+            config=spec.resolve(experiment=None, configs=ConfigCollection()),
+            **{"project": "test", "dataset": "test", "derived_dataset": "test_derived", **kwargs},
+        )
+
+    return factory
@@ -0,0 +1,360 @@
+"""In-process fake of the BigQuery client surface used by opmon.
+
+`FakeBigQuery` replaces `google.cloud.bigquery.Client` in `BigQueryClient`,
+`Metadata` and `BigQueryLogHandler`. Jobs don't compute anything, they take
+a simulated amount of time drawn from a latency distribution, may fail with
+injected errors and are recorded in a timeline. This allows benchmarking and
+testing how opmon orchestrates jobs without access to BigQuery:
+
+    fake = FakeBigQuery(latency=lognormal(median=30, sigma=0.5), time_scale=0.001)
+    client = BigQueryClient(project="project", dataset="dataset", client=fake)
+
+Simulated seconds are multiplied by `time_scale` to get the seconds jobs
+actually block for, so a run of long jobs can be replayed quickly.
+"""
+
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+import attr
+from google.api_core.exceptions import (
+    BadRequest,
+    Conflict,
+    Forbidden,
+    GoogleAPICallError,
+)
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+# returns the simulated seconds a job takes, given the kind of job, its query and its key
+Latency = Callable[[str, str, str], float]
+# returns an error a job fails with, given the kind of job, its query and its key
+Failure = Callable[[str, str, str], Optional[GoogleAPICallError]]
+
+_CREATE_STATEMENT = re.compile(
+    r"CREATE\s+(?:OR\s+REPLACE\s+)?(?:TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?`([^`]+)`",
+    re.IGNORECASE,
+)
+# names that differ between runs, e.g. IDs of jobs and random suffixes of tables
+_RUN_SPECIFIC_NAME = re.compile(r"_anonymous\.job_\d+|(?<![0-9a-f])[0-9a-f]{12}(?![0-9a-f])")
+
+
+def job_key(kind: str, query: str, destination: Optional[str], attempt: int) -> str:
+    """
+    Return a key identifying a job independently of when it was started.
+
+    Random latencies and failures are derived from the key, so that they don't
+    depend on the order in which concurrent jobs happen to be started.
+    """
+    return "\0".join(
+        [
+            kind,
+            _RUN_SPECIFIC_NAME.sub("", query),
+            _RUN_SPECIFIC_NAME.sub("", destination or ""),
+            str(attempt),
+        ]
+    )
+
+
+def _random(seed: Optional[int], key: str) -> random.Random:
+    """Return a random generator for a job, seeded by the seed and the key of the job."""
+    return random.Random(f"{seed}\0{key}")
+
+
+def constant(seconds: float) -> Latency:
+    """Return a latency distribution where every job takes the same time."""
+    return lambda kind, query, key: seconds
+
+
+def uniform(low: float, high: float, seed: Optional[int] = None) -> Latency:
+    """Return a latency distribution uniform between `low` and `high` seconds."""
+    return lambda kind, query, key: _random(seed, key).uniform(low, high)
+
+
+def lognormal(median: float, sigma: float, seed: Optional[int] = None) -> Latency:
+    """Return a log-normal latency distribution, with a long tail of slow jobs."""
+    return lambda kind, query, key: median * _random(seed, key).lognormvariate(0, sigma)
+
+
+def fail_matching(
+    pattern: str, error: Optional[GoogleAPICallError] = None, times: Optional[int] = None
+) -> Failure:
+    """Return a failure injection failing queries matching a regular expression."""
+    expression = re.compile(pattern)
+    remaining = [times]
+    lock = threading.Lock()
+
+    def failure(kind: str, query: str, key: str) -> Optional[GoogleAPICallError]:
+        if not expression.search(query):
+            return None
+        with lock:
+            if remaining[0] is not None:
+                if remaining[0] == 0:
+                    return None
+                remaining[0] -= 1
+        return error or BadRequest(f"Injected failure for query matching {pattern}")
+
+    return failure
+
+
+def fail_randomly(rate: float, seed: Optional[int] = None) -> Failure:
+    """Return a failure injection failing the given share of jobs."""
+
+    def failure(kind: str, query: str, key: str) -> Optional[GoogleAPICallError]:
+        failed = _random(seed, key).random() < rate
+        return BadRequest("Injected random failure") if failed else None
+
+    return failure
+
+
+def table_id(table: Union[str, bigquery.TableReference, bigquery.Table]) -> str:
+    """Return the fully qualified ID of a table without partition decorator."""
+    if isinstance(table, (bigquery.TableReference, bigquery.Table)):
+        table = f"{table.project}.{table.dataset_id}.{table.table_id}"
+    return table.split("$")[0]
+
+
+@attr.s(auto_attribs=True)
+class JobRecord:
+    """A job in the timeline of a `FakeBigQuery`."""
+
+    job_id: str
+    kind: str
+    query: str
+    destination: Optional[str]
+    # seconds since the fake was created
+    start: float
+    end: float
+    state: str = "RUNNING"
+    error: Optional[Exception] = None
+
+    @property
+    def seconds(self) -> float:
+        """Return the seconds the job ran for."""
+        return self.end - self.start
+
+
+class FakeJob:
+    """Job returned by `FakeBigQuery`, blocking in `result` until it finished."""
+
+    def __init__(self, fake: "FakeBigQuery", record: JobRecord):
+        """Instantiate a job for a record of the timeline."""
+        self._fake = fake
+        self.record = record
+        self.job_id = record.job_id
+        self.destination = (
+            bigquery.TableReference.from_string(record.destination) if record.destination else None
+        )
+        self._cancelled = threading.Event()
+
+    def done(self) -> bool:
+        """Return whether the job finished."""
+        return self.record.state != "RUNNING" or self._fake.now() >= self.record.end
+
+    def cancel(self) -> bool:
+        """Cancel the job if it is still running."""
+        with self._fake._lock:
+            if self.done():
+                return False
+            self.record.end = self._fake.now()
+            self.record.state = "CANCELLED"
+            self.record.error = BadRequest(f"Job {self.job_id} was cancelled")
+        self._cancelled.set()
+        return True
+
+    def result(self, timeout: Optional[float] = None) -> "FakeJob":
+        """Block until the job finished and raise its error if it failed."""
+        self._cancelled.wait(max(0.0, self.record.end - self._fake.now()))
+        with self._fake._lock:
+            if self.record.state == "RUNNING":
+                self.record.state = "FAILED" if self.record.error else "DONE"
+                destination = self.record.destination
+                if self.record.error is None and self.record.kind == "query" and destination:
+                    self._fake.tables.setdefault(destination, [])
+        if self.record.error is not None:
+            raise self.record.error
+        return self
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Return the rows of the result, queries of the fake don't return any."""
+        return iter(())
+
+
+class FakeBigQuery:
+    """Fake `google.cloud.bigquery.Client` with simulated latency and failures."""
+
+    def __init__(
+        self,
+        project: str = "fake-project",
+        latency: Latency = constant(0),
+        failures: Iterable[Failure] = (),
+        time_scale: float = 1.0,
+        max_concurrent_jobs: Optional[int] = None,
+        tables: Iterable[str] = (),
+    ):
+        """
+        Instantiate a fake client.
+
+        Queries started while `max_concurrent_jobs` queries are running fail
+        with the quota error BigQuery returns for too many concurrent queries.
+        """
+        self.project = project
+        self.latency = latency
+        self.failures = list(failures)
+        self.time_scale = time_scale
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.tables: Dict[str, List[Dict[str, Any]]] = {table: [] for table in tables}
+        self.timeline: List[JobRecord] = []
+        # number of jobs started with the same key, retried jobs get different latencies
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._started = time.monotonic()
+
+    def now(self) -> float:
+        """Return the seconds since the fake was created."""
+        return time.monotonic() - self._started
+
+    def _start(self, kind: str, query: str = "", destination: Optional[str] = None) -> FakeJob:
+        """Record a new job and decide when it finishes and whether it fails."""
+        with self._lock:
+            attempt = self._attempts.get(job_key(kind, query, destination, 0), 0)
+            self._attempts[job_key(kind, query, destination, 0)] = attempt + 1
+        key = job_key(kind, query, destination, attempt)
+        error = next(
+            (error for error in (failure(kind, query, key) for failure in self.failures) if error),
+            None,
+        )
+        seconds = 0.0 if error else self.latency(kind, query, key) * self.time_scale
+        with self._lock:
+            now = self.now()
+            if self.max_concurrent_jobs is not None and error is None:
+                running = sum(
+                    1
+                    for job in self.timeline
+                    if job.kind == "query" and job.state == "RUNNING" and job.end > now
+                )
+                if running >= self.max_concurrent_jobs:
+                    error = Forbidden(
+                        "Quota exceeded: Your project exceeded quota for concurrent queries"
+                    )
+                    seconds = 0.0
+            record = JobRecord(
+                job_id=f"job_{len(self.timeline)}",
+                kind=kind,
+                query=query,
+                destination=destination,
+                start=now,
+                end=now + seconds,
+                error=error,
+            )
+            self.timeline.append(record)
+        return FakeJob(self, record)
+
+    def query(self, query: str, job_config: Optional[bigquery.QueryJobConfig] = None) -> FakeJob:
+        """Start a query job."""
+        destination = None
+        if job_config is not None and job_config.destination is not None:
+            destination = table_id(job_config.destination)
+        else:
+            created = _CREATE_STATEMENT.search(query)
+            if created:
+                destination = created.group(1)
+        job = self._start("query", query, destination)
+        if destination is None:
+            # results of queries without destination are written to anonymous tables
+            job.record.destination = f"{self.project}._anonymous.{job.job_id}"
+            job.destination = bigquery.TableReference.from_string(job.record.destination)
+        return job
+
+    def load_table_from_json(
+        self,
+        json_rows: Iterable[Dict[str, Any]],
+        destination: Union[str, bigquery.TableReference],
+        job_config: Optional[bigquery.LoadJobConfig] = None,
+    ) -> FakeJob:
+        """Start a job loading rows into a table."""
+        rows = list(json_rows)
+        job = self._start("load", "", table_id(destination))
+        if job.record.error is None:
+            with self._lock:
+                self.tables.setdefault(table_id(destination), []).extend(rows)
+        return job
+
+    def get_table(self, table: Union[str, bigquery.TableReference]) -> bigquery.Table:
+        """Return a table, raising `NotFound` if it doesn't exist."""
+        self._start("get_table", "", table_id(table)).result()
+        with self._lock:
+            if table_id(table) not in self.tables:
+                raise NotFound(f"Not found: Table {table_id(table)}")
+        return bigquery.Table(table_id(table))
+
+    def create_table(
+        self, table: Union[str, bigquery.TableReference, bigquery.Table], exists_ok: bool = False
+    ) -> bigquery.Table:
+        """Create an empty table."""
+        self._start("create_table", "", table_id(table)).result()
+        with self._lock:
+            if table_id(table) in self.tables and not exists_ok:
+                raise Conflict(f"Already Exists: Table {table_id(table)}")
+            self.tables.setdefault(table_id(table), [])
+        return bigquery.Table(table_id(table))
+
+    def delete_table(
+        self, table: Union[str, bigquery.TableReference], not_found_ok: bool = False
+    ) -> None:
+        """Delete a table."""
+        self._start("delete_table", "", table_id(table)).result()
+        with self._lock:
+            if self.tables.pop(table_id(table), None) is None and not not_found_ok:
+                raise NotFound(f"Not found: Table {table_id(table)}")
+
+    def jobs(self, kind: Optional[str] = None, matching: Optional[str] = None) -> List[JobRecord]:
+        """
+        Return the recorded jobs.
+
+        Jobs can be restricted to a kind and to jobs whose query or destination
+        matches a regular expression.
+        """
+        with self._lock:
+            return [
+                job
+                for job in self.timeline
+                if (kind is None or job.kind == kind)
+                and (
+                    matching is None
+                    or re.search(matching, job.query)
+                    or re.search(matching, job.destination or "")
+                )
+            ]
+
+    def max_concurrency(self, kind: Optional[str] = "query", matching: Optional[str] = None) -> int:
+        """Return the maximum number of jobs that ran at the same time."""
+        events = []
+        for job in self.jobs(kind, matching):
+            if job.end > job.start:
+                events += [(job.start, 1), (job.end, -1)]
+        running = maximum = 0
+        # jobs ending at the time another one starts don't overlap
+        for _, change in sorted(events):
+            running += change
+            maximum = max(maximum, running)
+        return maximum
+
+    def summary(self) -> Dict[str, Any]:
+        """Return statistics of the recorded timeline."""
+        jobs = self.jobs()
+        wall_seconds = max((job.end for job in jobs), default=0.0) - min(
+            (job.start for job in jobs), default=0.0
+        )
+        return {
+            "jobs": len(jobs),
+            "queries": len(self.jobs("query")),
+            "failed": sum(1 for job in jobs if job.state == "FAILED"),
+            "cancelled": sum(1 for job in jobs if job.state == "CANCELLED"),
+            "max_concurrency": self.max_concurrency(),
+            "wall_seconds": wall_seconds,
+            "simulated_seconds": wall_seconds / self.time_scale if self.time_scale else 0.0,
+        }
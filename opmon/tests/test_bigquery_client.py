@@ -0,0 +1,269 @@
+import threading
+import time
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+import pytz
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from opmon.bigquery_client import BigQueryClient
+from opmon.costs import BytesBudget
+from opmon.errors import BudgetExceededException
+
+
+@pytest.fixture
+def client():
+    bq_client = BigQueryClient(project="project", dataset="dataset")
+    bq_client._client = MagicMock()
+    return bq_client
+
+
+class TestBigQueryClient:
+    def test_execute_partition(self, client):
+        client.execute(
+            "SELECT 1",
+            destination_table="table$20220102",
+            time_partitioning="submission_date",
+            write_disposition=bigquery.job.WriteDisposition.WRITE_TRUNCATE,
+        )
+
+        assert client.client.query.call_count == 1
+        config = client.client.query.call_args.args[1]
+        assert config.destination.table_id == "table$20220102"
+        assert config.write_disposition == bigquery.job.WriteDisposition.WRITE_TRUNCATE
+
+    def test_execute_partition_range(self, client):
+        staging = bigquery.TableReference.from_string("project.dataset.table_staging")
+        client.client.create_table.return_value.reference = staging
+        client.client.get_table.side_effect = lambda table: bigquery.Table(
+            table,
+            schema=[bigquery.SchemaField(name, "INT64") for name in ["a", "submission_date"]]
+            if table == staging
+            else [bigquery.SchemaField("submission_date", "DATE")],
+        )
+        client.execute(
+            "SELECT 1",
+            destination_table="table",
+            time_partitioning="submission_date",
+            write_disposition=bigquery.job.WriteDisposition.WRITE_TRUNCATE,
+            partition_range=(
+                datetime(2022, 1, 2, tzinfo=pytz.utc),
+                datetime(2022, 1, 5, tzinfo=pytz.utc),
+            ),
+        )
+
+        # the staging table expires in case it doesn't get deleted
+        assert client.client.create_table.call_args.args[0].expires is not None
+        config = client.client.query.call_args_list[0].args[1]
+        assert config.destination == staging
+        assert config.write_disposition == bigquery.job.WriteDisposition.WRITE_TRUNCATE
+
+        # new columns are added before the partitions are replaced in a transaction
+        updated = client.client.update_table.call_args.args[0]
+        assert [field.name for field in updated.schema] == ["submission_date", "a"]
+        assert client.client.query.call_args_list[1].args[0] == (
+            "BEGIN TRANSACTION;\n"
+            + "DELETE FROM `project.dataset.table` WHERE submission_date "
+            + "BETWEEN DATE('2022-01-02') AND DATE('2022-01-05');\n"
+            + "INSERT INTO `project.dataset.table` (`a`, `submission_date`)\n"
+            + "SELECT `a`, `submission_date` FROM `project.dataset.table_staging`;\n"
+            + "COMMIT TRANSACTION;"
+        )
+        client.client.delete_table.assert_called_once_with(staging, not_found_ok=True)
+
+    def test_execute_partition_range_failed(self, client):
+        client.client.query.return_value.result.side_effect = Exception("failed")
+        with pytest.raises(Exception, match="failed"):
+            client.execute(
+                "SELECT 1",
+                destination_table="table",
+                time_partitioning="submission_date",
+                partition_range=(
+                    datetime(2022, 1, 2, tzinfo=pytz.utc),
+                    datetime(2022, 1, 5, tzinfo=pytz.utc),
+                ),
+            )
+
+        # existing partitions are left untouched
+        assert client.client.query.call_count == 1
+        client.client.delete_table.assert_called_once()
+
+    def test_execute_partition_range_new_table(self, client):
+        client.client.get_table.side_effect = NotFound("table")
+        client.execute(
+            "SELECT 1",
+            destination_table="table",
+            time_partitioning="submission_date",
+            partition_range=(
+                datetime(2022, 1, 2, tzinfo=pytz.utc),
+                datetime(2022, 1, 5, tzinfo=pytz.utc),
+            ),
+        )
+
+        assert client.client.query.call_count == 1
+
+    def test_execute_partition_range_requires_table(self, client):
+        with pytest.raises(ValueError):
+            client.execute(
+                "SELECT 1",
+                destination_table="table$20220102",
+                time_partitioning="submission_date",
+                partition_range=(
+                    datetime(2022, 1, 2, tzinfo=pytz.utc),
+                    datetime(2022, 1, 5, tzinfo=pytz.utc),
+                ),
+            )
+
+    def test_execute_multipart(self, client):
+        client.client.query.return_value.destination = bigquery.TableReference.from_string(
+            "project.dataset.part"
+        )
+        client.execute(
+            ["SELECT 1 AS a", "SELECT 2 AS b"],
+            destination_table="table$20220102",
+            join_keys=["client_id", "branch"],
+        )
+
+        assert client.client.query.call_count == 3
+        part = client.client.query.call_args_list[0].args[0]
+        assert "TO_JSON_STRING(STRUCT(client_id, branch)) AS _join_key" in part
+        assert "SELECT 1 AS a" in part
+
+        joined = client.client.query.call_args_list[2].args[0]
+        assert "_1.* EXCEPT(_join_key, client_id, branch)" in joined
+        assert "ON\n  _0._join_key = _1._join_key" in joined
+        assert "IS NULL" not in joined
+        assert client.client.delete_table.call_count == 2
+
+    def test_execute_multipart_requires_join_keys(self, client):
+        with pytest.raises(ValueError):
+            client.execute(["SELECT 1", "SELECT 2"], destination_table="table")
+
+    def test_execute_multipart_concurrently(self, client):
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        def query(sql, config=None):
+            job = MagicMock()
+            job.destination = bigquery.TableReference.from_string("project.dataset.part")
+
+            def result():
+                with lock:
+                    running["current"] += 1
+                    running["max"] = max(running["max"], running["current"])
+                time.sleep(0.05)
+                with lock:
+                    running["current"] -= 1
+
+            job.result.side_effect = result
+            return job
+
+        client.part_parallelism = 3
+        client.client.query.side_effect = query
+        client.execute(
+            [f"SELECT {i} AS a{i}" for i in range(5)],
+            destination_table="table$20220102",
+            join_keys=["client_id"],
+        )
+
+        assert client.client.query.call_count == 6
+        assert running["max"] == 3
+
+    def test_execute_multipart_failure(self, client):
+        jobs = []
+        other_part_started = threading.Event()
+
+        def query(sql, config=None):
+            job = MagicMock()
+            job.destination = bigquery.TableReference.from_string(
+                f"project.dataset.part{len(jobs)}"
+            )
+            job.done.return_value = False
+            if "SELECT 0" in sql:
+
+                def fail():
+                    # fail while another part is running
+                    other_part_started.wait(1)
+                    raise Exception("part failed")
+
+                job.result.side_effect = fail
+            else:
+                job.result.side_effect = lambda: time.sleep(0.05)
+                other_part_started.set()
+            jobs.append(job)
+            return job
+
+        client.part_parallelism = 2
+        client.client.query.side_effect = query
+        with pytest.raises(Exception, match="part failed"):
+            client.execute(
+                [f"SELECT {i} AS a{i}" for i in range(5)],
+                destination_table="table$20220102",
+                join_keys=["client_id"],
+            )
+
+        # the remaining parts are not started and the joined query is not run
+        assert len(jobs) < 5
+        assert all(job.cancel.called for job in jobs)
+        assert client.client.delete_table.call_count == len(jobs)
+
+    def test_execute_budget(self, client):
+        dry_run = MagicMock(total_bytes_processed=100)
+        job = MagicMock(total_bytes_billed=80)
+        client.client.query.side_effect = [dry_run, job]
+        client.budget = BytesBudget(project_bytes=1000)
+
+        client.execute("SELECT 1", destination_table="table", annotations={"slug": "foo"})
+
+        dry_run_config = client.client.query.call_args_list[0].args[1]
+        assert dry_run_config.dry_run
+        config = client.client.query.call_args_list[1].args[1]
+        assert config.maximum_bytes_billed == 1000
+        assert client.budget.billed() == {"foo": 80}
+
+    def test_execute_partition_range_budget(self, client):
+        staging = bigquery.TableReference.from_string("project.dataset.table_staging")
+        client.client.create_table.return_value.reference = staging
+        client.client.get_table.return_value = bigquery.Table(
+            staging, schema=[bigquery.SchemaField("submission_date", "DATE")]
+        )
+        client.client.query.side_effect = [
+            MagicMock(total_bytes_processed=100),
+            MagicMock(total_bytes_billed=80),
+            MagicMock(total_bytes_processed=50),
+            MagicMock(total_bytes_billed=40),
+        ]
+        client.budget = BytesBudget(project_bytes=1000)
+        client.before_execute_callback = MagicMock()
+
+        client.execute(
+            "SELECT 1",
+            destination_table="table",
+            time_partitioning="submission_date",
+            partition_range=(
+                datetime(2022, 1, 2, tzinfo=pytz.utc),
+                datetime(2022, 1, 5, tzinfo=pytz.utc),
+            ),
+            annotations={"slug": "foo"},
+        )
+
+        # the transaction replacing the partitions is charged like the query
+        transaction = client.client.query.call_args_list[3].args[0]
+        assert transaction.startswith("BEGIN TRANSACTION;")
+        assert client.client.query.call_args_list[2].args[1].dry_run
+        assert client.client.query.call_args_list[3].args[1].maximum_bytes_billed is not None
+        assert client.budget.billed() == {"foo": 120}
+        callback_args = client.before_execute_callback.call_args_list
+        assert [args.args[0] for args in callback_args] == ["SELECT 1", transaction]
+        assert callback_args[1].args[2] == {"slug": "foo", "part": "replace"}
+
+    def test_execute_budget_exceeded(self, client):
+        client.client.query.return_value.total_bytes_processed = 2000
+        client.budget = BytesBudget(project_bytes=1000)
+
+        with pytest.raises(BudgetExceededException):
+            client.execute("SELECT 1", annotations={"slug": "foo"})
+        # only the dry run was submitted
+        assert client.client.query.call_count == 1
@@ -0,0 +1,218 @@
+import copy
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from textwrap import dedent
+from typing import Dict, List
+
+import pytest
+import requests
+import toml
+from metric_config_parser.config import ConfigCollection, DefinitionConfig
+from metric_config_parser.definition import DefinitionSpec
+from metric_config_parser.monitoring import MonitoringSpec
+
+from opmon.cache import ResolvedConfigCache, ResponseCache
+from opmon.utils import RetryLimitExceededException, retry_get
+
+CONFIG = dedent(
+    """
+    [project]
+    name = "Test"
+    metrics = ["test"]
+    start_date = "2022-01-01"
+
+    [metrics]
+    [metrics.test]
+    select_expression = "SELECT 1"
+    data_source = "foo"
+    type = "scalar"
+
+    [metrics.test.statistics]
+    sum = {}
+
+    [data_sources]
+    [data_sources.foo]
+    from_expression = "test"
+    """
+)
+
+
+@pytest.fixture
+def spec():
+    return MonitoringSpec.from_dict(toml.loads(CONFIG))
+
+
+class ExperimenterStandIn(BaseHTTPRequestHandler):
+    body = json.dumps([{"slug": "test"}]).encode("utf-8")
+    etag = '"v1"'
+    received: List[Dict[str, str]] = []
+    fail = False
+
+    def do_GET(self):
+        type(self).received.append(dict(self.headers))
+        if type(self).fail:
+            self.send_response(500)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", self.etag)
+            self.send_header("Content-Length", str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    ExperimenterStandIn.received = []
+    ExperimenterStandIn.fail = False
+    httpd = HTTPServer(("127.0.0.1", 0), ExperimenterStandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/api/v6/experiments/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResolvedConfigCache(directory=tmp_path / "configs")
+
+
+class TestResolvedConfigCache:
+    def test_get_or_resolve(self, cache, spec):
+        calls = []
+
+        def resolve():
+            calls.append(1)
+            return copy.deepcopy(spec).resolve(experiment=None, configs=ConfigCollection())
+
+        config = cache.get_or_resolve([spec, None], resolve)
+        cached = cache.get_or_resolve([spec, None], resolve)
+
+        assert len(calls) == 1
+        assert cached.project.name == config.project.name
+        assert [m.metric.name for m in cached.metrics] == [m.metric.name for m in config.metrics]
+
+    def test_key_changes_with_inputs(self, spec):
+        other = MonitoringSpec.from_dict(toml.loads(CONFIG))
+        assert ResolvedConfigCache.key([spec]) == ResolvedConfigCache.key([other])
+
+        other.project.name = "changed"
+        assert ResolvedConfigCache.key([spec]) != ResolvedConfigCache.key([other])
+
+    def test_collection_key(self, cache):
+        def collection(select_expression):
+            definition = DefinitionSpec.from_dict(
+                {"metrics": {"test": {"select_expression": select_expression}}}
+            )
+            return ConfigCollection(
+                definitions=[DefinitionConfig("firefox_desktop", definition, datetime(2022, 1, 1))]
+            )
+
+        configs = collection("SELECT 1")
+        assert cache.collection_key(configs) == cache.collection_key(collection("SELECT 1"))
+        # changed definitions invalidate resolved configs
+        assert cache.collection_key(configs) != cache.collection_key(collection("SELECT 2"))
+        assert cache.collection_key(configs) != cache.collection_key(ConfigCollection())
+
+    def test_disabled(self, spec):
+        cache = ResolvedConfigCache(directory=None)
+        calls = []
+
+        def resolve():
+            calls.append(1)
+            return copy.deepcopy(spec).resolve(experiment=None, configs=ConfigCollection())
+
+        cache.get_or_resolve([spec], resolve)
+        cache.get_or_resolve([spec], resolve)
+        assert len(calls) == 2
+
+    def test_corrupt_entry(self, cache, spec):
+        key = cache.key([spec])
+        cache.directory.mkdir(parents=True)
+        (cache.directory / f"{key}.pickle").write_bytes(b"not a pickle")
+
+        assert cache.get(key) is None
+        assert not (cache.directory / f"{key}.pickle").exists()
+
+    def test_evict(self, tmp_path, spec):
+        cache = ResolvedConfigCache(
+            directory=tmp_path / "configs", max_entries=2, max_age=timedelta(days=1)
+        )
+        config = spec.resolve(experiment=None, configs=ConfigCollection())
+        for i in range(4):
+            cache.put(f"entry{i}", config)
+        now = time.time()
+        for i in range(4):
+            os.utime(cache.directory / f"entry{i}.pickle", (now - i * 60, now - i * 60))
+        os.utime(cache.directory / "entry0.pickle", (now - 2 * 86400, now - 2 * 86400))
+
+        cache.evict()
+
+        assert sorted(p.name for p in cache.directory.glob("*.pickle")) == [
+            "entry1.pickle",
+            "entry2.pickle",
+        ]
+
+
+class TestResponseCache:
+    def test_fresh_response_not_refetched(self, tmp_path, server):
+        cache = ResponseCache(directory=tmp_path, max_age=timedelta(minutes=5))
+
+        assert retry_get(requests.Session(), server, 1, cache=cache) == [{"slug": "test"}]
+        assert retry_get(requests.Session(), server, 1, cache=cache) == [{"slug": "test"}]
+        assert len(ExperimenterStandIn.received) == 1
+
+    def test_stale_response_revalidated(self, tmp_path, server):
+        cache = ResponseCache(directory=tmp_path, max_age=timedelta(0))
+
+        assert retry_get(requests.Session(), server, 1, cache=cache) == [{"slug": "test"}]
+        assert retry_get(requests.Session(), server, 1, cache=cache) == [{"slug": "test"}]
+
+        assert len(ExperimenterStandIn.received) == 2
+        assert "If-None-Match" not in ExperimenterStandIn.received[0]
+        assert ExperimenterStandIn.received[1]["If-None-Match"] == '"v1"'
+        assert cache.get(server).etag == '"v1"'
+
+    def test_user_agent_per_request(self, tmp_path, server):
+        cache = ResponseCache(directory=tmp_path, max_age=timedelta(0))
+        session = requests.Session()
+
+        retry_get(session, server, 1, user_agent="opmon", cache=cache)
+        retry_get(session, server, 1, user_agent="opmon", cache=cache)
+
+        assert [headers["user-agent"] for headers in ExperimenterStandIn.received] == [
+            "opmon",
+            "opmon",
+        ]
+        assert ExperimenterStandIn.received[1]["If-None-Match"] == '"v1"'
+        # the shared session isn't modified
+        assert session.headers["User-Agent"] != "opmon"
+
+    def test_fallback_to_cached_response(self, tmp_path, server, monkeypatch):
+        monkeypatch.setattr(time, "sleep", lambda _: None)
+        cache = ResponseCache(directory=tmp_path, max_age=timedelta(0))
+        retry_get(requests.Session(), server, 1, cache=cache)
+
+        ExperimenterStandIn.fail = True
+        assert retry_get(requests.Session(), server, 2, cache=cache) == [{"slug": "test"}]
+        assert len(ExperimenterStandIn.received) == 3
+
+    def test_no_cached_response(self, tmp_path, server, monkeypatch):
+        monkeypatch.setattr(time, "sleep", lambda _: None)
+        cache = ResponseCache(directory=tmp_path)
+        ExperimenterStandIn.fail = True
+
+        with pytest.raises(RetryLimitExceededException):
+            retry_get(requests.Session(), server, 2, cache=cache)
+        assert cache.get(server) is None
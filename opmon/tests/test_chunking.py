@@ -0,0 +1,77 @@
+from metric_config_parser.data_source import DataSource
+from metric_config_parser.metric import Metric
+
+from opmon.chunking import (
+    DATA_SOURCE_COST,
+    MAX_METRIC_QUERY_COST,
+    metric_cost,
+    plan_chunks,
+)
+
+
+def _metrics(data_source, count, select_expression="SUM(1)"):
+    source = DataSource(name=data_source, from_expression=data_source)
+    return [
+        Metric(
+            name=f"{data_source}_{i}",
+            data_source=source,
+            select_expression=select_expression,
+        )
+        for i in range(count)
+    ]
+
+
+def _names(chunk):
+    return {source: [m.name for m in metrics] for source, metrics in chunk.items()}
+
+
+class TestChunking:
+    def test_single_chunk(self):
+        metrics_per_dataset = {"a": _metrics("a", 5), "b": _metrics("b", 5)}
+        chunks = plan_chunks(metrics_per_dataset)
+
+        assert len(chunks) == 1
+        assert _names(chunks[0]) == _names(metrics_per_dataset)
+
+    def test_no_metrics(self):
+        assert plan_chunks({}) == [{}]
+
+    def test_data_sources_not_split(self):
+        # 3 sources with 30 metrics each, iteration order chunking would split 2 of them
+        metrics_per_dataset = {source: _metrics(source, 30) for source in ["a", "b", "c"]}
+        chunks = plan_chunks(metrics_per_dataset)
+
+        assert len(chunks) == 3
+        assert sorted(list(chunk) for chunk in chunks) == [["a"], ["b"], ["c"]]
+
+    def test_large_data_source_split_evenly(self):
+        metrics_per_dataset = {"a": _metrics("a", 130)}
+        chunks = plan_chunks(metrics_per_dataset)
+
+        assert len(chunks) == 3
+        assert [len(chunk["a"]) for chunk in chunks] == [44, 43, 43]
+        assert sorted(m.name for c in chunks for m in c["a"]) == sorted(
+            m.name for m in metrics_per_dataset["a"]
+        )
+
+    def test_small_sources_packed(self):
+        metrics_per_dataset = {
+            "a": _metrics("a", 40),
+            "b": _metrics("b", 2),
+            "c": _metrics("c", 45),
+            "d": _metrics("d", 2),
+        }
+        chunks = plan_chunks(metrics_per_dataset)
+
+        assert len(chunks) == 2
+        for chunk in chunks:
+            cost = sum(metric_cost(m) for metrics in chunk.values() for m in metrics)
+            assert cost + DATA_SOURCE_COST * len(chunk) <= MAX_METRIC_QUERY_COST
+
+    def test_expensive_metrics(self):
+        cheap = _metrics("a", 1)[0]
+        expensive = _metrics("a", 1, "(SELECT SUM(v) FROM UNNEST(values))")[0]
+        assert metric_cost(expensive) > metric_cost(cheap)
+
+        metrics_per_dataset = {"a": _metrics("a", 20, "(SELECT SUM(v) FROM UNNEST(values))")}
+        assert len(plan_chunks(metrics_per_dataset)) > 1
@@ -0,0 +1,58 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from click.testing import CliRunner
+from metric_config_parser.monitoring import MonitoringSpec
+
+from opmon import cli
+from opmon.dryrun import DryRunFailedError, DryRunFailures
+
+
+@pytest.fixture
+def config_files(tmp_path):
+    files = []
+    for slug in ["foo", "bar", "baz"]:
+        config_file = tmp_path / f"{slug}.toml"
+        config_file.write_text('[project]\nplatform = "firefox_desktop"\nmetrics = []\n')
+        files.append(str(config_file))
+    return files
+
+
+@pytest.fixture
+def validated(monkeypatch):
+    loader = MagicMock()
+    loader.with_configs_from.return_value = loader
+    loader.configs.get_platform_definitions.side_effect = lambda platform: MonitoringSpec()
+    monkeypatch.setattr(cli, "ConfigLoader", loader)
+    monkeypatch.setattr(cli.ExperimentCollection, "from_experimenter", MagicMock())
+
+    lock = threading.Lock()
+    calls = []
+
+    def validate(config, config_getter, experiment, before_execute_callback):
+        with lock:
+            calls.append((config.slug, config_getter))
+        if config.slug == "bar":
+            raise DryRunFailures(
+                [DryRunFailedError("invalid", "SELECT a"), DryRunFailedError("invalid", "SELECT b")]
+            )
+
+    monkeypatch.setattr(cli, "validate", validate)
+    return loader, calls
+
+
+class TestValidateConfig:
+    @pytest.mark.parametrize("parallelism", ["1", "3"])
+    def test_validate_config(self, config_files, validated, parallelism):
+        loader, calls = validated
+        result = CliRunner().invoke(cli.validate_config, ["-p", parallelism] + config_files)
+
+        assert result.exit_code == 1
+        assert sorted(slug for slug, _ in calls) == ["bar", "baz", "foo"]
+        # repositories are loaded once and shared by all files
+        assert all(getter is loader for _, getter in calls)
+        assert loader.with_configs_from.call_count == 2
+        # all failures are reported
+        assert result.output.count("Error evaluating SQL") == 2
+        assert "   1 SELECT b" in result.output
@@ -1,6 +1,7 @@
+from metric_config_parser.config import ConfigCollection
 from metric_config_parser.monitoring import MonitoringSpec
 
-from opmon.config import ConfigLoader
+from opmon.config import ConfigLoader, with_stable_order
 
 
 class TestConfigLoader:
@@ -41,3 +42,23 @@ class TestConfigLoader:
 
     def test_get_nonexisting_data_source(self):
         assert ConfigLoader.configs.get_data_source_definition("non_existing", "foo") is None
+
+
+def test_with_stable_order():
+    spec = {
+        "project": {
+            "metrics": ["b", "a", "c"],
+            "population": {"data_source": "foo", "dimensions": ["y", "x"]},
+        },
+        "metrics": {
+            name: {"select_expression": "1", "data_source": "foo", "statistics": {"sum": {}}}
+            for name in ["a", "b", "c"]
+        },
+        "dimensions": {name: {"select_expression": "1", "data_source": "foo"} for name in "xy"},
+        "data_sources": {"foo": {"from_expression": "foo"}},
+    }
+    config = with_stable_order(
+        MonitoringSpec.from_dict(spec).resolve(experiment=None, configs=ConfigCollection())
+    )
+    assert [summary.metric.name for summary in config.metrics] == ["a", "b", "c"]
+    assert [dimension.name for dimension in config.dimensions] == ["x", "y"]
@@ -0,0 +1,107 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+import pytz
+from google.cloud.exceptions import NotFound
+
+from opmon.costs import (
+    BytesBudget,
+    CostHistory,
+    parse_bytes,
+    relative_costs,
+    unusual_costs,
+)
+from opmon.errors import BudgetExceededException
+
+TB = 1024**4
+
+
+class TestBytesBudget:
+    def test_parse_bytes(self):
+        assert parse_bytes("10TB") == 10 * TB
+        assert parse_bytes("1.5 gb") == int(1.5 * 1024**3)
+        assert parse_bytes("100") == 100
+        with pytest.raises(ValueError):
+            parse_bytes("10 TiB")
+
+    def test_unlimited(self):
+        budget = BytesBudget()
+        assert budget.charge("foo", 5 * TB) is None
+        budget.settle("foo", 5 * TB, 4 * TB)
+        assert budget.billed() == {"foo": 4 * TB}
+        assert budget.estimated() == {"foo": 5 * TB}
+
+    def test_project_budget(self):
+        budget = BytesBudget(project_bytes=10 * TB)
+        assert budget.charge("foo", 4 * TB) == 10 * TB
+        # the estimate is charged until the job finished
+        assert budget.charge("foo", 4 * TB) == 6 * TB
+        budget.settle("foo", 4 * TB, 1 * TB)
+
+        with pytest.raises(BudgetExceededException, match="foo"):
+            budget.charge("foo", 6 * TB)
+        assert budget.charge("bar", 6 * TB) == 10 * TB
+        assert budget.billed() == {"foo": 5 * TB, "bar": 6 * TB}
+
+    def test_run_budget(self):
+        budget = BytesBudget(project_bytes=10 * TB, run_bytes=12 * TB)
+        budget.charge("foo", 8 * TB)
+        assert budget.charge("bar", 3 * TB) == 4 * TB
+        # jobs without project only count towards the run budget
+        assert budget.charge(None, 1 * TB) == 1 * TB
+        with pytest.raises(BudgetExceededException):
+            budget.charge("baz", 1)
+
+
+class TestCostHistory:
+    def test_usual_bytes(self):
+        client = MagicMock()
+        client.query.return_value.result.return_value = [
+            {"slug": "foo", "billed_bytes": 1},
+            {"slug": "foo", "billed_bytes": 5},
+            {"slug": "foo", "billed_bytes": 3},
+            {"slug": "bar", "billed_bytes": 2},
+        ]
+        history = CostHistory("project", "dataset", client=client)
+
+        assert history.usual_bytes(datetime(2022, 1, 5, tzinfo=pytz.utc)) == {"foo": 3, "bar": 2}
+        query = client.query.call_args.args[0]
+        assert "`project.dataset.costs_v1`" in query
+        assert "submission_date < DATE('2022-01-05')" in query
+
+    def test_usual_bytes_without_history(self):
+        client = MagicMock()
+        client.query.return_value.result.side_effect = NotFound("table")
+        history = CostHistory("project", "dataset", client=client)
+        assert history.usual_bytes(datetime(2022, 1, 5, tzinfo=pytz.utc)) == {}
+
+    def test_write(self):
+        client = MagicMock()
+        budget = BytesBudget()
+        budget.charge("foo", 10)
+        budget.settle("foo", 10, 8)
+        budget.charge(None, 1)
+
+        CostHistory("project", "dataset", client=client).write(
+            datetime(2022, 1, 5, tzinfo=pytz.utc), budget
+        )
+
+        rows, table_id = client.load_table_from_json.call_args.args
+        assert table_id == "project.dataset.costs_v1"
+        assert rows == [
+            {
+                "submission_date": "2022-01-05",
+                "slug": "foo",
+                "estimated_bytes": 10,
+                "billed_bytes": 8,
+            }
+        ]
+
+    def test_relative_costs(self):
+        assert relative_costs({}) == {}
+        assert relative_costs({"a": 1, "b": 2, "c": 8}) == {"a": 0.5, "b": 1.0, "c": 4.0}
+
+    def test_unusual_costs(self):
+        usual = {"a": 10, "b": 10}
+        assert unusual_costs({"a": 15, "b": 30, "c": 100}, usual) == [("b", 30, 10)]
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from opmon import dryrun
+from opmon.dryrun import DryRunFailedError, DryRunFailures, dry_run_query
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = MagicMock()
+    lock = threading.Lock()
+    running = {"current": 0, "max": 0}
+
+    def post(url, headers, data):
+        query = json.loads(data)["query"]
+        with lock:
+            running["current"] += 1
+            running["max"] = max(running["max"], running["current"])
+        time.sleep(0.02)
+        with lock:
+            running["current"] -= 1
+
+        response = MagicMock()
+        if "invalid" in query:
+            response.json.return_value = {
+                "valid": False,
+                "errors": [{"code": 400, "message": f"Syntax error in {query}"}],
+            }
+        elif "CREATE" in query:
+            response.json.return_value = {
+                "valid": False,
+                "errors": [
+                    {
+                        "code": 403,
+                        "message": "does not have bigquery.tables.create permission for dataset",
+                    }
+                ],
+            }
+        else:
+            response.json.return_value = {"valid": True}
+        return response
+
+    session.post.side_effect = post
+    session.running = running
+    monkeypatch.setattr(dryrun, "_session", session)
+    dryrun.clear_cache()
+    yield session
+    dryrun.clear_cache()
+
+
+class TestDryRun:
+    def test_valid(self, session):
+        dry_run_query("SELECT 1")
+        dry_run_query("CREATE VIEW foo AS SELECT 1")
+        assert session.post.call_count == 2
+
+    def test_invalid(self, session):
+        with pytest.raises(DryRunFailedError, match="Syntax error") as e:
+            dry_run_query("SELECT invalid")
+        assert e.value.sql == "SELECT invalid"
+
+    def test_cached(self, session):
+        dry_run_query("SELECT 1")
+        dry_run_query("SELECT 1")
+        with pytest.raises(DryRunFailedError):
+            dry_run_query("SELECT invalid")
+        with pytest.raises(DryRunFailedError):
+            dry_run_query("SELECT invalid")
+        assert session.post.call_count == 2
+
+    def test_request_errors_not_cached(self, session):
+        session.post.side_effect = requests.exceptions.ConnectionError("unreachable")
+        with pytest.raises(DryRunFailedError, match="unreachable"):
+            dry_run_query("SELECT 1")
+        with pytest.raises(DryRunFailedError):
+            dry_run_query("SELECT 1")
+        assert session.post.call_count == 2
+
+    def test_multiple_queries(self, session):
+        dry_run_query([f"SELECT {i}" for i in range(16)])
+
+        queries = [json.loads(c.kwargs["data"])["query"] for c in session.post.call_args_list]
+        assert sorted(queries) == sorted(f"SELECT {i}" for i in range(16))
+        assert 1 < session.running["max"] <= dryrun.DEFAULT_DRY_RUN_PARALLELISM
+
+    def test_all_failures_reported(self, session):
+        with pytest.raises(DryRunFailures) as e:
+            dry_run_query(["SELECT invalid_1", "SELECT 1", "SELECT invalid_2"])
+        assert [failure.sql for failure in e.value.failures] == [
+            "SELECT invalid_1",
+            "SELECT invalid_2",
+        ]
+
+        with pytest.raises(DryRunFailedError):
+            dry_run_query(["SELECT invalid_1", "SELECT 1"])
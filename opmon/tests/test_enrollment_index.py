@@ -0,0 +1,106 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytz
+
+from opmon.enrollment_index import plan_enrollment_indexes, uses_enrollment_index
+from opmon.scheduler import Scheduler, enrollment_index_task, monitoring_tasks
+
+SUBMISSION_DATE = datetime(2022, 1, 5, tzinfo=pytz.utc)
+
+
+class TestEnrollmentIndex:
+    def test_uses_enrollment_index(self, monitoring_factory):
+        assert uses_enrollment_index(monitoring_factory("rollout").config)
+        assert uses_enrollment_index(
+            monitoring_factory(
+                "experiment", population={"branches": ["control", "treatment"]}
+            ).config
+        )
+        assert not uses_enrollment_index(
+            monitoring_factory("entire", population={"monitor_entire_population": True}).config
+        )
+        assert not uses_enrollment_index(monitoring_factory("build", xaxis="build_id").config)
+
+    def test_plan_enrollment_indexes(self, monitoring_factory):
+        rollout = monitoring_factory("rollout")
+        experiment = monitoring_factory(
+            "experiment", population={"branches": ["control", "treatment"]}
+        )
+        release = monitoring_factory("release", population={"channel": "release"})
+        entire = monitoring_factory("entire", population={"monitor_entire_population": True})
+
+        indexes = plan_enrollment_indexes([rollout, experiment, release, entire], SUBMISSION_DATE)
+
+        assert len(indexes) == 1
+        index = indexes[0]
+        assert index.slugs == ["rollout", "experiment"]
+        assert index.clients
+        assert index.table_id.startswith("test.test_derived.enrollment_index_")
+        assert rollout.enrollment_index is index
+        assert experiment.enrollment_index is index
+        assert release.enrollment_index is None
+        assert entire.enrollment_index is None
+        assert rollout.shared_tables(SUBMISSION_DATE) == [index.table_id]
+
+        sql = index.sql()
+        assert "CLUSTER BY\n  slug" in sql
+        assert "UNNEST(experiments) AS experiment" in sql
+        assert '"rollout",\n        "experiment"' in sql
+        assert "COUNT(*) AS pings" in sql
+
+    def test_population_from_enrollment_index(self, monitoring_factory):
+        rollout = monitoring_factory("rollout")
+        experiment = monitoring_factory(
+            "experiment", population={"branches": ["control", "treatment"]}
+        )
+        index = plan_enrollment_indexes([rollout, experiment], SUBMISSION_DATE)[0]
+
+        sql = experiment._get_metrics_sql(SUBMISSION_DATE, first_run=True)
+        assert f'`{index.table_id}`\n    WHERE\n        slug = "experiment"' in sql
+        assert "mozfun.map.get_key" not in sql
+
+        sql = rollout._get_metrics_sql(SUBMISSION_DATE, first_run=True)
+        assert "IF(enrolled_pings < pings, 'disabled', NULL)" in sql
+        assert "mozfun.map.get_key" not in sql
+
+        # the index only contains the date it was planned for
+        sql = rollout._get_metrics_sql(datetime(2022, 1, 6, tzinfo=pytz.utc), first_run=True)
+        assert index.table_id not in sql
+        assert "mozfun.map.get_key" in sql
+
+    def test_population_after_failed_enrollment_index(self, monitoring_factory):
+        rollout = monitoring_factory("rollout")
+        experiment = monitoring_factory(
+            "experiment", population={"branches": ["control", "treatment"]}
+        )
+        index = plan_enrollment_indexes([rollout, experiment], SUBMISSION_DATE)[0]
+
+        client = MagicMock()
+        client.execute.side_effect = Exception("index failed")
+        index_tasks = {index.table_id: enrollment_index_task(index, client)}
+        metrics_sql = []
+        tasks = list(index_tasks.values())
+        for monitoring in [rollout, experiment]:
+            project_tasks = monitoring_tasks(monitoring, SUBMISSION_DATE, index_tasks)
+            project_tasks[0].run = lambda m=monitoring: metrics_sql.append(
+                m._get_metrics_sql(SUBMISSION_DATE, first_run=True)
+            )
+            tasks += project_tasks[:1]
+
+        results = Scheduler(parallelism=4).run(tasks)
+
+        # projects derive their population from the pings instead
+        assert all(results.values())
+        assert index.failed
+        assert rollout.shared_tables(SUBMISSION_DATE) == []
+        assert len(metrics_sql) == 2
+        assert all(index.table_id not in sql for sql in metrics_sql)
+        assert all("mozfun.map.get_key" in sql for sql in metrics_sql)
+
+    def test_dimensions_not_indexed(self, monitoring_factory):
+        rollout = monitoring_factory(
+            "rollout", population={"dimensions": ["os"]}, dimensions=["os"]
+        )
+        other = monitoring_factory("other")
+        assert plan_enrollment_indexes([rollout, other], SUBMISSION_DATE) == []
@@ -3,6 +3,7 @@ import json
 from datetime import timedelta
 from unittest.mock import MagicMock
 
+import attr
 import pytest
 import pytz
 from metric_config_parser.experiment import Channel
@@ -316,7 +317,7 @@ FENIX_EXPERIMENT_FIXTURE = """
 
 @pytest.fixture
 def mock_session():
-    def experimenter_fixtures(url):
+    def experimenter_fixtures(url, headers=None):
         mocked_value = MagicMock()
         if url == ExperimentCollection.EXPERIMENTER_API_URL_V1:
             mocked_value.json.return_value = json.loads(EXPERIMENTER_FIXTURE_V1)
@@ -339,8 +340,9 @@ def experiment_collection(mock_session):
 
 def test_from_experimenter(mock_session):
     collection = ExperimentCollection.from_experimenter(mock_session)
-    mock_session.get.assert_any_call(ExperimentCollection.EXPERIMENTER_API_URL_V1)
-    mock_session.get.assert_any_call(ExperimentCollection.EXPERIMENTER_API_URL_V6)
+    headers = {"user-agent": ExperimentCollection.USER_AGENT}
+    mock_session.get.assert_any_call(ExperimentCollection.EXPERIMENTER_API_URL_V1, headers=headers)
+    mock_session.get.assert_any_call(ExperimentCollection.EXPERIMENTER_API_URL_V6, headers=headers)
     assert len(collection.experiments) == 6
     assert isinstance(collection.experiments[0], Experiment)
     assert isinstance(collection.experiments[0].branches[0], Branch)
@@ -370,6 +372,35 @@ def test_with_slug(experiment_collection):
     assert experiment is None
 
 
+def test_with_slug_first_match(experiment_collection):
+    first = experiment_collection.experiments[0]
+    duplicate = attr.evolve(first, normandy_slug="other")
+    collection = ExperimentCollection([first, duplicate] + experiment_collection.experiments[1:])
+
+    assert collection.with_slug(first.normandy_slug) is first
+    assert collection.with_slug("other") is duplicate
+
+
+def test_filtered_collections(experiment_collection):
+    launched = experiment_collection.ever_launched()
+    assert launched is experiment_collection.ever_launched()
+    assert all(ex.status in ("Complete", "Live", None) for ex in launched.experiments)
+
+    rollouts = experiment_collection.rollouts()
+    assert rollouts is experiment_collection.rollouts()
+    assert all(ex.is_rollout for ex in rollouts.experiments)
+
+
+def test_by_app_name(experiment_collection):
+    by_app_name = experiment_collection.by_app_name()
+    assert sum(len(c.experiments) for c in by_app_name.values()) == len(
+        experiment_collection.experiments
+    )
+    assert all(
+        ex.app_name == app_name for app_name, c in by_app_name.items() for ex in c.experiments
+    )
+
+
 def test_convert_experiment_v1_to_experiment():
     experiment_v1 = ExperimentV1(
         slug="test-slug",
@@ -449,3 +480,10 @@ def test_app_name():
     x = ExperimentV6.from_dict(json.loads(FENIX_EXPERIMENT_FIXTURE))
     assert x.appName == "fenix"
     assert x.appId == "org.mozilla.fenix"
+
+
+def test_indexed_collections_equal(experiment_collection):
+    other = ExperimentCollection(list(experiment_collection.experiments))
+    experiment_collection.with_slug("search-topsites")
+    experiment_collection.rollouts()
+    assert experiment_collection == other
@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime
+
+import pytest
+import pytz
+from google.api_core.exceptions import BadRequest, Forbidden
+
+from opmon.bigquery_client import BigQueryClient
+from opmon.logging.bigquery_log_handler import BigQueryLogHandler
+from opmon.scheduler import Scheduler, monitoring_tasks
+from opmon.tests.fake_bigquery import (
+    FakeBigQuery,
+    constant,
+    fail_matching,
+    fail_randomly,
+    job_key,
+    lognormal,
+)
+
+SUBMISSION_DATE = datetime(2022, 1, 5, tzinfo=pytz.utc)
+
+
+class TestFakeBigQuery:
+    def test_random_jobs_reproducible(self):
+        latency = lognormal(median=10, sigma=1, seed=1)
+        failure = fail_randomly(0.5, seed=1)
+        keys = [job_key("query", f"SELECT {i}", None, 0) for i in range(20)]
+
+        latencies = [latency("query", "", key) for key in keys]
+        failures = [failure("query", "", key) is None for key in keys]
+        # values don't depend on the order jobs are started in
+        assert [latency("query", "", key) for key in reversed(keys)] == latencies[::-1]
+        assert [failure("query", "", key) is None for key in reversed(keys)] == failures[::-1]
+        assert len(set(latencies)) == 20
+        assert latency("query", "", job_key("query", "SELECT 0", None, 1)) != latencies[0]
+        assert lognormal(median=10, sigma=1, seed=2)("query", "", keys[0]) != latencies[0]
+
+    def test_job_key_ignores_run_specific_names(self):
+        assert job_key(
+            "query", "SELECT * FROM `project._anonymous.job_12`", "t_staging_0123456789ab", 0
+        ) == job_key(
+            "query", "SELECT * FROM `project._anonymous.job_3`", "t_staging_ba9876543210", 0
+        )
+
+    def test_latency_and_timeline(self):
+        fake = FakeBigQuery(latency=constant(10), time_scale=0.002)
+        jobs = [fake.query(f"SELECT {i}") for i in range(3)]
+        for job in jobs:
+            job.result()
+
+        assert [job.state for job in fake.jobs()] == ["DONE"] * 3
+        assert all(job.seconds == pytest.approx(0.02) for job in fake.jobs())
+        assert fake.max_concurrency() == 3
+        assert fake.summary()["simulated_seconds"] == pytest.approx(10, rel=0.5)
+
+    def test_tables(self):
+        fake = FakeBigQuery(tables=["project.dataset.existing"])
+        client = BigQueryClient(project="project", dataset="dataset", client=fake)
+
+        assert client.table_exists("project.dataset.existing")
+        assert not client.table_exists("project.dataset.missing")
+
+        client.execute("SELECT 1", destination_table="created$20220105")
+        assert client.table_exists("project.dataset.created")
+        client.execute("CREATE OR REPLACE VIEW `project.dataset.view` AS SELECT 1")
+        assert client.table_exists("project.dataset.view")
+
+        client.delete_table("project.dataset.created")
+        assert not client.table_exists("project.dataset.created")
+
+    def test_quota(self):
+        fake = FakeBigQuery(latency=constant(1), time_scale=0.05, max_concurrent_jobs=1)
+        running = fake.query("SELECT 1")
+        with pytest.raises(Forbidden, match="Quota exceeded"):
+            fake.query("SELECT 2").result()
+        running.result()
+        fake.query("SELECT 3").result()
+
+    def test_multipart_parallelism(self):
+        fake = FakeBigQuery(latency=constant(1), time_scale=0.02)
+        client = BigQueryClient(
+            project="project", dataset="dataset", client=fake, part_parallelism=2
+        )
+        client.execute(
+            [f"SELECT {i} AS a{i}" for i in range(5)],
+            destination_table="table$20220105",
+            join_keys=["client_id"],
+        )
+
+        assert len(fake.jobs("query")) == 6
+        assert fake.max_concurrency() == 2
+        # only the joined result remains
+        assert list(fake.tables) == ["project.dataset.table"]
+
+    def test_multipart_failure(self):
+        fake = FakeBigQuery(latency=constant(1), time_scale=0.05, failures=[fail_matching("AS a1")])
+        client = BigQueryClient(
+            project="project", dataset="dataset", client=fake, part_parallelism=2
+        )
+
+        with pytest.raises(BadRequest):
+            client.execute(
+                [f"SELECT {i} AS a{i}" for i in range(4)],
+                destination_table="table$20220105",
+                join_keys=["client_id"],
+            )
+
+        states = [job.state for job in fake.jobs("query")]
+        assert states.count("FAILED") == 1
+        assert "CANCELLED" in states
+        assert len(states) < 4
+        assert fake.tables == {}
+
+    def test_log_handler(self):
+        fake = FakeBigQuery(latency=constant(1), time_scale=0.001)
+        handler = BigQueryLogHandler("project", "dataset", "logs", client=fake, capacity=2)
+        logger = logging.getLogger("test_fake_bigquery")
+        logger.addHandler(handler)
+        try:
+            logger.error("first")
+            logger.error("second")
+        finally:
+            logger.removeHandler(handler)
+
+        assert len(fake.jobs("load")) == 1
+        assert [row["message"] for row in fake.tables["project.dataset.logs"]] == [
+            "first",
+            "second",
+        ]
+
+    def test_scheduler(self, monitoring_factory):
+        fake = FakeBigQuery(latency=lognormal(median=1, sigma=0.5, seed=1), time_scale=0.01)
+        client = BigQueryClient(project="test", dataset="test", client=fake)
+        monitorings = [
+            monitoring_factory(
+                f"project-{i}", population={"monitor_entire_population": True}, client=client
+            )
+            for i in range(4)
+        ]
+        tasks = [task for m in monitorings for task in monitoring_tasks(m, SUBMISSION_DATE)]
+
+        results = Scheduler(parallelism=2).run(tasks)
+
+        assert all(results.values())
+        assert fake.summary()["failed"] == 0
+        # the stage limit applies to each stage separately
+        assert fake.max_concurrency(matching=r"project_\d_v1$") == 2
+        assert {job.kind for job in fake.jobs()} >= {"query", "get_table"}
+
+    def test_failure_isolated_to_project(self, monitoring_factory):
+        fake = FakeBigQuery(failures=[fail_matching("project_0_v1")])
+        client = BigQueryClient(project="test", dataset="test", client=fake)
+        monitorings = [
+            monitoring_factory(
+                f"project-{i}", population={"monitor_entire_population": True}, client=client
+            )
+            for i in range(2)
+        ]
+        tasks = [task for m in monitorings for task in monitoring_tasks(m, SUBMISSION_DATE)]
+
+        results = Scheduler(parallelism=2).run(tasks)
+
+        failed = [name for name, success in results.items() if not success]
+        assert failed and all("project-0" in name for name in failed)
@@ -0,0 +1,187 @@
+from datetime import datetime
+
+import pytest
+import pytz
+from google.cloud import bigquery
+
+from opmon.local_engine import DuckDBEngine, LocalEngineException, translate
+
+
+@pytest.fixture
+def engine(tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    # 4 clients per day, every client sends 3 events with values of 1, 2 and 3
+    duckdb.sql(
+        """
+        SELECT
+            'client' || (i % 4) AS client_id,
+            DATE '2022-01-01' + CAST(i // 12 AS INTEGER) AS submission_date,
+            CAST(i // 4 % 3 + 1 AS DOUBLE) AS value,
+            i % 4 = 0 AS flag
+        FROM range(24) AS t(i)
+        """
+    ).write_parquet(str(data_dir / "test.telemetry.events.parquet"))
+    return DuckDBEngine(project="test", dataset="test", data_dir=data_dir)
+
+
+def _statistics(engine, submission_date):
+    return {
+        (metric, statistic, parameter): (point, lower, upper)
+        for metric, statistic, parameter, point, lower, upper in engine.connection.execute(
+            """
+            SELECT metric, statistic, parameter, point, lower, upper
+            FROM "test.test.local_test_statistics"
+            WHERE submission_date = ?
+            """,
+            [submission_date.date()],
+        ).fetchall()
+    }
+
+
+class TestTranslate:
+    def test_literals_and_identifiers(self):
+        sql = translate('SELECT "it\'s" AS a, `project.dataset.table`.b -- comment\nFROM x')
+        assert sql == "SELECT 'it''s' AS a, \"project.dataset.table\".b \nFROM x"
+
+    def test_functions(self):
+        sql = translate(
+            "SELECT SAFE_CAST(a AS FLOAT64), SAFE_DIVIDE(b, c), LOG(d, 2), COUNTIF(e), "
+            + "mozfun.map.get_key(f, 'key'), DATE_SUB(DATE(g), INTERVAL 1 DAY) FROM x"
+        )
+        assert "TRY_CAST(a AS DOUBLE)" in sql
+        assert "(b) / NULLIF(c, 0)" in sql
+        assert "log(2, d)" in sql
+        assert "count_if(e)" in sql
+        assert "mozfun_map_get_key(f, 'key')" in sql
+        assert "CAST((bq_date(g)) - INTERVAL 1 DAY AS DATE)" in sql
+
+    def test_approx_quantiles(self):
+        sql = translate("SELECT APPROX_QUANTILES(a, 4)[OFFSET(2)] FROM x")
+        assert sql == "SELECT quantile_disc(a, [0.0, 0.25, 0.5, 0.75, 1.0])[1 + (2)] FROM x"
+
+    def test_typed_constructors(self):
+        sql = translate(
+            "SELECT ARRAY<STRUCT<key STRING, value INT64>>[STRUCT('a' AS key, 1 AS value)]"
+        )
+        assert sql == (
+            """SELECT CAST([struct_pack("key" := 'a', "value" := 1)] """
+            + """AS STRUCT("key" VARCHAR, "value" BIGINT)[])"""
+        )
+
+    def test_group_by_aliases(self):
+        sql = translate("SELECT DATE(ts) AS day, COUNT(*) AS n FROM x GROUP BY day")
+        assert sql.endswith("GROUP BY bq_date(ts)\n")
+
+    def test_unnest(self):
+        sql = translate("SELECT a FROM x, UNNEST(x.values) AS a")
+        assert sql == "SELECT a FROM x, (SELECT unnest(x.values) AS a)"
+
+    def test_temporary_functions(self):
+        sql = translate(
+            "CREATE TEMPORARY FUNCTION merge_histogram_values(arrs ANY TYPE) AS ((SELECT 1));\n"
+            + "SELECT merge_histogram_values(a) FROM x"
+        )
+        assert sql.strip() == "SELECT merge_histogram_values(a) FROM x"
+
+        with pytest.raises(LocalEngineException):
+            translate("CREATE TEMPORARY FUNCTION other(a INT64) AS (a); SELECT 1")
+
+    def test_unsupported(self):
+        with pytest.raises(LocalEngineException, match="binomial_percentile"):
+            translate("SELECT `moz-fx-data-shared-prod.udf_js.bootstrap_percentile_ci`(a)")
+        with pytest.raises(LocalEngineException):
+            translate("SELECT KLL_QUANTILES.INIT_FLOAT64(a, 100) FROM x")
+
+
+class TestDuckDBEngine:
+    def test_partitions(self, engine):
+        table_id = "test.test_derived.partitioned"
+        for date, value in [("2022-01-01", 1), ("2022-01-02", 2), ("2022-01-01", 3)]:
+            engine.execute(
+                f"SELECT DATE '{date}' AS submission_date, {value} AS value",
+                destination_table=f"partitioned${date.replace('-', '')}",
+                time_partitioning="submission_date",
+                write_disposition=bigquery.job.WriteDisposition.WRITE_TRUNCATE,
+                dataset="test_derived",
+            )
+
+        assert engine.table_exists(table_id)
+        assert engine.connection.execute(
+            f'SELECT value FROM "{table_id}" ORDER BY submission_date'
+        ).fetchall() == [(3,), (2,)]
+
+        engine.delete_table(table_id)
+        assert not engine.table_exists(table_id)
+
+    def test_multipart(self, engine):
+        engine.execute(
+            [
+                "SELECT 1 AS id, NULL AS key, 'a' AS a",
+                "SELECT 1 AS id, NULL AS key, 'b' AS b",
+            ],
+            destination_table="joined",
+            join_keys=["id", "key"],
+        )
+        assert engine.connection.execute('SELECT * FROM "test.test.joined"').fetchall() == [
+            (1, None, "a", "b")
+        ]
+
+    def test_binomial_percentile_ci(self, engine):
+        # 10 clients in buckets 1 to 4
+        histogram = "{'values': [{'key': 1.0, 'value': 1.0}, {'key': 2.0, 'value': 4.0}, "
+        histogram += "{'key': 3.0, 'value': 3.0}, {'key': 4.0, 'value': 2.0}]}"
+        result = engine.connection.execute(
+            f"SELECT binomial_percentile_ci([90, 50], {histogram}, 'm', 's', 1.96)"
+        ).fetchone()[0]
+
+        # ranks 5 +/- 3.1 and 9 +/- 1.86
+        assert [(r["parameter"], r["point"], r["lower"], r["upper"]) for r in result] == [
+            ("50", 2.0, 2.0, 4.0),
+            ("90", 4.0, 3.0, 4.0),
+        ]
+
+    def test_run(self, engine, monitoring_factory):
+        monitoring = monitoring_factory(
+            "local-test",
+            metrics={
+                "value": "SUM(value)",
+                "flagged": {"select_expression": "COUNTIF(flag)", "statistics": {"sum": {}}},
+            },
+            statistics={"mean": {}, "sum": {}, "count": {}, "binomial_percentile": {}},
+            population={"monitor_entire_population": True},
+            from_expression="`test.telemetry.events`",
+            client=engine,
+        )
+        executed = []
+        engine.before_execute_callback = lambda query, job_config, annotations={}: executed.append(
+            annotations.get("type")
+        )
+
+        for day in [1, 2, 2]:
+            submission_date = datetime(2022, 1, day, tzinfo=pytz.utc)
+            monitoring.run_metrics(submission_date)
+            monitoring.create_metrics_view(submission_date)
+            monitoring.run_statistics(submission_date)
+            monitoring.create_statistics_view(submission_date)
+
+        assert "metrics_query" in executed
+        assert engine.connection.execute(
+            "SELECT submission_date, COUNT(*), SUM(value), SUM(flagged) "
+            + 'FROM "test.test.local_test" GROUP BY submission_date ORDER BY submission_date'
+        ).fetchall() == [
+            (datetime(2022, 1, 1).date(), 4, 24.0, 3),
+            (datetime(2022, 1, 2).date(), 4, 24.0, 3),
+        ]
+
+        statistics = _statistics(engine, datetime(2022, 1, 2))
+        assert statistics[("value", "mean", None)][0] == 6.0
+        assert statistics[("value", "sum", None)][0] == 24.0
+        assert statistics[("value", "count", None)][0] == 4.0
+        assert statistics[("flagged", "sum", None)][0] == 3.0
+        assert {
+            parameter
+            for _, statistic, parameter in statistics
+            if statistic == "binomial_percentile"
+        } == {50.0, 90.0, 99.0}
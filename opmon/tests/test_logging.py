@@ -0,0 +1,97 @@
+import logging
+import time
+
+from opmon.logging import LogConfiguration
+from opmon.logging.bigquery_log_handler import AsyncBigQueryLogHandler
+from opmon.tests.fake_bigquery import FakeBigQuery, constant
+
+
+def _logger(handler):
+    logger = logging.getLogger("test_logging")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    return logger
+
+
+class TestAsyncBigQueryLogHandler:
+    def test_batches(self):
+        fake = FakeBigQuery(latency=constant(0.01))
+        handler = AsyncBigQueryLogHandler("project", "dataset", "logs", client=fake, capacity=3)
+        logger = _logger(handler)
+
+        for i in range(7):
+            logger.warning(f"message {i}")
+        handler.flush()
+
+        messages = [row["message"] for row in fake.tables["project.dataset.logs"]]
+        assert messages == [f"message {i}" for i in range(7)]
+        # at most 3 rows per load job
+        assert len(fake.jobs("load")) >= 3
+        handler.close()
+
+    def test_logging_does_not_block(self):
+        fake = FakeBigQuery(latency=constant(0.3))
+        handler = AsyncBigQueryLogHandler("project", "dataset", "logs", client=fake, capacity=1)
+        logger = _logger(handler)
+
+        start = time.monotonic()
+        for i in range(3):
+            logger.warning(f"message {i}")
+        assert time.monotonic() - start < 0.15
+        handler.close()
+
+    def test_flush_interval(self):
+        fake = FakeBigQuery()
+        handler = AsyncBigQueryLogHandler(
+            "project", "dataset", "logs", client=fake, capacity=100, flush_interval=0.05
+        )
+        logger = _logger(handler)
+
+        logger.warning("message")
+        time.sleep(0.5)
+        assert len(fake.tables["project.dataset.logs"]) == 1
+        handler.close()
+
+    def test_drops_when_full(self):
+        fake = FakeBigQuery(latency=constant(0.2))
+        handler = AsyncBigQueryLogHandler(
+            "project", "dataset", "logs", client=fake, capacity=1, max_queue_size=2
+        )
+        logger = _logger(handler)
+
+        for i in range(10):
+            logger.warning(f"message {i}")
+        handler.close()
+
+        messages = [row["message"] for row in fake.tables["project.dataset.logs"]]
+        assert len(messages) < 10
+        assert any(message.startswith("Dropped") for message in messages)
+
+    def test_close_writes_remaining(self):
+        fake = FakeBigQuery()
+        handler = AsyncBigQueryLogHandler(
+            "project", "dataset", "logs", client=fake, capacity=100, flush_interval=60
+        )
+        logger = _logger(handler)
+
+        logger.error("message")
+        handler.close()
+        logger.error("after close")
+
+        assert [row["message"] for row in fake.tables["project.dataset.logs"]] == ["message"]
+
+    def test_log_configuration(self):
+        fake = FakeBigQuery()
+        LogConfiguration("project", "dataset", "logs", log_to_bigquery=True).setup_logger(fake)
+        handlers = [
+            handler
+            for handler in logging.getLogger().handlers
+            if isinstance(handler, AsyncBigQueryLogHandler)
+        ]
+        try:
+            assert len(handlers) == 1
+        finally:
+            for handler in handlers:
+                logging.getLogger().removeHandler(handler)
+                handler.close()
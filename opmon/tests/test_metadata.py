@@ -0,0 +1,140 @@
+from textwrap import dedent
+from unittest.mock import MagicMock
+
+import pytest
+import toml
+from google.cloud.exceptions import NotFound
+from metric_config_parser.config import ConfigCollection
+from metric_config_parser.monitoring import MonitoringSpec
+
+from opmon.metadata import PROJECTS_SCHEMA, Metadata
+
+
+def _config(name="Test", end_date="2022-03-01"):
+    config_str = dedent(
+        f"""
+        [project]
+        name = "{name}"
+        start_date = "2022-01-01"
+        end_date = "{end_date}"
+        metrics = ["test"]
+
+        [project.population]
+        data_source = "foo"
+        branches = ["control", "treatment"]
+
+        [metrics]
+        [metrics.test]
+        select_expression = "SELECT 1"
+        data_source = "foo"
+
+        [metrics.test.statistics]
+        sum = {{}}
+
+        [data_sources]
+        [data_sources.foo]
+        from_expression = "test"
+        """
+    )
+    spec = MonitoringSpec.from_dict(toml.loads(config_str))
+    return spec.resolve(experiment=None, configs=ConfigCollection())
+
+
+@pytest.fixture
+def client():
+    client = MagicMock()
+    client.client.query.return_value.result.side_effect = NotFound("table")
+    return client
+
+
+def _metadata(client, projects, batch_size=500):
+    return Metadata("project", "dataset", "derived", projects, client=client, batch_size=batch_size)
+
+
+def _loaded_rows(client):
+    return [
+        row for call in client.client.load_table_from_json.call_args_list for row in call.args[0]
+    ]
+
+
+class TestMetadata:
+    def test_project_row(self, client):
+        row = _metadata(client, [])._project_row("foo", _config())
+        assert row["slug"] == "foo"
+        assert row["name"] == "Test"
+        assert row["branches"] == ["control", "treatment"]
+        assert row["summaries"] == [{"statistic": "sum", "metric": "test", "metric_groups": []}]
+        assert row["start_date"] == "2022-01-01"
+        assert row["end_date"] == "2022-03-01"
+        assert row["alerting"] is False
+        assert set(row) == {field.name for field in PROJECTS_SCHEMA}
+
+    def test_fingerprint(self, client):
+        metadata = _metadata(client, [])
+        fingerprint = metadata._project_row("foo", _config())["fingerprint"]
+        assert metadata._project_row("foo", _config())["fingerprint"] == fingerprint
+        assert metadata._project_row("foo", _config(name="Other"))["fingerprint"] != fingerprint
+        assert metadata._project_row("bar", _config())["fingerprint"] != fingerprint
+
+    def test_first_run(self, client):
+        _metadata(client, [("foo", _config()), ("bar", _config())]).write()
+
+        assert sorted(row["slug"] for row in _loaded_rows(client)) == ["bar", "foo"]
+        staging_table = client.client.load_table_from_json.call_args.args[1]
+        assert staging_table.startswith("project.derived.projects_v1_staging_")
+        client.client.delete_table.assert_called_once_with(staging_table, not_found_ok=True)
+        # the staging table expires in case it doesn't get deleted
+        staging = client.client.create_table.call_args.args[0]
+        assert f"{staging.project}.{staging.dataset_id}.{staging.table_id}" == staging_table
+        assert staging.expires is not None
+
+        merge, view = [call.args[0] for call in client.execute.call_args_list]
+        assert "CREATE TABLE IF NOT EXISTS `project.derived.projects_v1`" in merge
+        assert f"USING `{staging_table}` AS source" in merge
+        assert "INSERT (slug, name, xaxis, branches" in merge
+        assert "CREATE OR REPLACE VIEW `project.dataset.projects`" in view
+        assert "SELECT * EXCEPT(fingerprint)" in view
+
+    def test_only_changed_projects_written(self, client):
+        metadata = _metadata(client, [("foo", _config()), ("bar", _config()), ("baz", _config())])
+        fingerprints = {
+            "foo": metadata._project_row("foo", _config())["fingerprint"],
+            "bar": metadata._project_row("bar", _config(name="Old"))["fingerprint"],
+        }
+        client.client.query.return_value.result.side_effect = None
+        client.client.query.return_value.result.return_value = [
+            {"slug": slug, "fingerprint": fingerprint} for slug, fingerprint in fingerprints.items()
+        ]
+
+        metadata.write()
+        assert sorted(row["slug"] for row in _loaded_rows(client)) == ["bar", "baz"]
+
+    def test_unchanged(self, client):
+        metadata = _metadata(client, [("foo", _config())])
+        client.client.query.return_value.result.side_effect = None
+        client.client.query.return_value.result.return_value = [
+            {"slug": "foo", "fingerprint": metadata._project_row("foo", _config())["fingerprint"]}
+        ]
+
+        metadata.write()
+        client.client.load_table_from_json.assert_not_called()
+        client.execute.assert_not_called()
+
+    def test_batches(self, client):
+        projects = [(f"project_{i}", _config()) for i in range(7)]
+        _metadata(client, projects, batch_size=3).write()
+
+        batches = [call.args[0] for call in client.client.load_table_from_json.call_args_list]
+        assert [len(batch) for batch in batches] == [3, 3, 1]
+        # the statement doesn't grow with the number of changed projects
+        assert "project_" not in client.execute.call_args_list[0].args[0]
+
+    def test_ended_projects_skipped(self, client):
+        _metadata(client, [("foo", _config(end_date="2021-12-01"))]).write()
+        client.client.load_table_from_json.assert_not_called()
+
+    def test_staging_table_deleted_on_failure(self, client):
+        client.execute.side_effect = Exception("failed")
+        with pytest.raises(Exception, match="failed"):
+            _metadata(client, [("foo", _config())]).write()
+        client.client.delete_table.assert_called_once()
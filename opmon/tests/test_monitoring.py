@@ -1,9 +1,12 @@
+import re
 from datetime import datetime
 from textwrap import dedent
+from unittest.mock import MagicMock
 
 import pytest
 import pytz
 import toml
+from metric_config_parser.config import ConfigCollection
 from metric_config_parser.monitoring import MonitoringConfiguration, MonitoringSpec
 
 from opmon import errors
@@ -217,3 +220,149 @@ class TestMonitoring:
         assert "org_mozilla_fenix." in monitoring._get_metrics_sql(
             submission_date=datetime(2022, 1, 2, tzinfo=pytz.utc)
         )
+
+    def test_get_metrics_sql_date_range(self):
+        config_str = dedent(
+            """
+            [project]
+            metrics = ["test"]
+            start_date = "2022-01-01"
+
+            [project.population]
+            data_source = "foo"
+
+            [metrics]
+            [metrics.test]
+            select_expression = "SELECT 1"
+            data_source = "foo"
+            type = "scalar"
+
+            [metrics.test.statistics]
+            sum = {}
+
+            [data_sources]
+            [data_sources.foo]
+            from_expression = "test_data_source"
+            """
+        )
+        spec = MonitoringSpec.from_dict(toml.loads(config_str))
+        monitoring = Monitoring(
+            project="test",
+            dataset="test",
+            derived_dataset="test_derived",
+            slug="test-foo",
+            config=spec.resolve(experiment=None, configs=ConfigCollection()),
+        )
+        assert monitoring.supports_date_ranges()
+
+        sql = monitoring._get_metrics_sql(
+            submission_date=datetime(2022, 1, 5, tzinfo=pytz.utc),
+            start_date=datetime(2022, 1, 2, tzinfo=pytz.utc),
+            first_run=True,
+        )
+        assert "BETWEEN DATE('2022-01-02 00:00:00+00:00') AND DATE('2022-01-05" in sql
+        assert "REPLACE(DATE(" not in sql
+
+        sql = monitoring._get_statistics_sql(
+            submission_date=datetime(2022, 1, 5, tzinfo=pytz.utc),
+            start_date=datetime(2022, 1, 2, tzinfo=pytz.utc),
+        )
+        assert 'BETWEEN DATE("2022-01-02 00:00:00+00:00") AND DATE("2022-01-05' in sql
+
+        monitoring._client = MagicMock()
+        monitoring._run_statistics_sql(
+            submission_date=datetime(2022, 1, 5, tzinfo=pytz.utc),
+            start_date=datetime(2022, 1, 2, tzinfo=pytz.utc),
+        )
+        kwargs = monitoring._client.execute.call_args.kwargs
+        assert kwargs["destination_table"] == "test_foo_statistics_v2"
+        assert kwargs["partition_range"] == (
+            datetime(2022, 1, 2, tzinfo=pytz.utc),
+            datetime(2022, 1, 5, tzinfo=pytz.utc),
+        )
+
+    def test_date_range_not_supported_for_build_id(self):
+        config_str = dedent(
+            """
+            [project]
+            metrics = []
+            start_date = "2022-01-01"
+            xaxis = "build_id"
+            """
+        )
+        spec = MonitoringSpec.from_dict(toml.loads(config_str))
+        monitoring = Monitoring(
+            project="test",
+            dataset="test",
+            derived_dataset="test_derived",
+            slug="test-foo",
+            config=spec.resolve(experiment=None, configs=ConfigCollection()),
+        )
+        monitoring._client = MagicMock()
+
+        assert not monitoring.supports_date_ranges()
+        with pytest.raises(errors.ConfigurationException):
+            monitoring._run_statistics_sql(
+                submission_date=datetime(2022, 1, 5, tzinfo=pytz.utc),
+                start_date=datetime(2022, 1, 2, tzinfo=pytz.utc),
+            )
+
+    def test_shared_population_table(self):
+        sources = ["foo", "bar", "baz"]
+        metrics = {
+            f"{source}_{i}": {
+                "select_expression": f"SUM({source}_{i})",
+                "data_source": source,
+                "type": "scalar",
+                "statistics": {"sum": {}},
+            }
+            for source in sources
+            for i in range(30)
+        }
+        spec = MonitoringSpec.from_dict(
+            {
+                "project": {
+                    "metrics": list(metrics),
+                    "start_date": "2022-01-01",
+                    "population": {"data_source": "foo"},
+                },
+                "metrics": metrics,
+                "data_sources": {source: {"from_expression": source} for source in sources},
+            }
+        )
+        monitoring = Monitoring(
+            project="test",
+            dataset="test",
+            derived_dataset="test_derived",
+            slug="test-foo",
+            config=spec.resolve(experiment=None, configs=ConfigCollection()),
+        )
+        monitoring._client = MagicMock()
+        submission_date = datetime(2022, 1, 5, tzinfo=pytz.utc)
+
+        monitoring._run_metrics_sql(submission_date)
+
+        population_sql = monitoring._client.execute.call_args_list[0].args[0]
+        population_table = re.search(
+            r"CREATE OR REPLACE TABLE\n  `(test.test_derived.test_foo_population_20220105_\w{12})`",
+            population_sql,
+        ).group(1)
+        assert "expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 24 HOUR)" in (
+            population_sql
+        )
+
+        parts = monitoring._client.execute.call_args_list[1].args[0]
+        assert len(parts) == 3
+        for part in parts:
+            assert f"FROM\n        `{population_table}`" in part
+            assert "mozfun.map.get_key" not in part
+        monitoring._client.delete_table.assert_called_once_with(population_table)
+
+        # concurrent runs for the same date don't share population tables
+        monitoring._run_metrics_sql(submission_date)
+        assert population_table not in monitoring._client.execute.call_args_list[2].args[0]
+
+        # without a population table every query computes its own population
+        sql = monitoring._get_metrics_sql(submission_date, first_run=True)
+        assert "population_clients AS (" in sql[0]
+        assert "test_foo_population" not in sql[0]
@@ -0,0 +1,238 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+import pytz
+from metric_config_parser.monitoring import MonitoringConfiguration
+
+from opmon.monitoring import Monitoring
+from opmon.scheduler import (
+    Scheduler,
+    Stage,
+    Task,
+    backfill_tasks,
+    monitoring_tasks,
+    parse_stage_parallelism,
+)
+
+
+@pytest.fixture
+def mock_monitoring(monitoring_factory):
+    def factory(xaxis="submission_date", statistic="sum", alert_type="threshold"):
+        alert = {"type": alert_type, "metrics": ["test"]}
+        if alert_type == "threshold":
+            alert["max"] = [1]
+        else:
+            alert.update({"window_size": 3, "max_relative_change": 0.5})
+
+        monitoring = MagicMock(spec=Monitoring)
+        monitoring.slug = "test-foo"
+        monitoring.config = monitoring_factory(
+            metrics={"test": "SELECT 1"},
+            statistics={statistic: {}},
+            alerts={"test_alert": alert},
+            xaxis=xaxis,
+            from_expression="test",
+        ).config
+        return monitoring
+
+    return factory
+
+
+DATES = [datetime(2022, 1, 2, tzinfo=pytz.utc) + timedelta(days=d) for d in range(3)]
+
+
+class TestScheduler:
+    def test_runs_dependencies_first(self):
+        order = []
+        a = Task(name="a", stage=Stage.METRICS, run=lambda: order.append("a"))
+        b = Task(name="b", stage=Stage.STATISTICS, run=lambda: order.append("b"), dependencies=[a])
+        c = Task(name="c", stage=Stage.ALERTS, run=lambda: order.append("c"), dependencies=[b])
+
+        results = Scheduler(parallelism=4).run([c, b, a])
+
+        assert results == {"a": True, "b": True, "c": True}
+        assert order == ["a", "b", "c"]
+
+    def test_failure_skips_dependents(self):
+        def fail():
+            raise Exception("boom")
+
+        ran = []
+        a = Task(name="a", stage=Stage.METRICS, run=fail)
+        b = Task(name="b", stage=Stage.STATISTICS, run=lambda: ran.append("b"), dependencies=[a])
+        c = Task(name="c", stage=Stage.METRICS, run=lambda: ran.append("c"))
+
+        results = Scheduler(parallelism=2).run([a, b, c])
+
+        assert results == {"a": False, "b": False, "c": True}
+        assert ran == ["c"]
+
+    def test_stage_parallelism(self):
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        def work():
+            with lock:
+                running["current"] += 1
+                running["max"] = max(running["max"], running["current"])
+            time.sleep(0.02)
+            with lock:
+                running["current"] -= 1
+
+        tasks = [Task(name=str(i), stage=Stage.METRICS, run=work) for i in range(6)]
+        scheduler = Scheduler(parallelism=8, stage_parallelism={Stage.METRICS: 2})
+        results = scheduler.run(tasks)
+
+        assert all(results.values())
+        assert running["max"] == 2
+
+    def test_longest_critical_path_first(self):
+        order = []
+        short = Task(name="short", stage=Stage.METRICS, run=lambda: order.append("short"))
+        long = Task(name="long", stage=Stage.METRICS, run=lambda: order.append("long"))
+        long_tail = Task(
+            name="long_tail",
+            stage=Stage.STATISTICS,
+            run=lambda: order.append("long_tail"),
+            cost=10,
+            dependencies=[long],
+        )
+
+        Scheduler(parallelism=1, stage_parallelism={Stage.METRICS: 1}).run([short, long, long_tail])
+
+        assert order[0] == "long"
+
+    def test_cyclic_dependencies(self):
+        a = Task(name="a", stage=Stage.METRICS, run=lambda: None)
+        b = Task(name="b", stage=Stage.METRICS, run=lambda: None, dependencies=[a])
+        a.dependencies.append(b)
+
+        with pytest.raises(ValueError):
+            Scheduler().run([a, b])
+
+    def test_monitoring_tasks(self):
+        monitoring = MagicMock(spec=Monitoring)
+        monitoring.slug = "test-foo"
+        monitoring.config = MonitoringConfiguration()
+        date = datetime(2022, 1, 2, tzinfo=pytz.utc)
+
+        tasks = monitoring_tasks(monitoring, date)
+        assert [t.stage for t in tasks] == list(Stage)
+
+        results = Scheduler().run(tasks)
+        assert all(results.values())
+        monitoring.run_metrics.assert_called_once_with(date)
+        monitoring.create_metrics_view.assert_called_once_with(date)
+        monitoring.run_statistics.assert_called_once_with(date)
+        monitoring.create_statistics_view.assert_called_once_with(date)
+        monitoring.run_alerts.assert_called_once_with(date)
+
+    def test_monitoring_tasks_cost_factor(self):
+        monitoring = MagicMock(spec=Monitoring)
+        monitoring.slug = "test-foo"
+        monitoring.config = MonitoringConfiguration()
+        date = datetime(2022, 1, 2, tzinfo=pytz.utc)
+
+        costs = [t.cost for t in monitoring_tasks(monitoring, date)]
+        scaled = [t.cost for t in monitoring_tasks(monitoring, date, cost_factor=3.0)]
+        assert scaled[0] == 3 * costs[0]
+        assert scaled[2] == 3 * costs[2]
+        assert scaled[4] == costs[4]
+
+    def test_parse_stage_parallelism(self):
+        limits = parse_stage_parallelism(8, ["metrics=2", "alerts = 1"])
+        assert limits[Stage.METRICS] == 2
+        assert limits[Stage.ALERTS] == 1
+        assert limits[Stage.STATISTICS] == 8
+
+        with pytest.raises(ValueError):
+            parse_stage_parallelism(8, ["foo=2"])
+
+        with pytest.raises(ValueError):
+            parse_stage_parallelism(8, ["metrics"])
+
+
+class TestBackfillTasks:
+    def _by_name(self, tasks):
+        return {t.name: t for t in tasks}
+
+    def test_submission_date_dates_independent(self, mock_monitoring):
+        tasks = self._by_name(backfill_tasks(mock_monitoring(), DATES))
+
+        assert tasks["test-foo:2022-01-04:metrics"].dependencies == []
+        assert [t.name for t in tasks["test-foo:2022-01-04:statistics"].dependencies] == [
+            "test-foo:2022-01-02:metrics_view",
+            "test-foo:2022-01-04:metrics",
+        ]
+        assert [t.name for t in tasks["test-foo:2022-01-04:alerts"].dependencies] == [
+            "test-foo:2022-01-02:statistics_view",
+            "test-foo:2022-01-04:statistics",
+        ]
+        assert len([t for t in tasks.values() if t.stage == Stage.METRICS_VIEW]) == 1
+
+    def test_build_id_metrics_sequential(self, mock_monitoring):
+        tasks = self._by_name(backfill_tasks(mock_monitoring(xaxis="build_id"), DATES))
+
+        assert tasks["test-foo:2022-01-02:metrics"].dependencies == []
+        assert [t.name for t in tasks["test-foo:2022-01-04:metrics"].dependencies] == [
+            "test-foo:2022-01-03:metrics"
+        ]
+
+    def test_history_dependencies(self, mock_monitoring):
+        tasks = self._by_name(
+            backfill_tasks(mock_monitoring(statistic="percentile", alert_type="avg_diff"), DATES)
+        )
+
+        assert len(tasks["test-foo:2022-01-04:statistics"].dependencies) == 4
+        assert len(tasks["test-foo:2022-01-04:alerts"].dependencies) == 4
+
+    def test_run_backfill(self, mock_monitoring):
+        monitoring = mock_monitoring()
+        results = Scheduler(parallelism=2).run(backfill_tasks(monitoring, DATES))
+
+        assert all(results.values())
+        assert monitoring.run_metrics.call_count == 3
+        assert monitoring.create_metrics_view.call_count == 1
+        assert monitoring.run_alerts.call_count == 3
+
+    def test_no_dates(self, mock_monitoring):
+        assert backfill_tasks(mock_monitoring(), []) == []
+
+    def test_skipped_project(self, monitoring_factory):
+        monitoring = monitoring_factory(skip=True)
+        monitoring._client = MagicMock()
+
+        tasks = backfill_tasks(monitoring, DATES)
+        Scheduler().run(tasks)
+
+        assert tasks == []
+        monitoring._client.execute.assert_not_called()
+
+    def test_days_per_job(self, mock_monitoring):
+        monitoring = mock_monitoring()
+        monitoring.supports_date_ranges.return_value = True
+        dates = DATES + [DATES[-1] + timedelta(days=1)]
+        tasks = self._by_name(backfill_tasks(monitoring, dates, days_per_job=3))
+
+        assert "test-foo:2022-01-02..2022-01-04:metrics" in tasks
+        assert "test-foo:2022-01-05:metrics" in tasks
+        assert [t.name for t in tasks["test-foo:2022-01-03:alerts"].dependencies] == [
+            "test-foo:2022-01-02:statistics_view",
+            "test-foo:2022-01-02..2022-01-04:statistics",
+        ]
+
+        results = Scheduler(parallelism=2).run(list(tasks.values()))
+        assert all(results.values())
+        monitoring.run_metrics.assert_any_call(submission_date=DATES[-1], start_date=DATES[0])
+        monitoring.run_statistics.assert_any_call(submission_date=dates[-1])
+        assert monitoring.run_alerts.call_count == 4
+
+    def test_days_per_job_unsupported(self, mock_monitoring):
+        monitoring = mock_monitoring(xaxis="build_id")
+        monitoring.supports_date_ranges.return_value = False
+        tasks = backfill_tasks(monitoring, DATES, days_per_job=3)
+
+        assert len([t for t in tasks if t.stage == Stage.METRICS]) == 3
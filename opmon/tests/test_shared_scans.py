@@ -0,0 +1,155 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytz
+
+from opmon.enrollment_index import plan_enrollment_indexes
+from opmon.scheduler import (
+    Scheduler,
+    enrollment_index_task,
+    monitoring_tasks,
+    shared_scan_task,
+)
+from opmon.shared_scans import plan_shared_scans, shared_column_name
+
+SUBMISSION_DATE = datetime(2022, 1, 5, tzinfo=pytz.utc)
+
+
+class TestSharedScans:
+    def test_plan_shared_scans(self, monitoring_factory):
+        foo = monitoring_factory("foo", {"a": "SUM(a)", "b": "SUM(b)"})
+        bar = monitoring_factory("bar", {"b2": "SUM(b)", "c": "COUNT(c)"})
+        by_build = monitoring_factory("by-build", {"d": "SUM(d)"}, xaxis="build_id")
+        other = monitoring_factory(
+            "other", {"e": "SUM(e)"}, from_expression="`project.dataset.other`"
+        )
+
+        scans = plan_shared_scans([foo, bar, by_build, other], SUBMISSION_DATE)
+
+        assert len(scans) == 1
+        scan = scans[0]
+        assert scan.slugs == ["foo", "bar"]
+        assert sorted(scan.expressions.values()) == ["COUNT(c)", "SUM(a)", "SUM(b)"]
+        assert scan.table_id.startswith("test.test_derived.shared_scan_")
+        assert scan.table_id.endswith("_20220105")
+        assert foo.shared_scans == {"main": scan}
+        assert bar.shared_scans == {"main": scan}
+        assert by_build.shared_scans == {}
+        assert other.shared_scans == {}
+
+    def test_shared_scan_sql(self, monitoring_factory):
+        foo = monitoring_factory("foo", {"a": "SUM(a)"})
+        bar = monitoring_factory("bar", {"b": "SUM(b)"})
+        scan = plan_shared_scans([foo, bar], SUBMISSION_DATE)[0]
+
+        sql = scan.sql()
+        assert f"CREATE OR REPLACE TABLE\n  `{scan.table_id}`" in sql
+        assert f"SUM(a) AS {shared_column_name('SUM(a)')}" in sql
+        assert f"SUM(b) AS {shared_column_name('SUM(b)')}" in sql
+        assert "FROM\n    `project.dataset.main`" in sql
+        # only clients of the populations of the projects are aggregated
+        assert "AND client_id IN (" in sql
+        assert sql.count("WITH population AS (") == 2
+        assert '"foo"' in sql
+        assert '"bar"' in sql
+
+        metrics_sql = foo._get_metrics_sql(SUBMISSION_DATE, first_run=True)
+        assert f"`{scan.table_id}`" in metrics_sql
+        assert f"{shared_column_name('SUM(a)')} AS a" in metrics_sql
+        assert "`project.dataset.main`\n    RIGHT JOIN" not in metrics_sql
+
+        # scans are only used for the date they were planned for
+        metrics_sql = foo._get_metrics_sql(datetime(2022, 1, 6, tzinfo=pytz.utc), first_run=True)
+        assert scan.table_id not in metrics_sql
+        metrics_sql = foo._get_metrics_sql(
+            SUBMISSION_DATE, first_run=True, start_date=datetime(2022, 1, 2, tzinfo=pytz.utc)
+        )
+        assert scan.table_id not in metrics_sql
+
+    def test_shared_scan_entire_population(self, monitoring_factory):
+        foo = monitoring_factory("foo", {"a": "SUM(a)"})
+        bar = monitoring_factory(
+            "bar", {"b": "SUM(b)"}, population={"monitor_entire_population": True}
+        )
+        scan = plan_shared_scans([foo, bar], SUBMISSION_DATE)[0]
+
+        assert scan.populations() == []
+        assert "client_id IN (" not in scan.sql()
+
+    def test_shared_scan_after_enrollment_index(self, monitoring_factory):
+        foo = monitoring_factory("foo", {"a": "SUM(a)"})
+        bar = monitoring_factory(
+            "bar", {"b": "SUM(b)"}, population={"branches": ["control", "treatment"]}
+        )
+        index = plan_enrollment_indexes([foo, bar], SUBMISSION_DATE)[0]
+        scan = plan_shared_scans([foo, bar], SUBMISSION_DATE)[0]
+
+        assert scan.enrollment_indexes() == [index.table_id]
+        assert f"`{index.table_id}`" in scan.sql()
+        assert "mozfun.map.get_key" not in scan.sql()
+
+        order = []
+        client = MagicMock()
+        client.execute.side_effect = lambda sql, **kwargs: order.append(
+            kwargs["annotations"]["type"]
+        )
+        index_tasks = {index.table_id: enrollment_index_task(index, client)}
+        tasks = [shared_scan_task(scan, client, index_tasks), *index_tasks.values()]
+
+        results = Scheduler(parallelism=4).run(tasks)
+
+        assert all(results.values())
+        assert order == ["enrollment_index_query", "shared_scan_query"]
+
+        # the scan derives the populations from the pings if the index failed
+        index.failed = True
+        assert scan.enrollment_indexes() == []
+        assert index.table_id not in scan.sql()
+        assert "mozfun.map.get_key" in scan.sql()
+
+    def test_metrics_run_after_shared_scan(self, monitoring_factory):
+        foo = monitoring_factory("foo", {"a": "SUM(a)"})
+        bar = monitoring_factory("bar", {"b": "SUM(b)"})
+        scan = plan_shared_scans([foo, bar], SUBMISSION_DATE)[0]
+
+        order = []
+        client = MagicMock()
+        client.execute.side_effect = lambda *args, **kwargs: order.append("scan")
+        scan_tasks = {scan.table_id: shared_scan_task(scan, client)}
+        tasks = list(scan_tasks.values())
+        for monitoring in [foo, bar]:
+            project_tasks = monitoring_tasks(monitoring, SUBMISSION_DATE, scan_tasks)
+            project_tasks[0].run = lambda slug=monitoring.slug: order.append(slug)
+            tasks += project_tasks[:1]
+
+        results = Scheduler(parallelism=4).run(tasks)
+
+        assert all(results.values())
+        assert order[0] == "scan"
+        assert sorted(order[1:]) == ["bar", "foo"]
+
+    def test_metrics_run_after_failed_shared_scan(self, monitoring_factory):
+        foo = monitoring_factory("foo", {"a": "SUM(a)"})
+        bar = monitoring_factory("bar", {"b": "SUM(b)"})
+        scan = plan_shared_scans([foo, bar], SUBMISSION_DATE)[0]
+
+        client = MagicMock()
+        client.execute.side_effect = Exception("scan failed")
+        scan_tasks = {scan.table_id: shared_scan_task(scan, client)}
+        metrics_sql = []
+        tasks = list(scan_tasks.values())
+        for monitoring in [foo, bar]:
+            project_tasks = monitoring_tasks(monitoring, SUBMISSION_DATE, scan_tasks)
+            project_tasks[0].run = lambda m=monitoring: metrics_sql.append(
+                m._get_metrics_sql(SUBMISSION_DATE, first_run=True)
+            )
+            tasks += project_tasks[:1]
+
+        results = Scheduler(parallelism=4).run(tasks)
+
+        # projects read from the data source instead
+        assert all(results.values())
+        assert scan.failed
+        assert len(metrics_sql) == 2
+        assert all(scan.table_id not in sql for sql in metrics_sql)
+        assert all("`project.dataset.main`" in sql for sql in metrics_sql)
@@ -0,0 +1,145 @@
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import pytz
+from metric_config_parser.data_source import DataSource
+from metric_config_parser.metric import Metric
+
+from opmon.errors import StatisticNotImplementedForTypeException
+from opmon.local_engine import translate
+from opmon.statistic import BinomialPercentile, Mean, SketchMean, SketchQuantile
+from opmon.templates import render_template
+
+TEST_DIR = Path(__file__).parent
+
+METRIC = Metric(
+    name="active_hours",
+    data_source=DataSource(name="main", from_expression="main"),
+    select_expression="SUM(active_hours)",
+    type="scalar",
+)
+
+# arguments of `monitoring_factory` for a project computing METRIC by OS
+PROJECT = {
+    "metrics": {"active_hours": "SUM(active_hours)"},
+    "population": {"dimensions": ["os"]},
+    "dimensions": ["os"],
+}
+
+
+class TestStatistic:
+    def test_no_state(self):
+        assert Mean().state(METRIC) is None
+        with pytest.raises(StatisticNotImplementedForTypeException):
+            Mean().merge(METRIC, "state")
+
+    def test_sketch_mean(self):
+        assert "AVG(active_hours) AS point" in SketchMean().compute(METRIC)
+        assert "SUM(SAFE_CAST(active_hours AS FLOAT64)) AS sum" in SketchMean().state(METRIC)
+        assert "SUM(state.sum) / NULLIF(SUM(state.count), 0) AS point" in SketchMean().merge(
+            METRIC, "state"
+        )
+
+    def test_sketch_quantile(self):
+        statistic = SketchQuantile(quantiles=[50, 95])
+        sql = statistic.compute(METRIC)
+        assert sql.count("KLL_QUANTILES.EXTRACT_POINT_FLOAT64") == 2
+        assert "'95' AS parameter" in sql
+        assert statistic.state(METRIC).startswith("KLL_QUANTILES.INIT_FLOAT64(")
+        merged = statistic.merge(METRIC, "state")
+        assert "KLL_QUANTILES.MERGE_POINT_FLOAT64(state, 0.95)" in merged
+
+    def test_sketch_histogram_not_supported(self):
+        histogram = Metric(
+            name="histogram",
+            data_source=DataSource(name="main", from_expression="main"),
+            select_expression="histogram",
+            type="histogram",
+        )
+        with pytest.raises(StatisticNotImplementedForTypeException):
+            SketchQuantile().state(histogram)
+
+    def test_statistics_sql_stores_state(self, monitoring_factory):
+        monitoring = monitoring_factory(statistics={"sketch_mean": {}, "mean": {}}, **PROJECT)
+        sql = monitoring._get_statistics_sql(datetime(2022, 1, 5, tzinfo=pytz.utc))
+        assert "AS active_hours_sketch_mean_state" in sql
+        assert "active_hours_mean_state" not in sql
+
+    def test_rolling_view(self, monitoring_factory):
+        monitoring = monitoring_factory(statistics={"sketch_quantile": {}, "mean": {}}, **PROJECT)
+        sql = monitoring._get_statistics_rolling_view_sql()
+        assert "`test.test.test_foo_statistics_rolling`" in sql
+        assert "KLL_QUANTILES.MERGE_POINT_FLOAT64(active_hours_sketch_quantile_state" in sql
+        assert "UNNEST(active_hours_sketch_quantile) AS statistic" in sql
+        assert "active_hours_mean" not in sql
+        assert "INTERVAL 6 DAY" in sql
+
+        monitoring = monitoring_factory(statistics={"mean": {}}, **PROJECT)
+        assert monitoring._get_statistics_rolling_view_sql() is None
+        monitoring = monitoring_factory(statistics={"sketch_mean": {}}, xaxis="build_id", **PROJECT)
+        assert monitoring._get_statistics_rolling_view_sql() is None
+
+
+@pytest.fixture
+def binomial_percentile_ci():
+    duckdb = pytest.importorskip("duckdb")
+    udf = render_template("binomial_percentile_ci_udf.sql", {})
+    params = re.search(r"(?s)FUNCTION binomial_percentile_ci\((.*?)\) AS", udf).group(1)
+    # the rows of the array the UDF returns are computed by a table macro, DuckDB only
+    # substitutes macro parameters that aren't qualified like `histogram.values`
+    query = re.search(r"(?s)ARRAY\((.*)\)\s*\);\s*$", udf).group(1)
+    query = query.replace("SELECT AS STRUCT", "SELECT").replace(
+        "histogram.values", "histogram['values']"
+    )
+    connection = duckdb.connect()
+    connection.execute(
+        "CREATE MACRO binomial_percentile_ci("
+        + ", ".join(param.split()[0] for param in re.split(r",\s*\n", params.strip()))
+        + f") AS TABLE {translate(query)}"
+    )
+
+    def compute(histogram, percentile, z_score):
+        return connection.execute(
+            "SELECT point, lower, upper "
+            + "FROM binomial_percentile_ci([?], {'values': ?}, 'metric', 'statistic', ?)",
+            [percentile, [{"key": key, "value": value} for key, value in histogram], z_score],
+        ).fetchone()
+
+    return compute
+
+
+class TestBinomialPercentile:
+    def test_compute(self):
+        statistic = BinomialPercentile(percentiles=[50, 99])
+        sql = statistic.compute(METRIC)
+        assert "binomial_percentile_ci(" in sql
+        assert "[50, 99]" in sql
+        assert '"binomial_percentile"' in sql
+        assert "active_hours_buckets" in sql
+        assert "udf_js" not in sql
+        assert statistic.z_score == pytest.approx(1.96, abs=0.001)
+
+    def test_statistics_sql(self, monitoring_factory):
+        monitoring = monitoring_factory(statistics={"binomial_percentile": {}}, **PROJECT)
+        sql = monitoring._get_statistics_sql(datetime(2022, 1, 5, tzinfo=pytz.utc))
+        assert "CREATE TEMPORARY FUNCTION binomial_percentile_ci(" in sql
+        assert "AS active_hours_buckets" in sql
+
+    def test_matches_bootstrap(self, binomial_percentile_ci):
+        fixtures = json.loads((TEST_DIR / "data" / "percentile_ci.json").read_text())["fixtures"]
+        z_score = BinomialPercentile().z_score
+        for fixture in fixtures:
+            keys = [key for key, _ in fixture["histogram"]]
+            point, lower, upper = binomial_percentile_ci(
+                fixture["histogram"], fixture["percentile"], z_score
+            )
+            bootstrap = fixture["bootstrap"]
+
+            assert point == bootstrap["point"]
+            assert lower <= point <= upper
+            # intervals differ by at most one bucket from the bootstrapped intervals
+            assert abs(keys.index(lower) - keys.index(bootstrap["lower"])) <= 1
+            assert abs(keys.index(upper) - keys.index(bootstrap["upper"])) <= 1
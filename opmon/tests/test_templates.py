@@ -0,0 +1,46 @@
+from typing import Any, Dict
+
+from opmon import templates
+from opmon.templates import (
+    COMPILED_TEMPLATES_ENV_VAR,
+    compile_templates,
+    render_template,
+)
+
+RENDER_KWARGS: Dict[str, Any] = {
+    "header": "-- test",
+    "gcp_project": "project",
+    "dataset": "dataset",
+    "derived_dataset": "derived_dataset",
+    "normalized_slug": "slug",
+    "table_version": 1,
+    "config": {"xaxis": {"value": "submission_date"}},
+}
+
+
+class TestTemplates:
+    def test_environment_shared(self):
+        assert templates.environment() is templates.environment()
+
+    def test_template_cached(self):
+        env = templates.environment()
+        assert env.get_template("where_clause.sql") is env.get_template("where_clause.sql")
+
+    def test_compiled_templates(self, tmp_path, monkeypatch):
+        expected = render_template("metric_view.sql", RENDER_KWARGS)
+        compile_templates(tmp_path)
+        assert len(list(tmp_path.glob("*.py"))) > 0
+
+        # source templates must not be parsed once compiled templates are available
+        sources = tmp_path / "sources"
+        sources.mkdir()
+        (sources / "metric_view.sql").write_text("poisoned")
+        monkeypatch.setattr(templates, "TEMPLATE_FOLDER", sources)
+
+        monkeypatch.setenv(COMPILED_TEMPLATES_ENV_VAR, str(tmp_path))
+        assert render_template("metric_view.sql", RENDER_KWARGS) == expected
+        assert templates.environment(tmp_path) is not templates.environment()
+
+    def test_missing_compiled_templates(self, tmp_path, monkeypatch):
+        monkeypatch.setenv(COMPILED_TEMPLATES_ENV_VAR, str(tmp_path / "missing"))
+        assert "SELECT" in render_template("metric_view.sql", RENDER_KWARGS)
@@ -0,0 +1,162 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from google.cloud.exceptions import NotFound
+
+from opmon.monitoring import Monitoring
+from opmon.views import (
+    ViewSync,
+    _PendingView,
+    normalize_view_query,
+    parse_view,
+    view_fingerprint,
+)
+
+VIEW = """-- Generated via opmon
+
+CREATE OR REPLACE VIEW
+  `project.dataset.foo`
+AS
+SELECT
+    *
+FROM
+    `project.derived.foo_v1`
+"""
+
+
+def _view(name, table="foo_v1"):
+    return VIEW.replace("dataset.foo", f"dataset.{name}").replace("foo_v1", table)
+
+
+@pytest.fixture
+def bigquery():
+    bigquery = MagicMock()
+    bigquery.client.query.return_value.result.return_value = [
+        {"table_name": "foo", "view_definition": "\nSELECT * FROM `project.derived.foo_v1`"},
+        {"table_name": "bar", "view_definition": "SELECT * FROM `project.derived.bar_v1`"},
+    ]
+    return bigquery
+
+
+class TestViews:
+    def test_normalize_view_query(self):
+        assert normalize_view_query("\n  SELECT\n  *  -- all\nFROM foo;\n") == "SELECT * FROM foo"
+        assert normalize_view_query("(\n SELECT * FROM foo\n)") == "SELECT * FROM foo"
+        assert normalize_view_query("(SELECT 1) UNION ALL (SELECT 2)") == (
+            "(SELECT 1) UNION ALL (SELECT 2)"
+        )
+        # literals are left untouched
+        assert normalize_view_query("SELECT  'a  -- b'  AS `c  d` -- e\nFROM foo") == (
+            "SELECT 'a  -- b' AS `c  d` FROM foo"
+        )
+        assert view_fingerprint("SELECT 'a  b'") != view_fingerprint("SELECT 'a b'")
+
+    def test_parse_view(self):
+        view_id, query = parse_view(VIEW)
+        assert view_id == "project.dataset.foo"
+        assert view_fingerprint(query) == view_fingerprint("SELECT * FROM `project.derived.foo_v1`")
+        with pytest.raises(ValueError):
+            parse_view("SELECT 1")
+
+    def test_unchanged_views_skipped(self, bigquery):
+        views = ViewSync(bigquery)
+        assert views.create(_view("foo")) is False
+        assert views.create(_view("bar", table="bar_v1")) is False
+        bigquery.execute.assert_not_called()
+        # deployed views are read once per dataset
+        assert bigquery.client.query.call_count == 1
+        assert "`project.dataset`.INFORMATION_SCHEMA.VIEWS" in bigquery.client.query.call_args[0][0]
+
+    def test_changed_views_created(self, bigquery):
+        views = ViewSync(bigquery)
+        assert views.create(_view("foo", table="foo_v2"), {"slug": "foo"}) is True
+        assert views.create(_view("baz")) is True
+        assert [c.args[0] for c in bigquery.execute.call_args_list] == [
+            _view("foo", table="foo_v2"),
+            _view("baz"),
+        ]
+        assert bigquery.execute.call_args_list[0].kwargs["annotations"] == {"slug": "foo"}
+
+        # created views are up to date
+        assert views.create(_view("foo", table="foo_v2")) is False
+        assert bigquery.execute.call_count == 2
+
+    def test_before_execute_callback(self, bigquery):
+        views = ViewSync(bigquery)
+        views.create(_view("foo"), {"slug": "foo"})
+        bigquery.before_execute_callback.assert_called_once_with(
+            _view("foo"), None, {"slug": "foo"}
+        )
+
+        # changed views are passed on by executing them
+        bigquery.before_execute_callback.reset_mock()
+        views.create(_view("bar"), {"slug": "bar"})
+        bigquery.before_execute_callback.assert_not_called()
+        bigquery.execute.assert_called_once_with(_view("bar"), annotations={"slug": "bar"})
+
+    def test_missing_dataset(self, bigquery):
+        bigquery.client.query.return_value.result.side_effect = NotFound("dataset")
+        assert ViewSync(bigquery).create(_view("foo")) is True
+
+    def test_changes_batched(self, bigquery):
+        started = threading.Event()
+        release = threading.Event()
+        scripts = []
+
+        def execute(sql, annotations={}):
+            scripts.append(sql)
+            started.set()
+            release.wait(5)
+
+        bigquery.execute.side_effect = execute
+        views = ViewSync(bigquery)
+        threads = [threading.Thread(target=views.create, args=(_view("first"),))]
+        threads[0].start()
+        started.wait(5)
+
+        # views queued while the first script runs are created by a single script
+        for name in ["a", "b", "c"]:
+            threads.append(threading.Thread(target=views.create, args=(_view(name),)))
+            threads[-1].start()
+        while len(views._pending) < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert len(scripts) == 2
+        assert scripts[1].count("CREATE OR REPLACE VIEW") == 3
+
+    def test_failing_view_in_batch(self, bigquery):
+        def execute(sql, annotations={}):
+            if "invalid" in sql:
+                raise Exception("invalid view")
+
+        bigquery.execute.side_effect = execute
+        batch = [_PendingView(_view("valid"), {}), _PendingView(_view("invalid"), {})]
+        ViewSync(bigquery)._execute(batch)
+
+        assert all(view.done for view in batch)
+        assert batch[0].error is None
+        assert str(batch[1].error) == "invalid view"
+        # the script failed, views were created one by one
+        assert bigquery.execute.call_count == 3
+
+    def test_monitoring_views(self, bigquery):
+        views = ViewSync(bigquery)
+        monitoring = Monitoring(
+            project="project",
+            dataset="dataset",
+            derived_dataset="derived",
+            slug="foo",
+            config=MagicMock(),
+            client=bigquery,
+            views=views,
+        )
+        monitoring._create_view(_view("foo"), {"slug": "foo"})
+        bigquery.execute.assert_not_called()
+
+        monitoring.views = None
+        monitoring._create_view(_view("foo"), {"slug": "foo"})
+        bigquery.execute.assert_called_once_with(_view("foo"), annotations={"slug": "foo"})
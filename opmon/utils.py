@@ -1,16 +1,21 @@
 """Utility methods."""
 
+import json
 import logging
 import re
 import shutil
 import tempfile
 import time
 from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 from typing import Any, Optional
 
+import pytz
 from requests import Session
 
+from opmon.cache import CachedResponse, ResponseCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,27 +45,67 @@ class RetryLimitExceededException(Exception):
 
 
 def retry_get(
-    session: Session, url: str, max_retries: int, user_agent: Optional[str] = None
+    session: Session,
+    url: str,
+    max_retries: int,
+    user_agent: Optional[str] = None,
+    cache: Optional[ResponseCache] = None,
 ) -> Any:
     """
     Call an API and automatically retry if there was an error.
 
     This is handy for working with the Experimenter API which occassionally
     experiences some issues and returns a failure code.
+
+    If a response cache is provided, fresh cached responses are returned without
+    any request, stale ones are revalidated with a conditional request and are
+    returned if all retries fail.
     """
+    cached = cache.get(url) if cache else None
+    if cache and cached and cached.is_fresh(cache.max_age):
+        return json.loads(cached.body)
+
+    # headers are passed per request, the session may be shared by threads
+    headers = {"user-agent": user_agent} if user_agent else {}
+    if cached:
+        headers.update(cached.conditional_headers())
+
     # based on https://stackoverflow.com/a/22726782
     for _i in range(max_retries):
         try:
-            if user_agent:
-                session.headers.update({"user-agent": user_agent})
-
-            blob = session.get(url).json()
+            if cache is None:
+                blob = session.get(url, headers=headers).json()
+                break
+
+            response = session.get(url, headers=headers)
+            if cached and response.status_code == 304:
+                body = cached.body
+            else:
+                response.raise_for_status()
+                body = response.text
+
+            blob = json.loads(body)
+            cache.put(
+                CachedResponse(
+                    url=url,
+                    body=body,
+                    fetched_at=datetime.now(pytz.utc),
+                    etag=response.headers.get("ETag", cached.etag if cached else None),
+                    last_modified=response.headers.get(
+                        "Last-Modified", cached.last_modified if cached else None
+                    ),
+                )
+            )
             break
         except Exception as e:
             print(e)
             logger.info(f"Error fetching from {url}. Retrying...")
             time.sleep(1)
     else:
+        if cached:
+            logger.warning(f"Too many retries for {url}. Using cached response.")
+            return json.loads(cached.body)
+
         exception = RetryLimitExceededException(f"Too many retries for {url}")
 
         logger.exception(exception.__str__(), exc_info=exception)
@@ -0,0 +1,177 @@
+"""Create views only if their definitions changed.
+
+Every run re-creates the metrics, statistics and alerts views of each project,
+although their definitions only change with the config of a project or with
+`SCHEMA_VERSIONS`. The deployed definitions of all views in a dataset are read
+once with a single query to `INFORMATION_SCHEMA.VIEWS` and compared with the
+rendered views by a fingerprint of their normalized query. Unchanged views are
+skipped.
+
+Views that did change are created by scripts. While a script is running,
+views of other projects that need to be created are queued and created by the
+next script, so that concurrently finishing projects share a single job.
+"""
+
+import hashlib
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import attr
+from google.cloud.exceptions import NotFound
+
+from .bigquery_client import BigQueryClient
+
+VIEW_STATEMENT = re.compile(
+    r"CREATE\s+OR\s+REPLACE\s+VIEW\s+`([^`]+)`\s+AS\s+(.*)", re.IGNORECASE | re.DOTALL
+)
+# string literals, quoted identifiers and comments
+_TOKENS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|--[^\n]*")
+
+
+def _enclosed(sql: str) -> bool:
+    """Return whether the SQL is enclosed by a single pair of parentheses."""
+    if not sql.startswith("(") or not sql.endswith(")"):
+        return False
+    depth = 0
+    for i, char in enumerate(sql):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return i == len(sql) - 1
+    return False
+
+
+def normalize_view_query(query: str) -> str:
+    """
+    Return the query of a view without comments, redundant whitespace and parentheses.
+
+    String literals and quoted identifiers are left untouched.
+    """
+    parts = []
+    unquoted = ""
+    position = 0
+    for match in _TOKENS.finditer(query):
+        start, end = match.span()
+        unquoted += query[position:start]
+        position = end
+        if match.group().startswith("--"):
+            unquoted += " "
+        else:
+            parts += [re.sub(r"\s+", " ", unquoted), match.group()]
+            unquoted = ""
+    parts.append(re.sub(r"\s+", " ", unquoted + query[position:]))
+    query = "".join(parts).strip().rstrip(";").strip()
+    while _enclosed(query):
+        query = query[1:-1].strip()
+    return query
+
+
+def view_fingerprint(query: str) -> str:
+    """Return the fingerprint of the normalized query of a view."""
+    return hashlib.sha256(normalize_view_query(query).encode("utf-8")).hexdigest()
+
+
+def parse_view(sql: str) -> Tuple[str, str]:
+    """Return the ID and the query of the view created by a `CREATE OR REPLACE VIEW` statement."""
+    match = VIEW_STATEMENT.search(sql)
+    if not match:
+        raise ValueError("SQL does not create a view")
+    return match.group(1), match.group(2)
+
+
+@attr.s(auto_attribs=True)
+class _PendingView:
+    sql: str
+    annotations: Dict[str, Any]
+    done: bool = False
+    error: Optional[Exception] = None
+
+
+@attr.s(auto_attribs=True)
+class ViewSync:
+    """Create views whose definitions differ from the deployed ones, shared by all projects."""
+
+    bigquery: BigQueryClient
+    # fingerprints of the deployed views keyed by dataset ID and view name
+    _deployed: Dict[str, Dict[str, str]] = attr.ib(factory=dict, init=False)
+    _pending: List[_PendingView] = attr.ib(factory=list, init=False)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+    _script_lock: threading.Lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    def deployed(self, dataset_id: str) -> Dict[str, str]:
+        """Return the fingerprints of the views in a dataset, keyed by view name."""
+        with self._lock:
+            if dataset_id not in self._deployed:
+                query = (
+                    "SELECT table_name, view_definition "
+                    + f"FROM `{dataset_id}`.INFORMATION_SCHEMA.VIEWS"
+                )
+                try:
+                    rows = self.bigquery.client.query(query).result()
+                    self._deployed[dataset_id] = {
+                        row["table_name"]: view_fingerprint(row["view_definition"]) for row in rows
+                    }
+                except NotFound:
+                    self._deployed[dataset_id] = {}
+            return self._deployed[dataset_id]
+
+    def create(self, sql: str, annotations: Dict[str, Any] = {}) -> bool:
+        """
+        Create a view unless the deployed view has the same definition.
+
+        Returns whether the view was created. Blocks until the script creating
+        the view finished and raises its error if the view couldn't be created.
+        """
+        view_id, query = parse_view(sql)
+        dataset_id, view_name = view_id.rsplit(".", 1)
+        fingerprint = view_fingerprint(query)
+
+        if self.deployed(dataset_id).get(view_name) == fingerprint:
+            # the SQL is passed on like for every other query, even if it doesn't get executed
+            if callable(self.bigquery.before_execute_callback):
+                self.bigquery.before_execute_callback(sql, None, annotations)
+            return False
+
+        pending = _PendingView(sql, annotations)
+        with self._lock:
+            self._pending.append(pending)
+
+        # views queued while another script was running are created together
+        with self._script_lock:
+            if not pending.done:
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                self._execute(batch)
+
+        if pending.error is not None:
+            raise pending.error
+
+        with self._lock:
+            self._deployed.setdefault(dataset_id, {})[view_name] = fingerprint
+        return True
+
+    def _execute(self, batch: List[_PendingView]) -> None:
+        """Create a batch of views with a single script."""
+        try:
+            if len(batch) == 1:
+                self.bigquery.execute(batch[0].sql, annotations=batch[0].annotations)
+            else:
+                # the views are passed on individually, the script isn't annotated with a project
+                if callable(self.bigquery.before_execute_callback):
+                    for view in batch:
+                        self.bigquery.before_execute_callback(view.sql, None, view.annotations)
+                script = ";\n\n".join(view.sql.strip().rstrip(";") for view in batch) + ";"
+                self.bigquery.execute(script, annotations={"type": "views"})
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                # create views one by one, so only invalid views fail
+                for view in batch:
+                    self._execute([view])
+        finally:
+            for view in batch:
+                view.done = True
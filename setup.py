@@ -11,6 +11,7 @@ def text_from_file(path):
 
 test_dependencies = [
     "coverage",
+    "duckdb",
     "isort",
     "jsonschema",
     "pytest",
@@ -31,6 +32,7 @@ test_dependencies = [
 
 extras = {
     "testing": test_dependencies,
+    "duckdb": ["duckdb"],
 }
 
 